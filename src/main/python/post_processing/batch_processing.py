@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""Post-processing of many BEAM output folders at once, e.g. the runs of a sensitivity analysis.
+
+The output folders found under the given directories are processed in parallel worker processes, sharing the same
+ReferenceData. Runs are started as long as their estimated memory fits in the memory available. The outcome of each
+run is recorded in an index file. Runs that have already been processed are skipped, so an interrupted batch can be
+resumed.
+"""
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import fixed_data_visualization
+from dataframe_cache import file_signature, write_json
+from fixed_data_visualization import COMPETITION, ITERS, SUBMISSION_INPUTS, ReferenceData, ResultFiles
+
+INDEX_FILE = "post_processing_index.json"
+# Rough ratio between the memory used to post-process a run and the size of its compressed events file
+EVENTS_MEMORY_FACTOR = 30
+# Rough ratio between the memory used by each worker process rebuilding the legs of a run and the size of its
+# compressed events file: the workers are forked, and copy the pages of the parent process they touch
+LEGS_WORKER_MEMORY_FACTOR = 10
+# Share of the available memory used by the runs processed simultaneously
+MEMORY_FRACTION = 0.8
+
+
+def is_output_folder(path):
+    """ Whether a directory is the output folder of a BEAM run that can be post-processed """
+    return (path / ITERS).is_dir() and (path / COMPETITION / SUBMISSION_INPUTS).is_dir()
+
+
+def find_output_folders(roots):
+    """ Find the output folders of the BEAM runs under some directories
+
+    Parameters
+    ----------
+    roots: list of pathlib.Path objects
+        Output folders, or directories containing output folders at any depth
+
+    Returns
+    -------
+    output_folders: list of pathlib.Path objects
+        Absolute paths of the output folders, sorted
+    """
+    output_folders = set()
+    for root in roots:
+        for directory, subdirectories, _ in os.walk(str(root)):
+            if is_output_folder(Path(directory)):
+                output_folders.add(Path(directory).resolve())
+                # the iterations of a run are not searched
+                subdirectories[:] = []
+    return sorted(output_folders)
+
+
+def events_file(output_folder, iteration):
+    """ Events file of an iteration: the csv events if they were written, the xml events otherwise """
+    iteration_folder = output_folder / ITERS / "it.{0}".format(iteration)
+    csv_path = iteration_folder / "{0}.events.csv.gz".format(iteration)
+    return csv_path if csv_path.exists() else iteration_folder / "{0}.events.xml.gz".format(iteration)
+
+
+def last_iteration(output_folder):
+    """ Last iteration of a run with an events file, None if there is none """
+    iterations = []
+    for iteration_folder in (output_folder / ITERS).glob("it.*"):
+        iteration = iteration_folder.name[len("it."):]
+        if iteration.isdigit() and events_file(output_folder, int(iteration)).exists():
+            iterations.append(int(iteration))
+    return max(iterations) if iterations else None
+
+
+def available_memory():
+    """ Memory available to new processes in bytes, None if it cannot be determined """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_memory(output_folder, iteration, legs_workers=1):
+    """ Estimated memory needed to post-process an iteration of a run with `legs_workers` worker processes rebuilding
+    its legs, in bytes """
+    size = events_file(output_folder, iteration).stat().st_size
+    legs_memory = LEGS_WORKER_MEMORY_FACTOR * legs_workers * size if legs_workers > 1 else 0
+    return EVENTS_MEMORY_FACTOR * size + legs_memory
+
+
+def load_index(index_path):
+    """ Load the index of the runs processed, empty if it does not exist yet
+
+    Returns
+    -------
+    index: dictionary
+        {output folder: {"iteration", "status", "events", "duration_sec", "finished_at", "error"}}
+    """
+    try:
+        with open(str(index_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_processed(index, output_folder, iteration):
+    """ Whether an iteration of a run was processed successfully, and its events have not changed since """
+    entry = index.get(str(output_folder))
+    if entry is None or entry.get("status") != "processed" or entry.get("iteration") != iteration:
+        return False
+    signature = file_signature(events_file(output_folder, iteration), entry.get("events"))
+    return signature["sha1"] == entry["events"]["sha1"]
+
+
+def _init_worker(reference_data_memo):
+    # the reference data loaded by the parent process is shared by the runs of the worker
+    fixed_data_visualization._REFERENCE_DATA_MEMO.update(reference_data_memo)
+
+
+def process_run(output_folder, iteration, reference_data, legs_workers=None):
+    """ Post-process an iteration of a run and export its csv files into its output folder
+
+    Parameters
+    ----------
+    output_folder: pathlib.Path object
+
+    iteration: int
+
+    reference_data: ReferenceData
+
+    legs_workers: int, optional
+        Maximum number of worker processes rebuilding the legs of the run, the number of CPUs by default
+
+    Returns
+    -------
+    entry: dictionary
+        Entry of the run in the index
+    """
+    start = time.time()
+    entry = {"iteration": iteration, "events": file_signature(events_file(output_folder, iteration))}
+    try:
+        result_files = ResultFiles(output_folder, iteration, reference_data, export_csv=True,
+                                   legs_workers=legs_workers)
+        result_files.writer.close()
+        entry["status"] = "processed"
+    except Exception:
+        entry["status"] = "failed"
+        entry["error"] = traceback.format_exc()
+    entry["duration_sec"] = round(time.time() - start, 1)
+    entry["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return entry
+
+
+def failed_run_entry(output_folder, iteration, start, error):
+    """ Entry in the index of a run whose worker process died, e.g. killed when running out of memory """
+    return {"iteration": iteration,
+            "events": file_signature(events_file(output_folder, iteration)),
+            "status": "failed",
+            "error": error,
+            "duration_sec": round(time.time() - start, 1),
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def process_runs(roots, reference_data, iteration=None, index_path=None, max_workers=None, memory_limit=None,
+                 force=False, legs_workers=None):
+    """ Post-process the runs found under some directories in parallel, skipping the runs already processed
+
+    Parameters
+    ----------
+    roots: list of pathlib.Path objects
+        Output folders, or directories containing output folders
+
+    reference_data: ReferenceData
+
+    iteration: int, optional
+        Iteration to post-process, the last iteration of each run by default
+
+    index_path: pathlib.Path object, optional
+        Index of the runs processed, `post_processing_index.json` in the first directory by default
+
+    max_workers: int, optional
+        Maximum number of runs processed simultaneously, the number of CPUs by default
+
+    memory_limit: int, optional
+        Memory that the runs processed simultaneously may use, in bytes. Defaults to a share of the memory available
+
+    force: bool
+        Whether the runs already processed are processed again
+
+    legs_workers: int, optional
+        Maximum number of worker processes rebuilding the legs of each run. By default, the CPUs are shared by the
+        runs processed simultaneously
+
+    Returns
+    -------
+    index: dictionary
+        Index of the runs processed, also written to `index_path`
+    """
+    index_path = Path(index_path) if index_path is not None else Path(roots[0]) / INDEX_FILE
+    index = load_index(index_path)
+    max_workers = max_workers or os.cpu_count() or 1
+    legs_workers = legs_workers or max(1, (os.cpu_count() or 1) // max_workers)
+    if memory_limit is None:
+        memory = available_memory()
+        memory_limit = memory * MEMORY_FRACTION if memory is not None else float("inf")
+
+    pending = []
+    for output_folder in find_output_folders(roots):
+        run_iteration = iteration if iteration is not None else last_iteration(output_folder)
+        if run_iteration is None or not events_file(output_folder, run_iteration).exists():
+            print("Skipping {0}: no events file".format(output_folder))
+        elif not force and is_processed(index, output_folder, run_iteration):
+            print("Skipping {0}: already processed".format(output_folder))
+        else:
+            pending.append((output_folder, run_iteration, estimate_memory(output_folder, run_iteration, legs_workers)))
+    print("{0} runs to process".format(len(pending)))
+    if not pending:
+        return index
+
+    # the reference data used by the runs is loaded once, and copied into the worker processes
+    for name in ["route_ids", "trip_to_route", "fuel_costs"]:
+        getattr(reference_data, name)
+    executor = None
+    try:
+        running = {}
+        while pending or running:
+            # a pool broken by the death of one of its processes is replaced
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=min(max_workers, len(pending)), initializer=_init_worker,
+                                               initargs=(dict(fixed_data_visualization._REFERENCE_DATA_MEMO),))
+
+            # the largest runs first, as long as they fit in the memory left. A run is always started when none is
+            # running, even if it does not fit
+            memory_used = sum(run[3] for run in running.values())
+            pending.sort(key=lambda run: run[2], reverse=True)
+            for run in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if running and memory_used + run[2] > memory_limit:
+                    continue
+                output_folder, run_iteration, memory = run
+                pending.remove(run)
+                future = executor.submit(process_run, output_folder, run_iteration, reference_data, legs_workers)
+                running[future] = (output_folder, run_iteration, time.time(), memory)
+                memory_used += memory
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                output_folder, run_iteration, start, _ = running.pop(future)
+                try:
+                    entry = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    entry = failed_run_entry(output_folder, run_iteration, start, traceback.format_exc())
+                print("{0}: {1} in {2}s".format(output_folder, entry["status"], entry["duration_sec"]))
+                index[str(output_folder)] = entry
+            if broken:
+                # the other runs of the pool are lost with it
+                for output_folder, run_iteration, start, _ in running.values():
+                    print("{0}: failed, its worker process died".format(output_folder))
+                    index[str(output_folder)] = failed_run_entry(output_folder, run_iteration, start,
+                                                                 "Worker process died")
+                running = {}
+                executor.shutdown()
+                executor = None
+            # the index is written after each run, to resume from there if the batch is interrupted
+            write_json(index_path, index)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return index
+
+
+def run(args):
+    reference_data = ReferenceData(args.sample_size)
+    index = process_runs([Path(root) for root in args.output_dirs], reference_data, iteration=args.iter_number,
+                         index_path=args.index, max_workers=args.max_workers,
+                         memory_limit=args.memory_limit_gb * 1024 ** 3 if args.memory_limit_gb else None,
+                         force=args.force, legs_workers=args.legs_workers)
+    failed = [output_folder for output_folder, entry in index.items() if entry["status"] == "failed"]
+    if failed:
+        print("Failed runs:\n{0}".format("\n".join(failed)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Post-process the outputs of many BISTRO runs in parallel, e.g. of a sensitivity analysis.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("output_dirs", type=str, nargs="+",
+                        help="Output directories, or directories containing output directories.")
+    parser.add_argument("--iter_number", type=int, help="Iteration used to parse data, the last one by default.")
+    parser.add_argument("--sample_size", type=str, default="15k", help="Sample size.")
+    parser.add_argument("--index", type=str, help="Index of the runs processed, in the first directory by default.")
+    parser.add_argument("--max_workers", type=int, help="Maximum number of runs processed simultaneously.")
+    parser.add_argument("--memory_limit_gb", type=float,
+                        help="Memory the runs processed simultaneously may use, a share of the available memory by "
+                             "default.")
+    parser.add_argument("--legs_workers", type=int,
+                        help="Maximum number of processes rebuilding the legs of each run. By default, the CPUs are "
+                             "shared by the runs processed simultaneously.")
+    parser.add_argument("--force", action="store_true", help="Process again the runs already processed.")
+    args = parser.parse_args()
+
+    run(args)
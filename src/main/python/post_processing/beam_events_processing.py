@@ -1,17 +1,33 @@
 # -*- coding: utf-8 -*-
 import argparse
+import gzip
+import hashlib
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 
 from fixed_data_visualization import ResultFiles, ReferenceData
 
 BUCKET_NAME = 'uber-prize-testing-output'
+# Files larger than a part are uploaded in several parts, in parallel
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_THREADS = 8
+# Parts of each file uploaded simultaneously: the files are already uploaded in parallel, by UPLOAD_THREADS threads
+PART_UPLOAD_THREADS = 2
+# Extensions of the dataframe files uploaded: the `.tmp` files of the exports still being written are left out
+UPLOADED_SUFFIXES = ('.csv', '.csv.gz', '.parquet')
 
 
 def process_events(path_output_folder, iter_number, sample_size):
     ref = ReferenceData(sample_size)
-    ResultFiles(path_output_folder, iter_number, ref)
+    result_files = ResultFiles(path_output_folder, iter_number, ref, export_csv=True)
+    # the csv files are uploaded once they are all written
+    result_files.writer.close()
 
 
 def remote_path(args):
@@ -21,24 +37,140 @@ def remote_path(args):
         return "fixed-input/{}/output/".format(args.s3_dest_key)
 
 
+def file_checksums(path, part_size, multipart_threshold):
+    """ MD5 of a file and the ETag that S3 gives to it once uploaded
+
+    Parameters
+    ----------
+    path: pathlib.Path object
+
+    part_size, multipart_threshold: int
+        Size of the parts and minimum size of the files uploaded in several parts
+
+    Returns
+    -------
+    md5, etag: str
+        The ETag of a file uploaded in several parts is the MD5 of the MD5s of its parts, followed by their number
+    """
+    md5 = hashlib.md5()
+    part_digests = []
+    with open(str(path), 'rb') as f:
+        for part in iter(lambda: f.read(part_size), b''):
+            md5.update(part)
+            part_digests.append(hashlib.md5(part).digest())
+    if path.stat().st_size < multipart_threshold:
+        return md5.hexdigest(), md5.hexdigest()
+    return md5.hexdigest(), "{0}-{1}".format(hashlib.md5(b''.join(part_digests)).hexdigest(), len(part_digests))
+
+
+def compress_file(path, folder):
+    """ Gzip a file into a folder. The archive does not record the time of the compression, so that compressing the
+    same file twice gives the same archive (and the same checksum)
+
+    Returns
+    -------
+    : pathlib.Path object
+        Path of the archive
+    """
+    archive_path = Path(folder) / (path.name + ".gz")
+    with open(str(path), 'rb') as f_in, open(str(archive_path), 'wb') as f_out:
+        with gzip.GzipFile(filename=path.name, mode='wb', fileobj=f_out, mtime=0) as gz:
+            shutil.copyfileobj(f_in, gz)
+    return archive_path
+
+
+def is_uploaded(s3_client, bucket, key, md5, etag):
+    """ Whether an object with the same content as a local file already exists in the bucket """
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return head["ETag"].strip('"') == etag or head.get("Metadata", {}).get("md5") == md5
+
+
+def upload_file(s3_client, path, bucket, key, transfer_config, compress=False):
+    """ Upload a file to s3, unless it is already uploaded
+
+    Parameters
+    ----------
+    s3_client: boto3 s3 client
+
+    path: pathlib.Path object
+
+    bucket, key: str
+        Destination of the file. `.gz` is appended to the key of the compressed files
+
+    transfer_config: boto3.s3.transfer.TransferConfig
+        Size of the parts and number of threads of the multipart uploads of the file
+
+    compress: bool
+        Whether the file is gzipped before being uploaded
+
+    Returns
+    -------
+    uploaded: bool
+        False if the file was skipped
+    """
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        if compress:
+            path = compress_file(path, tmp_folder)
+            key += ".gz"
+        md5, etag = file_checksums(path, transfer_config.multipart_chunksize, transfer_config.multipart_threshold)
+        if is_uploaded(s3_client, bucket, key, md5, etag):
+            print("Skipping {0}: already uploaded to s3://{1}/{2}".format(path.name, bucket, key))
+            return False
+        # the MD5 is kept in the metadata, to recognize the file even if it was uploaded with other part sizes
+        s3_client.upload_file(str(path), bucket, key, ExtraArgs={"Metadata": {"md5": md5}}, Config=transfer_config)
+    print("Successfully uploaded {0} to s3://{1}".format(path.name, bucket + '/' + key))
+    return True
+
+
 # 3. upload results to s3
-def upload_results(output_folder, s3_dest_key):
-    s3api = boto3.resource('s3')
+def upload_results(output_folder, s3_dest_key, bucket=BUCKET_NAME, s3_client=None, max_workers=UPLOAD_THREADS,
+                   compress=False):
+    """ Upload the dataframe files (see UPLOADED_SUFFIXES) of an output folder to s3 in parallel, skipping the files
+    already uploaded
+
+    Parameters
+    ----------
+    output_folder: pathlib.Path object
+
+    s3_dest_key: str
+        Prefix of the keys of the files in the bucket
+
+    bucket: str
+
+    s3_client: boto3 s3 client, optional
+        Client used for the uploads, e.g. to upload to another endpoint. A default client is created if not provided
+
+    max_workers: int
+        Number of files uploaded simultaneously. The parts of each file are uploaded by PART_UPLOAD_THREADS threads
+
+    compress: bool
+        Whether the files are gzipped before being uploaded
 
-    for f in Path(output_folder).iterdir():
-        if 'dataframe' in f.name:
-            print("Uploading: {}".format({f.name}))
-            resp = s3api.Object(BUCKET_NAME, s3_dest_key + f.name).put(Body=open(str(f), 'rb'))
-            if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
-                raise ConnectionError('Bad request, response:\n {0}'.format(str(resp)))
-            else:
-                print("Successfully uploaded {0} to s3://{1}".format(f.name, BUCKET_NAME + '/' + s3_dest_key + f.name))
+    Returns
+    -------
+    uploaded: list of str
+        Names of the files uploaded, not including the files skipped
+    """
+    s3_client = s3_client if s3_client is not None else boto3.client('s3')
+    transfer_config = TransferConfig(multipart_threshold=MULTIPART_CHUNK_SIZE, multipart_chunksize=MULTIPART_CHUNK_SIZE,
+                                     max_concurrency=PART_UPLOAD_THREADS)
+    files = [f for f in sorted(Path(output_folder).iterdir())
+             if 'dataframe' in f.name and f.name.endswith(UPLOADED_SUFFIXES) and f.is_file()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(upload_file, s3_client, f, bucket, s3_dest_key + f.name, transfer_config, compress)
+                   for f in files]
+        return [f.name for f, future in zip(files, futures) if future.result()]
 
 
 def run(args):
     output_path = Path(args.output_dir)
     process_events(output_path, args.iter_number, args.sample_size)
-    upload_results(output_path, remote_path(args))
+    upload_results(output_path, remote_path(args), max_workers=args.upload_threads, compress=args.compress)
     print("Done uploading post-processed data!")
 
 
@@ -49,6 +181,8 @@ if __name__ == '__main__':
     parser.add_argument("--output_dir", type=str, help="Path to output directory.")
     parser.add_argument("--iter_number", type=str, help="Iteration used to parse data.")
     parser.add_argument("--sample_size", type=str, default="15k", help="Sample size.")
+    parser.add_argument("--upload_threads", type=int, default=UPLOAD_THREADS, help="Number of upload threads.")
+    parser.add_argument("--compress", action="store_true", help="Gzip the files before uploading them.")
     # parser.add_argument("--random_search_num", type=int, required=False)
     # parser.add_argument('--s3_dest_key', type=str, required=True)
     args = parser.parse_args()
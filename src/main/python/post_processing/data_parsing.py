@@ -1,8 +1,30 @@
 import gzip
-import re
+from array import array
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from lxml import etree
+from pandas.api.types import union_categoricals
+
+# Number of events gathered in memory before a chunk is handed over to pandas
+DEFAULT_CHUNK_SIZE = 500000
+
+# String attributes taking few distinct values, stored as pandas categoricals
+CATEGORICAL_COLUMNS = frozenset(['type', 'mode', 'vehicleType', 'primaryFuelType', 'secondaryFuelType', 'actType',
+                                 'currentTourMode'])
+
+# Identifiers of the persons, vehicles, links and GTFS trips, kept as strings even when all of them look like numbers
+# (e.g. the numeric person ids of a small scenario), so that they match the ids of the plans
+ID_COLUMNS = frozenset(['person', 'driver', 'vehicle', 'links', 'gtfs_trip_id'])
+
+# Number of values of each (event type, attribute) pair looked at to infer its data type
+SCHEMA_SAMPLE_SIZE = 1000
+
+_INT_PATTERN = r'[-+]?\d+'
+_FLOAT_PATTERN = r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?|NaN|-?Infinity'
+_JAVA_SPECIAL_VALUES = {'NaN': np.nan, 'Infinity': np.inf, '-Infinity': -np.inf}
+_TYPE_WIDTHS = {int: 0, float: 1, str: 2}
 
 
 def open_xml(path):
@@ -22,26 +44,111 @@ def open_xml(path):
         return etree.parse(path)
 
 
-def guess_type(s):
+class EventSchema(object):
+    """Data types of the attributes of the events.
+
+    The type of each (event type, attribute) pair is inferred once, from a sample of its first values, and a column
+    gets the widest type of its pairs (str > float > int). The type of a column therefore does not depend on which
+    event happened to come first in the file. The identifiers (see `ID_COLUMNS`) are always strings.
+    """
+
+    def __init__(self, sample_size=SCHEMA_SAMPLE_SIZE):
+        """
+
+        Parameters
+        ----------
+        sample_size: int
+            Number of values of each (event type, attribute) pair used to infer its type
+        """
+        self.sample_size = sample_size
+        self.pair_types = {}
+
+    def update(self, name, values, type_codes, type_names):
+        """ Infer the type of the (event type, `name`) pairs that were not seen yet
+
+        Parameters
+        ----------
+        name: string
+            Attribute name
+
+        values: numpy array of strings
+            Raw values of the attribute
+
+        type_codes: numpy array of integers
+            Code of the event type of each value (-1 for events without type)
+
+        type_names: array of strings
+            Event type of each code
+        """
+        present_codes = np.flatnonzero(np.bincount(type_codes + 1, minlength=len(type_names) + 1)) - 1
+        new_codes = [code for code in present_codes if (_type_name(code, type_names), name) not in self.pair_types]
+        if len(new_codes) == 0:
+            return
+
+        if name in ID_COLUMNS:
+            for code in new_codes:
+                self.pair_types[(_type_name(code, type_names), name)] = str
+            return
+
+        samples = pd.Series(values).groupby(type_codes, sort=False).head(self.sample_size)
+        sample_codes = type_codes[samples.index.values]
+        for code in new_codes:
+            self.pair_types[(_type_name(code, type_names), name)] = _infer_type(samples[sample_codes == code])
+
+    def column_type(self, name):
+        """ Widest type of the (event type, `name`) pairs (str if none of them has a type yet) """
+        types = [data_type for (_, attribute), data_type in self.pair_types.items()
+                 if attribute == name and data_type is not None]
+        if len(types) == 0:
+            return str
+        return max(types, key=_TYPE_WIDTHS.get)
+
+    def set_column_type(self, name, data_type):
+        for pair in self.pair_types:
+            if pair[1] == name:
+                self.pair_types[pair] = data_type
+
+
+def _type_name(code, type_names):
+    return None if code < 0 else type_names[code]
+
+
+def _infer_type(sample):
+    # Empty strings are missing values: they do not tell anything about the type
+    sample = sample[sample != '']
+    if len(sample) == 0:
+        return None
+    if sample.str.fullmatch(_INT_PATTERN).all():
+        return int
+    if sample.str.fullmatch(_FLOAT_PATTERN).all():
+        return float
+    return str
+
+
+def to_numeric(values):
     """
-    Cast objects to appropriate data types
+    Convert an array of numeric strings as written by BEAM to a NumPy array of numbers
 
     Parameters
     ----------
-    s: object
-        Object whose data type is unknown
+    values: numpy array of strings
+        Raw values. Empty strings are missing values.
 
     Returns
     -------
-    data type
+    : numpy array of int64 (if all values are integers) or float64
 
+    Raises
+    ------
+    ValueError
+        If some values are not numeric
     """
-    if re.match("^[0-9.]+$", s):
-        return float
-    elif re.match("^[0-9]+$", s):
-        return int
-    else:
-        return str
+    values = np.where(values == '', None, values)
+    try:
+        return pd.to_numeric(values)
+    except ValueError:
+        # Java writes the special values of the doubles in a way that pandas does not parse
+        return pd.to_numeric(pd.Series(values).replace(_JAVA_SPECIAL_VALUES).values)
 
 
 def list_attributes(tree):
@@ -50,7 +157,8 @@ def list_attributes(tree):
 
     Parameters
     ----------
-    root:
+    tree: ElementTree object
+        Output of the open_xml() function for an events file
 
     Returns
     -------
@@ -60,47 +168,413 @@ def list_attributes(tree):
     """
     root = tree.getroot()
 
-    columns = []
-    column_types = []
+    columns = {}
     for event in root:
-        for i in event.items():
-            if i[0] not in columns:
-                columns.append(i[0])
-                column_types.append(guess_type(i[1]))
-    return columns, column_types
+        for name in event.keys():
+            if name not in columns:
+                columns[name] = None
+    return list(columns)
 
 
-def create_dataframe(tree, columns, column_types):
+def create_dataframe(tree, columns, schema=None):
     """
     Collect the data and store it in a pandas DataFrame
 
+    Parameters
+    ----------
+    tree: ElementTree object
+        Output of the open_xml() function for an events file
+
+    columns: list
+        Columns of the DataFrame: output of the list_attributes() function
+
+    schema: EventSchema, optional
+        Data types of the attributes. Inferred from the events if None.
+
     Returns
     -------
     : pandas DataFrame
     """
     root = tree.getroot()
 
-    event_data_size = len(columns)
-    data = []
-
-    # Reading the data of each event to append values in the correct order.
+    buffers = ColumnBuffers(columns, schema)
     for event in root:
-        event_data = [None] * event_data_size
+        buffers.append(event.get('type'), event.items())
 
-        for i in event.items():
-            attribute_name = i[0]
-            attribute_value = i[1]
-            column_index = columns.index(attribute_name)
-            event_data[column_index] = column_types[column_index](attribute_value)
-        data.append(event_data)
+    return buffers.to_dataframe()
 
-    output_data = pd.DataFrame(data=data, columns=columns)
 
-    return output_data
+def open_xml_source(path):
+    """
+    Open xml and xml.gz files as a file object that can be parsed incrementally
 
+    Parameters
+    ----------
+    path: string
+        Absolute path of the file to parse
+    """
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path)
+    else:
+        return open(path, 'rb')
+
+
+def iter_elements(path, tag):
+    """
+    Iterate over the elements of an xml (or xml.gz) file without building the full tree.
+
+    Each element is yielded once it has been completely parsed and is cleared (together with its already processed
+    siblings) as soon as the caller moves on to the next one, so that the memory used does not grow with the size
+    of the file.
+
+    Parameters
+    ----------
+    path: string
+        Absolute path of the file to parse
+
+    tag: string
+        Tag of the elements to yield, e.g. "event" or "person"
+
+    Yields
+    ------
+    element: lxml.etree.Element
+        Fully parsed element. It is only valid until the next element is requested.
+    """
+    with open_xml_source(path) as source:
+        for _, element in etree.iterparse(source, events=('end',), tag=tag):
+            yield element
+
+            # Free the memory used by the element and by its previous siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+class ColumnBuffers(object):
+    """Column-oriented append buffers used to assemble events into a pandas DataFrame.
+
+    Each column keeps the raw values of the events having the attribute, together with the positions of these events
+    in an integer array, so that appending an event only touches the columns of its own attributes (found through a
+    name -> position dictionary) and no intermediate row is ever built. The values are only converted, column by
+    column, when the DataFrame is created.
+    """
 
-def extract_dataframe(path):
-    tree = open_xml(path)
-    columns, column_types = list_attributes(tree)
-    output_data = create_dataframe(tree, columns, column_types)
+    def __init__(self, columns=None, schema=None):
+        """
+
+        Parameters
+        ----------
+        columns: list of strings, optional
+            Columns known in advance, in the order they should appear in the DataFrame
+
+        schema: EventSchema, optional
+            Data types of the attributes. Shared (and completed) by the buffers of the successive chunks of a file, so
+            that all chunks get the same types.
+        """
+        self.schema = EventSchema() if schema is None else schema
+        self.column_index = {}
+        self.columns = []
+        self.values = []
+        self.rows = []
+        self.event_types = []
+        self.n_rows = 0
+        for name in columns or []:
+            self.add_column(name)
+
+    def add_column(self, name):
+        index = len(self.columns)
+        self.column_index[name] = index
+        self.columns.append(name)
+        self.values.append([])
+        self.rows.append(array('l'))
+        return index
+
+    def append(self, event_type, items, kept_columns=None):
+        """ Append an event to the buffers
+
+        Parameters
+        ----------
+        event_type: string
+            Type of the event
+
+        items: iterable of (attribute name, attribute value) tuples
+            Attributes of the event
+
+        kept_columns: set of strings, optional
+            Attributes to keep. All attributes are kept if None.
+        """
+        row = self.n_rows
+        for name, value in items:
+            index = self.column_index.get(name)
+            if index is None:
+                if kept_columns is not None and name not in kept_columns:
+                    continue
+                index = self.add_column(name)
+            self.values[index].append(value)
+            self.rows[index].append(row)
+        self.event_types.append(event_type)
+        self.n_rows += 1
+
+    def to_dataframe(self):
+        type_codes, type_names = pd.factorize(np.array(self.event_types, dtype=object))
+
+        data = {}
+        for name, values, rows in zip(self.columns, self.values, self.rows):
+            rows = np.frombuffer(rows, dtype=rows.typecode)
+            values = np.array(values, dtype=object)
+            self.schema.update(name, values, type_codes[rows], type_names)
+            data[name] = self._to_column(name, values, rows)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def _to_column(self, name, values, rows):
+        # Place the values of the column at the positions of their events, the other events have missing values
+        if self.schema.column_type(name) is not str:
+            try:
+                numbers = to_numeric(values)
+            except ValueError:
+                # A value beyond the sample is not numeric: the whole column is made of strings from now on
+                self.schema.set_column_type(name, str)
+            else:
+                if len(rows) == self.n_rows:
+                    return numbers
+                column = np.full(self.n_rows, np.nan)
+                column[rows] = numbers
+                return column
+
+        if name in CATEGORICAL_COLUMNS:
+            categories = pd.Categorical(values)
+            codes = np.full(self.n_rows, -1, dtype=categories.codes.dtype)
+            codes[rows] = categories.codes
+            column = pd.Categorical.from_codes(codes, categories.categories)
+        else:
+            column = np.full(self.n_rows, None, dtype=object)
+            column[rows] = values
+        return column
+
+
+def concat_chunks(chunks):
+    """
+    Concatenate chunks of events into a single DataFrame, keeping the categorical columns categorical
+
+    Parameters
+    ----------
+    chunks: list of pandas DataFrames
+        Output of the iter_event_chunks() function
+
+    Returns
+    -------
+    : pandas DataFrame
+    """
+    columns = list(dict.fromkeys(name for chunk in chunks for name in chunk.columns))
+
+    # A column whose values stopped being numeric after the first chunks (see `ColumnBuffers._to_column()`) is made
+    # of strings in all the chunks
+    for name in columns:
+        numeric = [pd.api.types.is_numeric_dtype(chunk[name]) for chunk in chunks if name in chunk.columns]
+        if any(numeric) and not all(numeric):
+            for chunk in chunks:
+                if name in chunk.columns and pd.api.types.is_numeric_dtype(chunk[name]):
+                    chunk[name] = numbers_to_strings(chunk[name], name in CATEGORICAL_COLUMNS)
+
+    # The categories of a column differ from one chunk to the other: align them on their union beforehand,
+    # otherwise pandas falls back to an object column
+    categorical_columns = {name for chunk in chunks for name, dtype in chunk.dtypes.items()
+                           if isinstance(dtype, pd.CategoricalDtype)}
+    for name in categorical_columns:
+        categories = union_categoricals([chunk[name] for chunk in chunks if name in chunk.columns
+                                         and isinstance(chunk[name].dtype, pd.CategoricalDtype)]).categories
+        for chunk in chunks:
+            if name in chunk.columns:
+                if isinstance(chunk[name].dtype, pd.CategoricalDtype):
+                    chunk[name] = chunk[name].cat.set_categories(categories)
+            else:
+                chunk[name] = pd.Categorical.from_codes(np.full(len(chunk), -1), categories)
+    return pd.concat(chunks, ignore_index=True, sort=False)[columns]
+
+
+def numbers_to_strings(column, categorical=False):
+    """
+    Write a numeric column as strings, without decimals when all its values are integers (1.0 is written "1")
+
+    Parameters
+    ----------
+    column: pandas Series
+        Numbers, NaN for the missing values
+
+    categorical: bool
+        Whether to return a categorical column
+
+    Returns
+    -------
+    : pandas Series
+        Strings, NaN for the missing values
+    """
+    strings = column.astype(object)
+    present = column.notnull()
+    numbers = column[present]
+    if (numbers % 1 == 0).all():
+        numbers = numbers.astype('int64')
+    strings[present] = numbers.astype(str)
+    return strings.astype('category') if categorical else strings
+
+
+def iter_event_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, event_types=None, columns=None):
+    """
+    Stream the events of an events.xml(.gz) file as DataFrames of at most `chunk_size` events.
+
+    The columns are discovered in the same pass as the values are read: an attribute seen for the first time
+    becomes a new column (missing values in the events preceding it in the chunk). The types of the columns are
+    inferred by an EventSchema shared by all the chunks of the file.
+
+    Parameters
+    ----------
+    path: string
+        Absolute path of the `<num_iterations>.events.xml(.gz)` file
+
+    chunk_size: int
+        Maximum number of events in each chunk
+
+    event_types: iterable of strings, optional
+        Types of the events to keep (e.g. "PathTraversal"); all the other events are skipped while decoding.
+        All events are kept if None.
+
+    columns: list of strings, optional
+        Attributes to keep, in the order of the columns of the chunks; all the other attributes are skipped while
+        decoding. All attributes are kept if None.
+
+    Yields
+    ------
+    : pandas DataFrame
+        Chunk of events, one row per event and one column per attribute
+    """
+    if event_types is not None:
+        event_types = frozenset(event_types)
+    kept_columns = None if columns is None else frozenset(columns)
+
+    schema = EventSchema()
+    buffers = ColumnBuffers(schema=schema)
+
+    for event in iter_elements(path, 'event'):
+        event_type = event.get('type')
+        if event_types is not None and event_type not in event_types:
+            continue
+
+        buffers.append(event_type, event.items(), kept_columns)
+
+        if buffers.n_rows == chunk_size:
+            yield _select_columns(buffers.to_dataframe(), columns)
+            buffers = ColumnBuffers(schema=schema)
+
+    if buffers.n_rows > 0:
+        yield _select_columns(buffers.to_dataframe(), columns)
+
+
+def _select_columns(events_df, columns):
+    # Put the projected columns in the requested order, adding the ones that were never seen
+    if columns is None:
+        return events_df
+    return events_df.reindex(columns=columns)
+
+
+def extract_dataframe(path, chunk_size=DEFAULT_CHUNK_SIZE, event_types=None, columns=None):
+    """
+    Parse an events.xml(.gz) file into a pandas DataFrame
+
+    The file is streamed (see `iter_event_chunks()`), so the peak memory used while parsing is bounded by the size of
+    a chunk rather than by the size of the file.
+
+    Parameters
+    ----------
+    path: string
+        Absolute path of the `<num_iterations>.events.xml(.gz)` file
+
+    chunk_size: int
+        Maximum number of events parsed before being converted to a DataFrame
+
+    event_types: iterable of strings, optional
+        Types of the events to keep. All events are kept if None.
+
+    columns: list of strings, optional
+        Attributes to keep. All attributes are kept if None.
+
+    Returns
+    -------
+    output_data: pandas DataFrame
+        One row per event and one column per attribute
+    """
+    chunks = list(iter_event_chunks(path, chunk_size, event_types, columns))
+    if len(chunks) == 0:
+        return _select_columns(pd.DataFrame(), columns)
+    output_data = concat_chunks(chunks)
     return output_data
+
+
+def read_events_csv(path, chunk_size=DEFAULT_CHUNK_SIZE, event_types=None, columns=None):
+    """
+    Read an events.csv(.gz) file into a pandas DataFrame, dropping the unneeded events and columns chunk by chunk
+
+    Parameters
+    ----------
+    path: string
+        Absolute path of the `<num_iterations>.events.csv(.gz)` file
+
+    chunk_size: int
+        Number of rows read at once
+
+    event_types: iterable of strings, optional
+        Types of the events to keep. All events are kept if None.
+
+    columns: list of strings, optional
+        Columns to keep. All columns are kept if None.
+
+    Returns
+    -------
+    : pandas DataFrame
+        One row per event
+    """
+    if event_types is not None:
+        event_types = frozenset(event_types)
+    # The type column is needed to filter the events, even when it is not part of the projection
+    read_columns = None if columns is None else frozenset(columns) | {'type'}
+    usecols = None if read_columns is None else (lambda name: name in read_columns)
+
+    chunks = []
+    dtype = {name: 'category' for name in CATEGORICAL_COLUMNS}
+    dtype.update({name: str for name in ID_COLUMNS})
+    for chunk in pd.read_csv(str(path), usecols=usecols, dtype=dtype, chunksize=chunk_size):
+        if event_types is not None:
+            chunk = chunk[chunk['type'].isin(event_types)]
+        chunks.append(_select_columns(chunk, columns))
+    if len(chunks) == 0:
+        return _select_columns(pd.DataFrame(), columns)
+    return concat_chunks(chunks)
+
+
+def load_events(path, event_types=None, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Load the events of an iteration from either its `events.xml(.gz)` or its `events.csv(.gz)` file
+
+    Parameters
+    ----------
+    path: pathlib.Path object or string
+        Absolute path of the events file
+
+    event_types: iterable of strings, optional
+        Types of the events to keep. All events are kept if None.
+
+    columns: list of strings, optional
+        Attributes to keep. All attributes are kept if None.
+
+    chunk_size: int
+        Number of events decoded at once
+
+    Returns
+    -------
+    : pandas DataFrame
+        One row per event and one column per attribute
+    """
+    if '.xml' in Path(path).suffixes:
+        return extract_dataframe(str(path), chunk_size, event_types, columns)
+    else:
+        return read_events_csv(str(path), chunk_size, event_types, columns)
@@ -0,0 +1,349 @@
+"""Columnar cache of the DataFrames parsed from the outputs of a BEAM run.
+
+The DataFrames are stored as Parquet files (pickles if pyarrow is not installed), next to a manifest recording the
+size, modification time and content hash of the files they were parsed from. The cached DataFrames are only used
+while all these source files are unchanged, so re-simulating a run (or changing its inputs) invalidates the cache.
+
+The files can be written by a BackgroundWriter, so that the parsing and the plots carry on while they are written.
+
+Archives (e.g. the BAU warm-start outputs) are extracted by extract_archive() into folders named after the hash of
+their content, so that each archive is extracted once per machine.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pickle"
+
+MANIFEST_FILE = "manifest.json"
+HASH_BLOCK_SIZE = 1 << 20
+# Machine-wide folder where the archives are extracted, and record of the signatures of the archives extracted
+EXTRACTION_FOLDER = Path(os.environ.get("BISTRO_CACHE", str(Path.home() / ".cache" / "bistro"))) / "archives"
+EXTRACTED_ARCHIVES_FILE = "archives.json"
+
+
+def hash_file(path):
+    """ Compute the SHA-1 of the content of a file
+
+    Parameters
+    ----------
+    path: pathlib.Path object
+        Absolute path of the file
+
+    Returns
+    -------
+    : str
+        Hexadecimal digest of the file
+    """
+    sha1 = hashlib.sha1()
+    with open(str(path), 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_signature(path, previous=None):
+    """ Signature (size, modification time and content hash) of a file
+
+    Hashing a multi-GB events file takes a while: the hash of the `previous` signature is reused as long as the size
+    and the modification time of the file did not change.
+
+    Parameters
+    ----------
+    path: pathlib.Path object
+        Absolute path of the file
+
+    previous: dictionary, optional
+        Signature previously computed for the same file
+
+    Returns
+    -------
+    signature: dictionary
+        {"size": size in bytes, "mtime": modification time, "sha1": content hash}
+    """
+    stat = os.stat(str(path))
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if previous is not None and previous.get("size") == signature["size"] \
+            and previous.get("mtime") == signature["mtime"]:
+        signature["sha1"] = previous["sha1"]
+    else:
+        signature["sha1"] = hash_file(path)
+    return signature
+
+
+def write_json(path, data):
+    """ Write a json file atomically, through a temporary file
+
+    Parameters
+    ----------
+    path: pathlib.Path object
+
+    data: dictionary
+    """
+    tmp_path = path.with_name("{0}.{1}.tmp".format(path.name, os.getpid()))
+    with open(str(tmp_path), 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(str(tmp_path), str(path))
+
+
+def extract_archive(archive_path, extraction_folder=EXTRACTION_FOLDER):
+    """ Extract an archive into a folder named after the SHA-1 of its content, unless it was already extracted
+
+    The archives extracted are recorded with their signatures, so that an archive is only hashed again when its size
+    or modification time changes. Archives with the same content share the same folder.
+
+    Parameters
+    ----------
+    archive_path: pathlib.Path object
+        Absolute path of the archive, in one of the formats of `shutil.unpack_archive` (e.g. zip)
+
+    extraction_folder: pathlib.Path object
+        Folder the archives are extracted into
+
+    Returns
+    -------
+    : pathlib.Path object
+        Folder containing the content of the archive
+    """
+    archive_path = Path(archive_path).absolute()
+    extraction_folder = Path(extraction_folder)
+    extraction_folder.mkdir(parents=True, exist_ok=True)
+    records_path = extraction_folder / EXTRACTED_ARCHIVES_FILE
+    try:
+        with open(str(records_path)) as f:
+            records = json.load(f)
+    except (OSError, ValueError):
+        records = {}
+
+    signature = file_signature(archive_path, records.get(str(archive_path)))
+    folder = extraction_folder / signature["sha1"]
+    if not folder.is_dir():
+        # Extracted next to its final location then renamed, so that an interrupted extraction is never used
+        tmp_folder = Path(tempfile.mkdtemp(prefix=signature["sha1"] + ".", dir=str(extraction_folder)))
+        try:
+            shutil.unpack_archive(str(archive_path), str(tmp_folder))
+            os.replace(str(tmp_folder), str(folder))
+        except OSError:
+            # Another process extracted the same archive in the meantime
+            if not folder.is_dir():
+                raise
+        finally:
+            shutil.rmtree(str(tmp_folder), ignore_errors=True)
+
+    if records.get(str(archive_path)) != signature:
+        records[str(archive_path)] = signature
+        write_json(records_path, records)
+    return folder
+
+
+class DataFrameCache(object):
+    """Cache of the DataFrames parsed from a set of source files.
+
+    Attributes
+    ----------
+    cache_folder: pathlib.Path object
+        Folder where the DataFrames and the manifest are stored
+
+    source_files: list of pathlib.Path objects
+        Files the cached DataFrames are parsed from
+
+    version: int
+        Version of the layout of the cached DataFrames: DataFrames cached with another version are parsed again
+    """
+
+    def __init__(self, cache_folder, source_files, version=0):
+        self.cache_folder = Path(cache_folder)
+        self.source_files = [Path(path) for path in source_files]
+        self.version = version
+        # Signatures of the source files last computed, reused while the files keep their size and modification time
+        self._computed_signatures = {}
+
+    @property
+    def manifest_path(self):
+        return self.cache_folder / MANIFEST_FILE
+
+    def frame_path(self, name):
+        return self.cache_folder / "{0}.{1}".format(name, CACHE_FORMAT)
+
+    def _read_manifest(self):
+        try:
+            with open(str(self.manifest_path)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        write_json(self.manifest_path, manifest)
+
+    def _signatures(self, previous_signatures):
+        previous_signatures = dict(previous_signatures, **self._computed_signatures)
+        self._computed_signatures = {str(path): file_signature(path, previous_signatures.get(str(path)))
+                                     for path in self.source_files}
+        return self._computed_signatures
+
+    def source_signatures(self):
+        """ Signatures of the source files, to compute before parsing the DataFrames and pass to save(): a file
+        modified while the DataFrames are parsed is then not recorded as their source
+
+        Returns
+        -------
+        signatures: dictionary
+            {path: signature}, see file_signature()
+        """
+        previous_manifest = self._read_manifest() or {}
+        return self._signatures(previous_manifest.get("sources", {}))
+
+    def is_valid(self, names):
+        """ Check that the DataFrames `names` are cached and were parsed from the current source files
+
+        Parameters
+        ----------
+        names: list of str
+            Names of the DataFrames
+
+        Returns
+        -------
+        : bool
+        """
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get("format") != CACHE_FORMAT or manifest.get("version", 0) != self.version:
+            return False
+        if any(name not in manifest["frames"] or not self.frame_path(name).exists() for name in names):
+            return False
+
+        previous_signatures = manifest["sources"]
+        if set(previous_signatures) != {str(path) for path in self.source_files}:
+            return False
+        if not all(path.exists() for path in self.source_files):
+            return False
+        signatures = self._signatures(previous_signatures)
+        if any(signatures[path]["sha1"] != previous_signatures[path]["sha1"] for path in signatures):
+            return False
+
+        # The files were touched but not modified: remember their new modification times to avoid hashing them again
+        if signatures != previous_signatures:
+            manifest["sources"] = signatures
+            self._write_manifest(manifest)
+        return True
+
+    def load(self, name):
+        """ Load a cached DataFrame
+
+        Parameters
+        ----------
+        name: str
+            Name of the DataFrame
+
+        Returns
+        -------
+        : pandas DataFrame
+        """
+        if CACHE_FORMAT == "parquet":
+            frame = pd.read_parquet(str(self.frame_path(name)), memory_map=True)
+            manifest = self._read_manifest() or {}
+            for column, categories in manifest.get("categories", {}).get(name, {}).items():
+                frame[column] = pd.Categorical.from_codes(frame[column].values, categories)
+            return frame
+        else:
+            return pd.read_pickle(str(self.frame_path(name)))
+
+    def save(self, frames, signatures=None):
+        """ Cache DataFrames and record the signatures of the source files they were parsed from
+
+        Parameters
+        ----------
+        frames: dictionary
+            {name: pandas DataFrame}
+
+        signatures: dictionary, optional
+            Signatures of the source files when the DataFrames were parsed: output of source_signatures(). Computed
+            when the DataFrames are saved by default
+        """
+        if signatures is None:
+            signatures = self.source_signatures()
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+
+        # The manifest is removed while the DataFrames are saved: an interrupted save leaves the cache invalid
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+        categories = {}
+        for name, frame in frames.items():
+            tmp_path = self.frame_path(name).with_suffix(".tmp")
+            if CACHE_FORMAT == "parquet":
+                # Parquet only restores the categorical columns of strings: the categorical columns of numbers (e.g.
+                # the route ids) are stored as their codes, and their categories in the manifest
+                numeric = {column: dtype.categories for column, dtype in frame.dtypes.items()
+                           if isinstance(dtype, pd.CategoricalDtype) and dtype.categories.dtype.kind in "iufb"}
+                if numeric:
+                    frame = frame.assign(**{column: frame[column].cat.codes for column in numeric})
+                    categories[name] = {column: values.tolist() for column, values in numeric.items()}
+                frame.to_parquet(str(tmp_path))
+            else:
+                frame.to_pickle(str(tmp_path))
+            os.replace(str(tmp_path), str(self.frame_path(name)))
+
+        self._write_manifest({"format": CACHE_FORMAT,
+                              "version": self.version,
+                              "frames": sorted(frames),
+                              "categories": categories,
+                              "sources": signatures})
+
+
+class BackgroundWriter(object):
+    """Writes files on a single background thread, in the order the writes are submitted.
+
+    The DataFrames submitted must not be modified until they are written: submit shallow copies
+    (`DataFrame.copy(deep=False)`) of DataFrames that columns are added to afterwards. The writes still pending when
+    the interpreter exits are completed before it exits.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+
+    def submit(self, function, *args, **kwargs):
+        """ Schedule a write
+
+        Parameters
+        ----------
+        function: callable
+            Function writing the files, called as `function(*args, **kwargs)` on the background thread
+
+        Returns
+        -------
+        : concurrent.futures.Future
+        """
+        future = self._executor.submit(function, *args, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def wait(self):
+        """ Wait for all the writes submitted so far, raising the exception of the first write that failed
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """ Wait for all the writes submitted, then stop the background thread
+        """
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
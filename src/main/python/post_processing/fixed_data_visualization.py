@@ -1,12 +1,16 @@
+import copy
+import functools
 from collections import Counter
 from pathlib import Path
 
 import plans_parser as parser
 from data_parsing import *
+from dataframe_cache import BackgroundWriter, DataFrameCache, extract_archive
+from range_parsing import add_range_columns
+from trip_cube import build_trip_cube
 
 # import pandana as pdna
 # import re
-from plans_parser import unzip_file
 
 REFERENCE_DATA = "resources"
 AGENCY = "sioux_faux_bus_lines"
@@ -15,6 +19,12 @@ EXAMPLES = "examples"
 COMPETITION = "competition"
 SUBMISSION_INPUTS = "submission-inputs"
 ITERS = "ITERS"
+CACHE = "parsed_dataframes_cache"
+# Version of the layout of the cached DataFrames, to increment when the parser changes it
+CACHE_VERSION = 5
+# DataFrames parsed from the outputs of each iteration, cached in the folder of the iteration. The persons DataFrame is
+# the same for all the iterations: it is cached in the output folder
+ITERATION_DATAFRAMES = ["activities", "legs", "path_traversals", "trips"]
 
 max_incentive = 50
 max_income = 150000
@@ -28,81 +38,190 @@ max_time = 900
 utm_zone = "14N"
 
 
+# Reference data already loaded by this process: {(scenario folder, sample size, attribute): value}
+_REFERENCE_DATA_MEMO = {}
+
+
+def memoized_reference_data(load):
+    """ Turn a loading method of ReferenceData into a property loaded on first access, and shared by all the
+    ReferenceData instances of the process with the same scenario and sample size
+
+    Each access returns a copy of the value loaded, so that a caller modifying it (e.g. adding a column to a DataFrame)
+    does not change it for the other ReferenceData instances
+
+    Parameters
+    ----------
+    load : function
+        Method loading the attribute from the reference data files
+
+    Returns
+    -------
+    : property
+    """
+
+    @functools.wraps(load)
+    def wrapper(self):
+        key = (str(self.scenario_path), self.sample_size, load.__name__)
+        if key not in _REFERENCE_DATA_MEMO:
+            _REFERENCE_DATA_MEMO[key] = load(self)
+        return copy.deepcopy(_REFERENCE_DATA_MEMO[key])
+
+    return property(wrapper)
+
+
 class ReferenceData(object):
 
     def __init__(self, sample_size, scenario_name="sioux_faux", transit_scale_factor=0.1):
-        """
+        """ Reference data of a scenario. The files are only read when their attributes are first used, and once per
+        process for each scenario and sample size
 
         Parameters
         ----------
-        reference_data_path : Path
-            Directory containing the scenario's reference-data
+        sample_size : str
+            Sample size of the scenario, e.g. "15k"
+
+        scenario_name : str
+            Directory containing the scenario's reference-data, in the `resources` folder
+
+        transit_scale_factor : float
+            Scale factor to compare the 15k to the 157k scenario (full population)
         """
-        # Scale factor to compare the 15k to the 157k scenario (full population)
+        self.sample_size = sample_size
+        self.scenario_name = scenario_name
         self.transit_scale_factor = transit_scale_factor
+        self.scenario_path = (Path.cwd().parent / REFERENCE_DATA / scenario_name).absolute()
+
+        # Network and population files
+        self.path_network_file = self.scenario_path / CONFIG / "physsim-network.xml"
+        self.path_population_file = self.scenario_path / CONFIG / "{}/population.xml.gz".format(sample_size)
 
+        # Files the fares and fuel costs of the parsed outputs depend on
+        self.path_routes_file = self.scenario_path / AGENCY / "gtfs_data/routes.txt"
+        self.path_trips_file = self.scenario_path / AGENCY / "gtfs_data/trips.txt"
+        self.path_fuel_types_file = self.scenario_path / CONFIG / sample_size / "beamFuelTypes.csv"
+        self.parsing_files = [self.path_routes_file, self.path_trips_file, self.path_fuel_types_file]
+
+    @memoized_reference_data
+    def agency_ids(self):
         # Importing agencies ids from agency.txt
-        agency_ids = pd.read_csv(Path.cwd().parent / REFERENCE_DATA / scenario_name / AGENCY / "gtfs_data/agency.txt")
-        self.agency_ids = agency_ids["agency_id"].tolist()
+        agency_ids = pd.read_csv(self.scenario_path / AGENCY / "gtfs_data/agency.txt")
+        return agency_ids["agency_id"].tolist()
 
+    @memoized_reference_data
+    def route_ids(self):
         # Importing route ids from `routes.txt`
-        route_df = pd.read_csv(Path.cwd().parent / REFERENCE_DATA / scenario_name / AGENCY / "gtfs_data/routes.txt")
-        self.route_ids = route_df["route_id"].sort_values(ascending=True).tolist()
+        route_df = pd.read_csv(self.path_routes_file)
+        return route_df["route_id"].sort_values(ascending=True).tolist()
 
+    @memoized_reference_data
+    def available_vehicle_types(self):
         # Importing vehicle types and seating capacities from `availableVehicleTypes.csv` file
-        self.available_vehicle_types = pd.read_csv(Path.cwd().parent / REFERENCE_DATA /
-                                                   scenario_name / AGENCY / "availableVehicleTypes.csv")
+        return pd.read_csv(self.scenario_path / AGENCY / "availableVehicleTypes.csv")
 
-        self.buses_list = self.available_vehicle_types["vehicleTypeId"][1:].tolist()
+    @memoized_reference_data
+    def buses_list(self):
+        return self.available_vehicle_types["vehicleTypeId"][1:].tolist()
 
-        self.seating_capacities = self.available_vehicle_types[["vehicleTypeId", "seatingCapacity"]]. \
+    @memoized_reference_data
+    def seating_capacities(self):
+        return self.available_vehicle_types[["vehicleTypeId", "seatingCapacity"]]. \
             set_index("vehicleTypeId", drop=True).T.to_dict("records")[0]
-        self.standing_capacities = self.available_vehicle_types[["vehicleTypeId", "standingRoomCapacity"]]. \
+
+    @memoized_reference_data
+    def standing_capacities(self):
+        return self.available_vehicle_types[["vehicleTypeId", "standingRoomCapacity"]]. \
             set_index("vehicleTypeId", drop=True).T.to_dict("records")[0]
 
-        self.capacity = {}
+    @memoized_reference_data
+    def capacity(self):
+        capacity = {}
         for vehicle_type, sum_capacities in (
                 Counter(self.standing_capacities) + Counter(self.seating_capacities)).items():
-            self.capacity[vehicle_type] = sum_capacities
+            capacity[vehicle_type] = sum_capacities
+        return capacity
 
+    @memoized_reference_data
+    def operational_costs(self):
         # Extracting Operational costs per bus type from the `vehicleCosts.csv` file
-        operational_costs = pd.read_csv(
-            Path.cwd().parent / REFERENCE_DATA / scenario_name / AGENCY / "vehicleCosts.csv")
-        self.operational_costs = operational_costs[["vehicleTypeId", "opAndMaintCost"]]. \
+        operational_costs = pd.read_csv(self.scenario_path / AGENCY / "vehicleCosts.csv")
+        return operational_costs[["vehicleTypeId", "opAndMaintCost"]]. \
             set_index("vehicleTypeId", drop=True).T.to_dict("records")[0]
 
+    @memoized_reference_data
+    def trip_to_route(self):
         # Extracting route_id / trip_id correspondence from the `trips.csv` file
-        trips = pd.read_csv(Path.cwd().parent / REFERENCE_DATA / scenario_name / AGENCY / "gtfs_data/trips.txt")
-        self.trip_to_route = trips[["trip_id", "route_id"]].set_index("trip_id", drop=True).T.to_dict('records')[0]
+        trips = pd.read_csv(self.path_trips_file)
+        return trips[["trip_id", "route_id"]].set_index("trip_id", drop=True).T.to_dict('records')[0]
 
+    @memoized_reference_data
+    def fuel_costs(self):
         # Extracting Fuel cost from the `beamFuelTypes.csv` file
-        fuel_costs = pd.read_csv(
-            Path.cwd().parent / REFERENCE_DATA / scenario_name / CONFIG / sample_size / "beamFuelTypes.csv")
+        fuel_costs = pd.read_csv(self.path_fuel_types_file)
         fuel_costs.loc[len(fuel_costs)] = ["food", 0]
-        self.fuel_costs = fuel_costs.set_index("fuelTypeId", drop=True).T.to_dict('records')[0]
+        return fuel_costs.set_index("fuelTypeId", drop=True).T.to_dict('records')[0]
 
-        # PATHS TO BAU DATA
-        # 1.ouput folder
-        path_output_folder_bau = (Path.cwd().parent / REFERENCE_DATA / scenario_name /
-                                  "bau/warm-start/sioux_faux-{}__warm-start".format(sample_size)).absolute()
-        self.path_output_folder_bau = unzip_file(path_output_folder_bau)
+    @memoized_reference_data
+    def path_output_folder_bau(self):
+        # Output folder of the BAU run. When only the zip archive of the warm-start is available, it is extracted once
+        # per machine, in a folder named after the hash of the archive
+        path_output_folder_bau = self.scenario_path / "bau/warm-start/sioux_faux-{}__warm-start".format(
+            self.sample_size)
+        archive_path = path_output_folder_bau.with_name(path_output_folder_bau.name + ".zip")
+        if not path_output_folder_bau.is_dir() and archive_path.is_file():
+            return extract_archive(archive_path)
+        return path_output_folder_bau
 
-        # 2. Network and population files
-        self.path_network_file = Path.cwd().parent / REFERENCE_DATA / scenario_name / CONFIG / "physsim-network.xml"
-        self.path_population_file = Path.cwd().parent / REFERENCE_DATA / scenario_name / CONFIG / "{}/population.xml.gz".format(sample_size)
-        self.linkstats_file_bau = self.path_output_folder_bau / ITERS / "it.101" / "101.linkstats.csv.gz"
+    @property
+    def linkstats_file_bau(self):
+        return self.path_output_folder_bau / ITERS / "it.101" / "101.linkstats.csv.gz"
 
 
 class ResultFiles:
-    def __init__(self, path_output_folder, number_iterations, reference_data: ReferenceData):
+    def __init__(self, path_output_folder, number_iterations, reference_data: ReferenceData, export_csv=False,
+                 person_df=None, writer=None, legs_workers=None):
+        """
+
+        Parameters
+        ----------
+        path_output_folder : Path
+            Output folder of the simulation
+
+        number_iterations : int
+            Iteration whose outputs are parsed
+
+        reference_data : ReferenceData
+
+        export_csv : bool
+            Whether the parsed DataFrames are also exported to csv files in the output folder. The files are written
+            in the background: call `writer.wait()` before reading them
+
+        person_df : pandas DataFrame, optional
+            Attributes of the persons, shared with the ResultFiles of another iteration of the same simulation
+
+        writer : BackgroundWriter, optional
+            Writer of the cache and the csv files, shared with the ResultFiles of other iterations
+
+        legs_workers : int, optional
+            Maximum number of worker processes rebuilding the legs of the trips, the number of CPUs by default
+        """
 
         self.path_output_folder = path_output_folder
         self.number_iterations = number_iterations
         self.reference_data = reference_data
+        self.export_csv = export_csv
+        self.person_df = person_df
+        self.legs_workers = legs_workers
+        self._trip_cube = None
+        # Writes the cache and the csv files while the DataFrames are used
+        self.writer = writer if writer is not None else BackgroundWriter()
 
         # Extracting input data from the submission input csv files
         self.bus_fares_data = pd.read_csv(path_output_folder / COMPETITION / SUBMISSION_INPUTS / "MassTransitFares.csv")
         self.incentives_data = pd.read_csv(path_output_folder / COMPETITION / SUBMISSION_INPUTS / "ModeIncentives.csv")
+        # Parsing the age and income ranges once for the post-processing and the plots
+        add_range_columns(self.bus_fares_data, "age")
+        add_range_columns(self.incentives_data, "age")
+        add_range_columns(self.incentives_data, "income")
         self.fleet_mix_data = pd.read_csv(path_output_folder / COMPETITION / SUBMISSION_INPUTS / "VehicleFleetMix.csv")
         self.bus_frequency_data = pd.read_csv(
             path_output_folder / COMPETITION / SUBMISSION_INPUTS / "FrequencyAdjustment.csv")
@@ -116,37 +235,121 @@ class ResultFiles:
         self.process_all_xml_files()
 
     def process_all_xml_files(self):
-        """ Import all xml.gz files from the output folder of the scenario, parse them and create .csv files"
+        """ Import all xml.gz files from the output folder of the scenario and parse them, or load the DataFrames
+        cached by a previous parsing
 
         """
-        if not Path(self.path_output_folder / ITERS / "it.{0}".format(self.number_iterations) / \
-                    "{0}.events.csv.gz".format(self.number_iterations)).exists():
-            self.events_path = self.path_output_folder / ITERS / "it.{0}".format(self.number_iterations) / \
-                               "{0}.events.xml.gz".format(self.number_iterations)
-
+        iteration_folder = self.path_output_folder / ITERS / "it.{0}".format(self.number_iterations)
+        if not Path(iteration_folder / "{0}.events.csv.gz".format(self.number_iterations)).exists():
+            self.events_path = iteration_folder / "{0}.events.xml.gz".format(self.number_iterations)
         else:
-            self.events_path = self.path_output_folder / ITERS / "it.{0}".format(self.number_iterations) / \
-                               "{0}.events.csv.gz".format(self.number_iterations)
+            self.events_path = iteration_folder / "{0}.events.csv.gz".format(self.number_iterations)
         self.output_plans_path = self.path_output_folder / "outputPlans.xml.gz"
-        self.experienced_plans_path = self.path_output_folder / ITERS / "it.{0}".format(self.number_iterations) \
-                                      / "{0}.experiencedPlans.xml.gz".format(self.number_iterations)
+        self.experienced_plans_path = iteration_folder / "{0}.experiencedPlans.xml.gz".format(self.number_iterations)
         self.persons_path = self.path_output_folder / "outputPersonAttributes.xml.gz"
         self.households_path = self.path_output_folder / "outputHouseholds.xml.gz"
-
-        if not Path(self.path_output_folder / "trips_dataframe.csv").exists():
-            # Parsing and creating the csv files in the output folder
-            parser.output_parse(self.events_path, self.output_plans_path, self.persons_path, self.households_path,
-                                self.experienced_plans_path, self.bus_fares_data, self.reference_data.route_ids,
-
-                                self.reference_data.trip_to_route, self.reference_data.fuel_costs,
-                                self.path_output_folder, self.incentives_data, max_age, max_income)
-
-        # Get the data from the generated csv files
-        self.trips_df = pd.read_csv(self.path_output_folder / "trips_dataframe.csv")
-        self.person_df = pd.read_csv(self.path_output_folder / "persons_dataframe.csv")
-        self.activities_df = pd.read_csv(self.path_output_folder / "activities_dataframe.csv")
-        self.legs_df = pd.read_csv(self.path_output_folder / "legs_dataframe.csv")
-        self.paths_traversals_df = pd.read_csv(self.path_output_folder / "path_traversals_dataframe.csv")
+        person_sources = [self.output_plans_path, self.persons_path, self.households_path]
+        input_paths = [self.path_output_folder / COMPETITION / SUBMISSION_INPUTS / "MassTransitFares.csv",
+                       self.path_output_folder / COMPETITION / SUBMISSION_INPUTS / "ModeIncentives.csv"]
+        csv_folder_path = self.path_output_folder if self.export_csv else None
+
+        # The persons are parsed once for all the iterations
+        if self.person_df is None:
+            self.person_df = self.load_persons(person_sources)
+        elif self.export_csv:
+            parser.export_csv_files({"persons": self.person_df}, self.path_output_folder, self.writer)
+
+        # The DataFrames of the iteration are cached in its folder as long as the files they are parsed from are
+        # unchanged: the fares and incentives of the trips depend on the persons, on the inputs and on the routes and
+        # fuel types of the reference data
+        cache = DataFrameCache(iteration_folder / CACHE,
+                               [self.events_path, self.experienced_plans_path] + person_sources + input_paths +
+                               self.reference_data.parsing_files,
+                               version=CACHE_VERSION)
+        if cache.is_valid(ITERATION_DATAFRAMES):
+            frames = {name: cache.load(name) for name in ITERATION_DATAFRAMES}
+            if self.export_csv:
+                parser.export_csv_files(frames, self.path_output_folder, self.writer)
+        else:
+            # Parsing, and creating the csv files in the output folder if requested
+            sources = cache.source_signatures()
+            frames = parser.parse_iteration_outputs(self.events_path, self.experienced_plans_path,
+                                                    self.person_df.set_index("PID"), self.bus_fares_data,
+                                                    self.reference_data.route_ids, self.reference_data.trip_to_route,
+                                                    self.reference_data.fuel_costs, self.incentives_data, max_age,
+                                                    max_income, csv_folder_path=csv_folder_path, writer=self.writer,
+                                                    legs_workers=self.legs_workers)
+            self.writer.submit(cache.save, {name: frame.copy(deep=False) for name, frame in frames.items()}, sources)
+
+        self.trips_df = frames["trips"]
+        self.activities_df = frames["activities"]
+        self.legs_df = frames["legs"]
+        self.paths_traversals_df = frames["path_traversals"]
         self.linkstats_file = self.path_output_folder / ITERS / "it.{0}".format(
             self.number_iterations) / "{0}.linkstats.csv.gz".format(
             self.number_iterations)
+
+    @property
+    def trip_cube(self):
+        """ Trips aggregated by mode, income group, age group, distance group and hour (see trip_cube.py), built on
+        first use and shared by the mode choice plots of the run
+        """
+        if self._trip_cube is None:
+            self._trip_cube = build_trip_cube(self.trips_df, self.person_df)
+        return self._trip_cube
+
+    def load_persons(self, person_sources):
+        """ Parse the attributes of the persons, or load them from the cache of the output folder
+
+        Parameters
+        ----------
+        person_sources : list of Path
+            `outputPlans.xml`, `outputPersonAttributes.xml` and `outputHouseholds.xml` files
+
+        Returns
+        -------
+        person_df : pandas DataFrame
+        """
+        cache = DataFrameCache(self.path_output_folder / CACHE, person_sources, version=CACHE_VERSION)
+        if cache.is_valid(["persons"]):
+            person_df = cache.load("persons")
+            if self.export_csv:
+                parser.export_csv_files({"persons": person_df}, self.path_output_folder, self.writer)
+        else:
+            sources = cache.source_signatures()
+            person_df = parser.get_persons_attributes_output(*person_sources).reset_index()
+            if self.export_csv:
+                parser.export_csv_files({"persons": person_df}, self.path_output_folder, self.writer)
+            self.writer.submit(cache.save, {"persons": person_df.copy(deep=False)}, sources)
+        return person_df
+
+
+def load_iterations(path_output_folder, iterations, reference_data: ReferenceData):
+    """ Post-process several iterations of a simulation, e.g. to follow its convergence
+
+    The persons and the writer of the cache are shared by all the iterations, and only the iterations that are not
+    cached yet (in `ITERS/it.<iteration>/parsed_dataframes_cache`) are parsed.
+
+    Parameters
+    ----------
+    path_output_folder : Path
+        Output folder of the simulation
+
+    iterations : list of int
+        Iterations to post-process
+
+    reference_data : ReferenceData
+
+    Returns
+    -------
+    results : dictionary
+        {iteration: ResultFiles}
+    """
+    writer = BackgroundWriter()
+    results = {}
+    person_df = None
+    for iteration in iterations:
+        results[iteration] = ResultFiles(path_output_folder, iteration, reference_data, person_df=person_df,
+                                         writer=writer)
+        person_df = results[iteration].person_df
+    return results
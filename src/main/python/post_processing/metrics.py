@@ -0,0 +1,193 @@
+"""Aggregate metrics of a run computed from its path traversals and legs: distances traveled per mode, vehicle miles
+traveled (VMT), emissions, and costs and benefits per bus route.
+
+The path traversals and the legs are grouped once by mode, and the distances of all the modes are converted at once by
+vectors of factors. The costs of the buses and the fares of the bus legs are summed per route before being joined.
+"""
+import numpy as np
+import pandas as pd
+
+from .plans_parser import ROUTE_COLUMNS, add_route_columns
+
+METERS_TO_MILES = 0.000621371
+# Modes of the VMT and emissions outputs, in their order
+VMT_MODES = ["bus", "car", "on_demand_ride", "walk"]
+# PM2.5 emissions per mile traveled, in grams, for each mode
+EMISSION_FACTORS = pd.Series({"bus": 0.259366648, "car": 0.001716086, "on_demand_ride": 0.001716086, "walk": 0.},
+                             name="emission_factor")
+# Costs and benefits per bus route, in their order
+ROUTE_COSTS_AND_BENEFITS = ["OperationalCosts", "FuelCost", "Fare"]
+
+
+def read_emission_factors(path):
+    """ Read a table of emission factors, e.g. for another pollutant or other vehicles
+
+    Parameters
+    ----------
+    path: pathlib.Path object
+        csv file with the `mode` and `emission_factor` (grams per mile) columns, one row per mode of VMT_MODES
+
+    Returns
+    -------
+    emission_factors: pandas Series
+        Emission factors indexed by mode, as EMISSION_FACTORS
+    """
+    return pd.read_csv(path).set_index("mode")["emission_factor"]
+
+
+def get_mode_distances(paths_traversals_df, legs_df, on_demand_from_legs=False):
+    """ Total distance traveled per mode
+
+    The distances of the buses and the walks are the lengths of their path traversals, and those of the cars the
+    distances of the car legs. The distance of the on-demand rides is the length of the path traversals of the
+    ride-hail vehicles (including the trips to pick up the passengers), or the distance of the on-demand ride legs.
+
+    Parameters
+    ----------
+    paths_traversals_df: pandas DataFrame
+        Gathers info on all traversal paths done by agents: output of the event_parser.py
+
+    legs_df: pandas DataFrame
+        Gathers info on each single leg constituing trips of agents: output of the event_parser.py
+
+    on_demand_from_legs: bool
+        Whether the distance of the on-demand rides is the distance of the legs rather than of the path traversals
+
+    Returns
+    -------
+    distances: pandas Series
+        Distance in meters, indexed by the VMT_MODES
+    """
+    path_traversal_modes = np.select(
+        [paths_traversals_df["mode"].values == "walk", paths_traversals_df["mode"].values == "bus",
+         paths_traversals_df["vehicle"].astype(str).str.contains("rideHailVehicle", regex=False).values],
+        ["walk", "bus", "on_demand_ride"], default="")
+    leg_modes = legs_df["Mode"].astype(object).map({"car": "car", "OnDemand_ride": "on_demand_ride"})
+
+    path_traversal_distances = paths_traversals_df["length"].groupby(path_traversal_modes).sum()
+    leg_distances = legs_df["Distance_m"].groupby(leg_modes.values).sum()
+    from_legs = ["car", "on_demand_ride"] if on_demand_from_legs else ["car"]
+    return pd.Series([(leg_distances if mode in from_legs else path_traversal_distances).get(mode, 0.)
+                      for mode in VMT_MODES], index=VMT_MODES, dtype=float)
+
+
+def get_vmt_dataframe(paths_traversals_df, legs_df, on_demand_from_legs=False):
+    """ Daily vehicle miles traveled per mode
+
+    Parameters
+    ----------
+    paths_traversals_df, legs_df, on_demand_from_legs:
+        see get_mode_distances()
+
+    Returns
+    -------
+    vmt: pandas DataFrame
+        One row, one column per mode of VMT_MODES, rounded to the mile
+    """
+    vmt = get_mode_distances(paths_traversals_df, legs_df, on_demand_from_legs) * METERS_TO_MILES
+    return vmt.round(0).to_frame().T.reset_index(drop=True)
+
+
+def get_emissions_dataframe(paths_traversals_df, legs_df, emission_factors=EMISSION_FACTORS):
+    """ Daily emissions per mode
+
+    Parameters
+    ----------
+    paths_traversals_df, legs_df:
+        see get_mode_distances()
+
+    emission_factors: pandas Series
+        Emissions per mile indexed by mode, EMISSION_FACTORS (PM2.5) by default. See read_emission_factors()
+
+    Returns
+    -------
+    emissions: pandas DataFrame
+        One row, one column per mode of VMT_MODES, rounded to the gram
+    """
+    emissions = get_mode_distances(paths_traversals_df, legs_df) * METERS_TO_MILES * \
+        emission_factors.reindex(VMT_MODES).values
+    return emissions.round(0).to_frame().T.reset_index(drop=True)
+
+
+def get_bus_routes(bus_df, vehicle_column, trip_to_route):
+    """ Route of each bus path traversal or leg
+
+    Parameters
+    ----------
+    bus_df: pandas DataFrame
+        Bus path traversals or legs. The routes are those of the `route_id` column added at parsing time, or are mapped
+        again from the vehicle ids for the dataframes read back from csv files
+
+    vehicle_column: str
+        "vehicle" for the path traversals, "Veh" for the legs
+
+    trip_to_route: dictionary
+        Correspondance between trip_ids and route_ids
+
+    Returns
+    -------
+    routes: pandas Series
+        Route id of each row
+
+    Raises
+    ------
+    KeyError
+        If the GTFS trip of a bus has no route in `trip_to_route`, as for the fares of the bus legs
+    """
+    if all(column in bus_df.columns for column in ROUTE_COLUMNS) and \
+            isinstance(bus_df["route_id"].dtype, pd.CategoricalDtype):
+        route_columns = bus_df[ROUTE_COLUMNS]
+    else:
+        route_columns = add_route_columns(pd.DataFrame({"vehicle": bus_df[vehicle_column].values, "mode": "bus"},
+                                                       index=bus_df.index), "vehicle", "mode", trip_to_route)
+    routes = route_columns["route_id"]
+    unmapped = routes.isnull().values
+    if unmapped.any():
+        raise KeyError("No route for the GTFS trips {}".format(
+            pd.unique(route_columns["gtfs_trip_id"].values[unmapped]).tolist()))
+    return routes.astype(object)
+
+
+def get_route_costs_and_benefits(paths_traversals_df, legs_df, operational_costs, trip_to_route):
+    """ Operational costs and fuel costs of the buses, and fares of the bus legs, per bus route
+
+    The path traversals and the legs are summed per route separately, then joined: the join has one row per route.
+
+    Parameters
+    ----------
+    paths_traversals_df, legs_df:
+        see get_mode_distances()
+
+    operational_costs: dictionary
+        Operational costs per hour of service for each bus vehicle type
+
+    trip_to_route: dictionary
+        Correspondance between trip_ids and route_ids
+
+    Returns
+    -------
+    costs_and_benefits: pandas DataFrame
+        One row per route (`route_id` index), one column per item of ROUTE_COSTS_AND_BENEFITS, in $. The routes served
+        without bus legs have no fares, and the routes with bus legs but no path traversals have no costs
+
+    Raises
+    ------
+    KeyError
+        If a bus vehicle type has no operational costs, or the GTFS trip of a bus has no route
+    """
+    bus_df = paths_traversals_df.loc[paths_traversals_df["mode"].values == "bus"]
+    vehicle_types = bus_df["vehicleType"].astype(object).values
+    costs_per_hour = pd.Series(operational_costs, dtype=float).reindex(vehicle_types).values
+    if pd.isnull(costs_per_hour).any():
+        raise KeyError("No operational costs for the vehicle types {}".format(
+            pd.unique(vehicle_types[pd.isnull(costs_per_hour)]).tolist()))
+    service_hours = (bus_df["arrivalTime"].values - bus_df["departureTime"].values) / 3600
+    costs = pd.DataFrame({"OperationalCosts": costs_per_hour * service_hours, "FuelCost": bus_df["FuelCost"].values})
+    costs = costs.groupby(get_bus_routes(bus_df, "vehicle", trip_to_route).values).sum()
+
+    bus_legs_df = legs_df.loc[legs_df["Mode"].values == "bus"]
+    fares = bus_legs_df["Fare"].groupby(get_bus_routes(bus_legs_df, "Veh", trip_to_route).values).sum()
+
+    costs_and_benefits = costs.join(fares.rename("Fare"), how="outer").fillna(0.)
+    costs_and_benefits.index.name = "route_id"
+    return costs_and_benefits[ROUTE_COSTS_AND_BENEFITS]
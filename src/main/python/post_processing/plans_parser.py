@@ -1,12 +1,42 @@
 import gzip
+import multiprocessing
+import os
+from array import array
+from collections import namedtuple
 from pathlib import Path
 
-import dask.dataframe as dd
-
 import numpy as np
 import pandas as pd
 
-from data_parsing import extract_dataframe, open_xml
+from data_parsing import iter_elements, load_events, numbers_to_strings
+from range_parsing import add_range_columns
+
+# Only these events and attributes are used to rebuild the legs of the trips: all the others are dropped while the
+# events file is decoded
+LEGS_EVENT_TYPES = ['PathTraversal', 'PersonEntersVehicle']
+LEGS_EVENT_COLUMNS = ['time', 'type', 'person', 'vehicle', 'driver', 'vehicleType', 'length', 'numPassengers',
+                      'departureTime', 'arrivalTime', 'mode', 'links', 'primaryFuelType', 'primaryFuel']
+# Modes of the trips eligible to incentives, and table of the incentives for these modes by age and income
+INCENTIVE_ELIGIBLE_MODES = ['OnDemand_ride', 'drive_transit', 'walk_transit']
+IncentiveTable = namedtuple('IncentiveTable', ['modes', 'income_edges', 'amounts'])
+# Modes of the legs, in the order of their bits in the bitmasks of the modes of the trips
+LEG_MODES = ['walk', 'car', 'bus', 'OnDemand_ride']
+# Attributes of the persons kept from the `outputPersonAttributes.xml` file
+PERSON_ATTRIBUTES = ['excluded-modes', 'income', 'rank', 'valueOfTime']
+# Files the dataframes created by output_parse() are exported to. The trips and persons files start with the ID of the
+# trips and persons, the other files with the row numbers of the dataframes
+OUTPUT_CSV_FILES = {"trips": "trips_dataframe.csv",
+                    "persons": "persons_dataframe.csv",
+                    "activities": "activities_dataframe.csv",
+                    "legs": "legs_dataframe.csv",
+                    "path_traversals": "path_traversals_dataframe.csv"}
+CSV_ROW_NUMBERS = ["activities", "legs", "path_traversals"]
+# GTFS trip id in the ids of the buses: `<agency>:<trip id>-<suffix>`
+GTFS_TRIP_ID_PATTERN = r'^[^:]*:([^:-]*)'
+# Columns of the legs and path traversals dataframes kept categorical in the outputs of the parsing
+ROUTE_COLUMNS = ['gtfs_trip_id', 'route_id']
+# Minimum number of path traversal and vehicle entry events handled by each worker process rebuilding the legs
+EVENTS_PER_PARTITION = 500000
 
 
 # ########### 1. INTERMEDIARY FUNCTIONS ###########
@@ -31,6 +61,73 @@ def unzip_file(path: Path):
         return path
 
 
+def compose_ids(prefixes, separator, ordinals):
+    """ Readable IDs made of a prefix and an ordinal, e.g. the trip ID "<person id>_t-<trip ordinal>"
+
+    The persons, trips and legs are referred to by integer codes and ordinals while the outputs are processed: the
+    readable IDs are only composed when the dataframes are exported.
+
+    Parameters
+    ----------
+    prefixes: array-like
+        Prefix of each ID, e.g. the person IDs
+
+    separator: str
+        e.g. "_t-"
+
+    ordinals: array-like of ints
+
+    Returns
+    -------
+    : numpy array
+    """
+    return (pd.Series(np.asarray(prefixes, dtype=object)) + separator + pd.Series(ordinals).astype(str)).values
+
+
+def id_strings(ids):
+    """ Person or vehicle IDs of the events as strings, written as the person IDs of the plans
+
+    The IDs of events parsed as numbers (e.g. numeric person IDs in the events of another tool) are written without
+    decimals, so that the driver 1.0 is the person "1".
+
+    Parameters
+    ----------
+    ids: pandas Series
+
+    Returns
+    -------
+    : pandas Series of strings
+    """
+    if pd.api.types.is_numeric_dtype(ids):
+        ids = numbers_to_strings(ids)
+    return ids.astype(str)
+
+
+def lookup_person_values(person_df, column, pids):
+    """ Values of an attribute of the persons, looked up once per distinct person rather than once per row
+
+    Parameters
+    ----------
+    person_df: pandas DataFrame
+        Attributes of the persons, indexed by person ID: output of the get_persons_attributes_output() function
+
+    column: str
+        Attribute looked up
+
+    pids: pandas Series
+        Person IDs, categorical in the dataframes of the parser: the integer codes of the persons then index the
+        values looked up for the categories
+
+    Returns
+    -------
+    : numpy array
+        Values of the attribute as floats, NaN for the persons missing from `person_df`
+    """
+    pids = pd.Categorical(pids)
+    values = person_df[column].reindex(pids.categories).values.astype(float)
+    return pd.api.extensions.take(values, pids.codes, allow_fill=True)
+
+
 def parse_bus_fare_input(bus_fare_data_df, route_ids, max_age):
     """Processes the `MassTransitFares.csv` input file into a dataframe with rows = ages and columns = routes
 
@@ -47,38 +144,36 @@ def parse_bus_fare_input(bus_fare_data_df, route_ids, max_age):
     -------
     bus_fare_per_route_df: pandas DataFrame
         Dataframe with rows = ages and columns = routes
+
+    Raises
+    ------
+    KeyError
+        If fares are given for routes missing from the GTFS data
     """
 
-    bus_fare_per_route_df = pd.DataFrame(np.zeros((max_age + 1, len(route_ids))), columns=route_ids)
+    add_range_columns(bus_fare_data_df, 'age')
+    bus_fare_per_route = np.zeros((max_age + 1, len(route_ids)))
 
     routes = bus_fare_data_df['routeId'].unique()
+    unknown_routes = [int(r) for r in routes if not np.isnan(r) and int(r) not in route_ids]
+    if len(unknown_routes) > 0:
+        raise KeyError("No route {} in the GTFS data for the fares".format(unknown_routes))
     for r in routes:
         if np.isnan(r):
-            cols = route_ids
+            cols = slice(None)
             r_fares = bus_fare_data_df.loc[np.isnan(bus_fare_data_df['routeId']),]
         else:
-            cols = int(r)
+            cols = route_ids.index(int(r))
             r_fares = bus_fare_data_df.loc[bus_fare_data_df['routeId'] == r,]
-        for i, row in r_fares.iterrows():
-            age_group = row['age']
-            left = age_group[0]
-            ages = age_group[1:-1].split(':')
-            right = age_group[-1]
-            if left == '(':
-                min_a = int(ages[0]) + 1
-            else:
-                min_a = int(ages[0])
-            if right == ')':
-                max_a = int(ages[1]) - 1
-            else:
-                max_a = int(ages[1])
-            bus_fare_per_route_df.loc[min_a:max_a, cols] = float(row['amount'])
-
-    return bus_fare_per_route_df
+        for age_interval, amount in zip(r_fares['age_interval'], r_fares['amount']):
+            bus_fare_per_route[max(age_interval.left, 0):age_interval.right + 1, cols] = float(amount)
+
+    return pd.DataFrame(bus_fare_per_route, columns=route_ids)
 
 
 def parse_incentive_input(incentive_data, max_age, max_income):
-    """Processes the `MassTransitFares.csv` input file into a dataframe with rows = ages and columns = routes
+    """Processes the `ModeIncentives.csv` input file into an incentive table: the incomes are split into the bins where
+    the incentives are constant, and the incentives are stored in a small (mode, age, income bin) array
 
     Parameters
     ----------
@@ -91,74 +186,70 @@ def parse_incentive_input(incentive_data, max_age, max_income):
 
     Returns
     -------
-    incentive_dict: Dictionaries of pandas DataFrames {mode: incentive_per_age_income}
-        incentive_per_age_income: Dataframe with rows = ages and columns = incomes
+    incentive_table: IncentiveTable
+        modes: list of the modes eligible to incentives
+        income_edges: sorted array of the lower bounds of the income bins, ending with `max_income + 1`
+        amounts: array of the incentives with shape (modes, max_age + 1, income bins)
     """
+    add_range_columns(incentive_data, 'age')
+    add_range_columns(incentive_data, 'income')
+    age_ranges = [(max(interval.left, 0), min(interval.right, max_age)) for interval in incentive_data['age_interval']]
+    income_ranges = [(max(interval.left, 0), min(interval.right, max_income))
+                     for interval in incentive_data['income_interval']]
+
+    # the incentives only change at the bounds of the income ranges
+    income_edges = np.unique([0, max_income + 1] + [bound for min_i, max_i in income_ranges
+                                                    for bound in (min_i, max_i + 1) if bound <= max_income + 1])
+    amounts = np.zeros((len(INCENTIVE_ELIGIBLE_MODES), max_age + 1, len(income_edges) - 1))
+
+    # later rows override earlier ones, as when the incentives are written into a full age x income table
+    for (i, row), (min_a, max_a), (min_i, max_i) in zip(incentive_data.iterrows(), age_ranges, income_ranges):
+        if row['mode'] not in INCENTIVE_ELIGIBLE_MODES or min_a > max_a or min_i > max_i:
+            continue
+        m = INCENTIVE_ELIGIBLE_MODES.index(row['mode'])
+        first_bin, last_bin = np.searchsorted(income_edges, [min_i, max_i + 1])
+        amounts[m, min_a:max_a + 1, first_bin:last_bin] = float(row['amount'])
+
+    return IncentiveTable(list(INCENTIVE_ELIGIBLE_MODES), income_edges, amounts)
+
+
+def calc_incentives(trips_df, incentive_table, person_df):
+    """ Computes the incentive received for each trip, all at once
+
+    Parameters
+    ----------
+    trips_df: pandas DataFrame
+        Record of each person's trips' attributes, with their `realizedTripMode`
 
-    incentive_elligible = {"OnDemand_ride", "drive_transit", "walk_transit"}
-
-    incentive_per_age_income = pd.DataFrame(np.zeros((max_age + 1, max_income + 1)))
-
-    incentive_dict = {}
-    for m in incentive_elligible:
-        incentive_per_age_income = pd.DataFrame(np.zeros((max_age + 1, max_income + 1)))
-        # get all incentive rows for this mode:
-        m_incentives = incentive_data.loc[incentive_data['mode'] == m,]
-        if len(m_incentives) > 0:
-            for i, row in m_incentives.iterrows():
-                age_group = row['age']
-                income_group = row['income']
-
-                left_a = age_group[0]
-                ages = age_group[1:-1].split(':')
-                right_a = age_group[-1]
-                if left_a == '(':
-                    min_a = int(ages[0]) + 1
-                else:
-                    min_a = int(ages[0])
-                if right_a == ')':
-                    max_a = int(ages[1]) - 1
-                else:
-                    max_a = int(ages[1])
-
-                left_i = income_group[0]
-                incomes = income_group[1:-1].split(':')
-                right_i = income_group[-1]
-                if left_i == '(':
-                    min_i = int(incomes[0]) + 1
-                else:
-                    min_i = int(incomes[0])
-                if right_i == ')':
-                    max_i = int(incomes[1]) - 1
-                else:
-                    max_i = int(incomes[1])
-
-                incentive_per_age_income.loc[min_a:max_a, min_i:max_i] = float(row['amount'])
-        incentive_dict[m] = incentive_per_age_income
-
-    return incentive_dict
-
-
-def find_incentive(row, incentive_df, person_df):
-    pid = row['PID']
-
-    age = person_df.loc[pid, 'Age']
-    income = person_df.loc[pid, 'income']
-
-    incentive = incentive_df.loc[int(float(age)), int(float(income))]
-    return incentive
-
-
-def calc_incentives(trips_df, incentive_dict, person_df):
-    # row: row from trips dataframe
-    incentive_elligible = {"OnDemand_ride", "drive_transit", "walk_transit"}
+    incentive_table: IncentiveTable
+        Output of the parse_incentive_input() function
+
+    person_df: pandas DataFrame
+        Attributes of the persons, indexed by person ID: output of the get_persons_attributes_output() function
+
+    Returns
+    -------
+    trips_df: pandas DataFrame
+        trips_df augmented with an additional column of incentives
+    """
     trips_df['Incentive'] = np.zeros((trips_df.shape[0]))
-    for m in incentive_elligible:
-        incentive_df = incentive_dict[m]
-        these_trips = trips_df.loc[trips_df['realizedTripMode'] == m,]
 
-        trips_df.loc[trips_df['realizedTripMode'] == m, 'Incentive'] = these_trips.apply(
-            lambda x: find_incentive(x, incentive_df, person_df), axis=1)
+    mode_positions = pd.Index(incentive_table.modes).get_indexer(trips_df['realizedTripMode'])
+    eligible = mode_positions >= 0
+    pids = trips_df['PID'][eligible]
+    ages = lookup_person_values(person_df, 'Age', pids)
+    incomes = lookup_person_values(person_df, 'income', pids)
+    max_age = incentive_table.amounts.shape[1] - 1
+    unknown = pd.isnull(ages) | pd.isnull(incomes) | (ages > max_age) | (ages < 0) | \
+        (incomes >= incentive_table.income_edges[-1]) | (incomes < 0)
+    if unknown.any():
+        raise KeyError("No incentives for the age and income of the persons {}".format(
+            pids[unknown].unique().tolist()))
+
+    # incomes are truncated to whole dollars, then located in the income bins
+    income_bins = np.searchsorted(incentive_table.income_edges, np.trunc(incomes.astype(float)), side='right') - 1
+    trips_df.loc[eligible, 'Incentive'] = incentive_table.amounts[mode_positions[eligible], ages.astype(np.int64),
+                                                                  income_bins]
     return trips_df
 
 
@@ -176,16 +267,90 @@ def calc_fuel_costs(legs_df, fuel_cost_dict):
     return legs_df
 
 
-def calc_transit_fares(row, bus_fare_dict, person_df, trip_to_route):
-    pid = row['PID']
-    age = person_df.loc[pid, 'Age']
-    vehicle = row['Veh']
-    route = trip_to_route[vehicle.split(':')[1].split('-')[0]]
-    fare = bus_fare_dict.loc[age, route]
-    return fare
+def add_route_columns(df, vehicle_column, mode_column, trip_to_route):
+    """ Adds the GTFS trip and the route of the bus rows of the legs or path traversals dataframe, as categorical columns
+
+    The GTFS trip id is extracted from the ids of the buses (`<agency>:<trip id>-<suffix>`), once per bus, and mapped
+    to the route of the trip.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        Legs or path traversals
+
+    vehicle_column, mode_column: str
+        Columns of the vehicle ids and of the modes: "Veh" and "Mode" for the legs, "vehicle" and "mode" for the path
+        traversals
+
+    trip_to_route: dictionary
+        route_id / trip_id correspondence
+
+    Returns
+    -------
+    df: pandas DataFrame
+        With the `gtfs_trip_id` and `route_id` columns, missing for the rows other than bus rows, and for the buses
+        whose trip has no route
+    """
+    is_bus = (df[mode_column] == 'bus').values
+    vehicle_codes, vehicles = pd.factorize(np.asarray(df[vehicle_column], dtype=object)[is_bus])
+    gtfs_trip_ids = pd.Series(vehicles, dtype=object).str.extract(GTFS_TRIP_ID_PATTERN, expand=False)
+    trip_codes, trip_ids = pd.factorize(gtfs_trip_ids, sort=True)
+
+    route_table = pd.Series(trip_to_route, dtype=None if trip_to_route else object)
+    positions = route_table.index.get_indexer(trip_ids)
+    route_codes, route_ids = pd.factorize(route_table.values[positions[positions >= 0]], sort=True)
+    # route code of each trip code, and -1 for the code -1 of the rows without trip (the last element)
+    trip_route_codes = np.full(len(trip_ids) + 1, -1)
+    trip_route_codes[:-1][positions >= 0] = route_codes
+
+    row_trip_codes = np.full(len(df), -1)
+    row_trip_codes[is_bus] = trip_codes[vehicle_codes]
+    df['gtfs_trip_id'] = pd.Categorical.from_codes(row_trip_codes, trip_ids)
+    df['route_id'] = pd.Categorical.from_codes(trip_route_codes[row_trip_codes], route_ids)
+    return df
+
 
+def calc_transit_fares(bus_legs_df, bus_fare_dict, person_df):
+    """ Computes the fares of bus legs, all at once
 
-def calc_fares(legs_df, ride_hail_fares, bus_fare_dict, person_df, trip_to_route):
+    The fares are gathered from the age x route array of fares, at the age of each passenger and the position of each
+    route.
+
+    Parameters
+    ----------
+    bus_legs_df: pandas DataFrame
+        Bus legs, with the `PID` of the passenger and the `gtfs_trip_id` and `route_id` of the bus: see
+        add_route_columns()
+
+    bus_fare_dict: pandas DataFrame
+        Dataframe with rows = ages and columns = routes: output of the parse_bus_fare_input() function
+
+    person_df: pandas DataFrame
+        Attributes of the persons, indexed by person ID: output of the get_persons_attributes_output() function
+
+    Returns
+    -------
+    fares: numpy array
+        Fare of each bus leg
+    """
+    routes = bus_legs_df['route_id'].values
+    if pd.isnull(routes).any():
+        raise KeyError("No route for the GTFS trips {}".format(
+            pd.unique(bus_legs_df['gtfs_trip_id'].values[pd.isnull(routes)]).tolist()))
+    route_positions = bus_fare_dict.columns.get_indexer(routes.categories)
+    if (route_positions < 0).any():
+        raise KeyError("No fares for the routes {}".format(routes.categories[route_positions < 0].tolist()))
+
+    ages = lookup_person_values(person_df, 'Age', bus_legs_df['PID'])
+    unknown = pd.isnull(ages) | (ages >= len(bus_fare_dict))
+    if unknown.any():
+        raise KeyError("No fares for the age of the persons {}".format(
+            bus_legs_df['PID'][unknown].unique().tolist()))
+
+    return bus_fare_dict.values[ages.astype(np.int64), route_positions[routes.codes]]
+
+
+def calc_fares(legs_df, ride_hail_fares, bus_fare_dict, person_df):
     # legs_df: legs_dataframe
     # ride_hail_fares: {'base': $, 'duration': $/hour, 'distance': $/km}
     # transit_fares isnt being used currently - would need to be updated to compute fare based on age
@@ -193,8 +358,9 @@ def calc_fares(legs_df, ride_hail_fares, bus_fare_dict, person_df, trip_to_route
 
     legs_df["Fare"] = np.zeros(legs_df.shape[0])
 
-    legs_df.loc[legs_df["Mode"] == 'bus', "Fare"] = legs_df.loc[legs_df["Mode"] == 'bus'].apply(
-        lambda row: calc_transit_fares(row, bus_fare_dict, person_df, trip_to_route), axis=1)
+    is_bus = legs_df["Mode"] == 'bus'
+    legs_df.loc[is_bus, "Fare"] = calc_transit_fares(legs_df.loc[is_bus, ['PID'] + ROUTE_COLUMNS], bus_fare_dict,
+                                                     person_df)
 
     legs_df.loc[legs_df["Mode"] == 'OnDemand_ride', "Fare"] = ride_hail_fares['base'] + (
             pd.to_timedelta(legs_df['Duration_sec']).dt.seconds / 60) * float(ride_hail_fares['duration']) + (
@@ -205,278 +371,525 @@ def calc_fares(legs_df, ride_hail_fares, bus_fare_dict, person_df, trip_to_route
     return legs_df
 
 
-def one_path(path_trav, leg_id, pid, trip_id):
-    # extracts leg data from path traversal
-    # returns a leg_dataframe row
-
-    l_row = path_trav
-    leg_id_this = leg_id + l_row.name
-    leg_id_full = trip_id + "_l-" + str(leg_id)
-    veh_id = l_row["vehicle"]
-    leg_start_time = l_row['departureTime']
-    veh_type = l_row['vehicleType']
-    distance = l_row['length']
-    leg_end_time = l_row['arrivalTime']
-    leg_duration = int(leg_end_time) - int(leg_start_time)
-    leg_path = l_row['links']
-    leg_mode = l_row['mode']
-    leg_fuel = l_row['primaryFuel']
-    leg_fuel_type = l_row['primaryFuelType']
-
-    # return the leg record
-    return [pid, trip_id, leg_id_full, leg_mode, veh_id, veh_type, leg_start_time, leg_end_time, leg_duration, distance,
-            leg_path, leg_fuel, leg_fuel_type]
-
-
-def parse_transit_trips(row, non_bus_path_traversal_events, bus_path_traversal_events, enter_veh_events):
-    # inputs:
-    # row: a row from transit_trips_df
-    # path_traversal_events: non-transit path traversal df
-    # bus_path_traversal_events: transit path traversal df
-    # enter_veh_events: enter vehicle events
-
-    leg_array = []
-    pid = row['PID']
-    trip_id = row['Trip_ID']
-    start_time = row['Start_time'].total_seconds()
-    duration = row['Duration_sec']
-    end_time = row['End_time']
-    mode = row['Mode']
-    # initiate the leg ID counter
-    leg_id = 0
-
-    # get all path traversals occuring within the time frame of this trip in which the driver is the person making this trip
-    path_trav = non_bus_path_traversal_events[
-        (non_bus_path_traversal_events['driver'] == pid) & (
-                    non_bus_path_traversal_events['arrivalTime'] <= end_time) & (
-                non_bus_path_traversal_events['departureTime'] >= start_time)]
-    path_trav = path_trav.reset_index(drop=True)
-
-    # get the vehicle entry events corresponding to this person during the time frame of this trip
-    veh_entries = enter_veh_events[
-        (enter_veh_events['person'] == pid) & (enter_veh_events['time'] >= start_time) & (
-                enter_veh_events['time'] <= end_time)]
-
-    # get bus entry events for this person & trip
-    bus_entries = veh_entries[veh_entries['vehicle'].str.startswith('siouxareametro-sd-us:', na=False)]
-    bus_entries = bus_entries.reset_index(drop=True)
-
-    if len(bus_entries) > 0:
-        prev_entry_time = start_time
-        for idx, bus_entry in bus_entries.iterrows():
-            if idx < len(bus_entries) - 1:
-                next_entry = bus_entries.loc[idx + 1]
-                next_entry_time = next_entry['time']
-            else:
-                next_entry_time = end_time
-
-            # get all path traversals occuring before the bus entry
-            prev_path_trav = path_trav[
-                (path_trav['arrivalTime'] <= bus_entry['time']) & (path_trav['arrivalTime'] >= prev_entry_time)]
-
-            # get all path traversals occuring after the bus entry
-            post_path_trav = path_trav[
-                (path_trav['arrivalTime'] > bus_entry['time']) & (path_trav['arrivalTime'] <= next_entry_time)]
-            prev_path_trav = prev_path_trav.reset_index(drop=True)
-            post_path_trav = post_path_trav.reset_index(drop=True)
-            prev_entry_time = bus_entry['time']
-
-            # iterate through the path traversals prior to the bus entry
-
-            if len(prev_path_trav) > 0:
-                these_legs = prev_path_trav.apply(lambda row1: one_path(row1, leg_id, pid, trip_id), axis=1)
-                leg_array.extend(these_legs)
-
-            # record transit leg
-            leg_id += 1
-            leg_id_full = trip_id + "_l-" + str(leg_id)
-            veh_id = bus_entry['vehicle']
-            leg_start_time = int(bus_entry['time'])
-            if len(post_path_trav) > 0:
-                leg_end_time = int(post_path_trav['departureTime'].values[0])
-                bus_path_trav = bus_path_traversal_events[(bus_path_traversal_events['vehicle'] == veh_id) & (
-                        bus_path_traversal_events['arrivalTime'] <= leg_end_time) & (bus_path_traversal_events[
-                                                                                         'departureTime'] >= leg_start_time)]
-            else:
-                leg_end_time = next_entry_time
-                bus_path_trav = bus_path_traversal_events[(bus_path_traversal_events['vehicle'] == veh_id) & (
-                        bus_path_traversal_events['arrivalTime'] < leg_end_time) & (bus_path_traversal_events[
-                                                                                        'departureTime'] >= leg_start_time)]
-
-            leg_duration = int(leg_end_time - bus_entry['time'])
-            # find the path traversals of the bus corresponding to the bus entry for this trip, occuring between the last prev_path_traversal and the first post_path_traversal
-
-            if len(bus_path_trav) > 0:
-                veh_type = bus_path_trav['vehicleType'].values[0]
-                distance = bus_path_trav['length'].sum()
-                leg_path = [path['links'] for p, path in bus_path_trav.iterrows()]
-                leg_mode = bus_path_trav['mode'].values[0]
-                leg_fuel = 0
-                leg_fuel_type = 'Diesel'
-                leg_array.append(
-                    [pid, trip_id, leg_id_full, leg_mode, veh_id, veh_type, leg_start_time, leg_end_time,
-                     leg_duration,
-                     distance, leg_path, leg_fuel, leg_fuel_type])
-
-            # iterate through the path traversals after the bus entry
-            if len(post_path_trav) > 0:
-                these_legs = post_path_trav.apply(lambda row1: one_path(row1, leg_id, pid, trip_id), axis=1)
-                leg_array.extend(these_legs)
-
-    # if the agent underwent replanning, there will be no bus entry
-    else:
-        leg_array = parse_walk_car_trips(row, non_bus_path_traversal_events, enter_veh_events)
-
-    return leg_array
-
-
-def parse_walk_car_trips(row, path_traversal_events, enter_veh_events):
-    # inputs:
-    # row: a row from transit_trips_df
-    # path_traversal_events: non-transit path traversal df
-    # person_costs: person cost events df
-    # enter_veh_events: enter vehicle events
-
-    leg_array = []
-    pid = row['PID']
-    trip_id = row['Trip_ID']
-    start_time = row['Start_time']
-    duration = row['Duration_sec']
-    end_time = row['End_time']
-    mode = row['Mode']
-    # initiate the leg ID counter
-    leg_id = 0
-
-    # get all path traversals occuring within the time frame of this trip in which the driver is the person making this trip
-
-    path_trav = path_traversal_events.loc[
-        (path_traversal_events['driver'] == pid) & (path_traversal_events['arrivalTime'] <= end_time) & (
-                path_traversal_events['departureTime'] >= start_time.total_seconds()),]
-    path_trav.reset_index(drop=True, inplace=True)
-    # iterate through the path traversals
-    if len(path_trav) > 0:
-        these_legs = path_trav.apply(lambda row: one_path(row, leg_id, pid, trip_id), axis=1)
-        leg_array.extend(these_legs)
-    return leg_array
-
-
-def parse_ridehail_trips(row, path_traversal_events, enter_veh_events):
-    # inputs:
-    # row: a row from transit_trips_df
-    # path_traversal_events: non-transit path traversal df
-    # person_costs: person cost events df
-    # enter_veh_events: enter vehicle events
-    # reserve_ridehail_events: ReserveRideHail events
-    leg_array = []
-    pid = row['PID']
-    trip_id = row['Trip_ID']
-    start_time = row['Start_time']
-    duration = row['Duration_sec']
-    end_time = row['End_time']
-    mode = row['Mode']
-    # initiate the leg ID counter
-    leg_id = 0
-
-    # get all vehicle entry events corresponding to this person during the time frame of this trip, not including those corresponding to a walking leg
-    veh_entry = enter_veh_events.loc[
-        (enter_veh_events['person'] == pid) & (enter_veh_events['time'] >= start_time.total_seconds()) & (
-                enter_veh_events['time'] <= end_time),]
-    veh_entry2 = veh_entry.loc[(veh_entry['vehicle'] != 'body-' + pid),]
-
-    # reservation = reserve_ridehail_events.loc[(reserve_ridehail_events['person']==pid)&(reserve_ridehail_events['time'] >= start_time.total_seconds()) & (reserve_ridehail_events['time'] <= end_time),]
-
-    try:
-        veh_id = veh_entry2['vehicle'].item()
-        leg_start_time = veh_entry2['time'].item()
-        # get the path traversal corresponding to this ridehail trip
-        path_trav = path_traversal_events.loc[(path_traversal_events['vehicle'] == veh_id) & (
-                path_traversal_events['departureTime'] == int(leg_start_time)) & (
-                                                          path_traversal_events['numPassengers'] > 0),]
-    except:
-        path_trav = []
-        print(row)
-
-    leg_id += 1
-    # create leg ID
-    leg_id_full = trip_id + "_l-" + str(leg_id)
-    if len(path_trav) > 0:
-        veh_type = path_trav['vehicleType'].values[0]
-        distance = path_trav['length'].item()
-        leg_end_time = path_trav['arrivalTime'].item()
-        leg_duration = int(leg_end_time) - int(leg_start_time)
-        leg_path = path_trav['links'].item()
-        leg_mode = 'OnDemand_ride'
-        leg_fuel = path_trav['primaryFuel'].item()
-        leg_fuel_type = path_trav['primaryFuelType'].item()
-        leg_array.append(
-            [pid, trip_id, leg_id_full, leg_mode, veh_id, veh_type, leg_start_time, leg_end_time, leg_duration,
-             distance, leg_path, leg_fuel, leg_fuel_type])
-    return leg_array
-
-
-def label_trip_mode(modes):
-    if ('walk' in modes) and ('car' in modes) and ('bus' in modes):
-        return 'drive_transit'
-    elif ('car' in modes) and ('bus' in modes):
-        return 'drive_transit'
-    elif ('walk' in modes) and ('bus' in modes):
-        return 'walk_transit'
-    elif ('walk' in modes) and ('car' in modes):
-        return 'car'
-    elif ('car' == modes):
-        return 'car'
-    elif ('OnDemand_ride' in modes):
-        return 'OnDemand_ride'
-    elif ('walk' == modes):
-        return 'walk'
-    else:
-        print(modes)
+class EventIndex(object):
+    """Path traversal and vehicle entry events sorted by person and by vehicle, to rebuild the legs of the trips.
+
+    The persons and the vehicles are referred to by integer codes: their positions in the `person_ids` and
+    `vehicle_ids` dictionaries. The events of each person (and the trips of each person) are stored contiguously: the
+    events of the persons `first_person` to `last_person` are the rows `offsets[first_person]:offsets[last_person]` of
+    the sorted tables, so a range of persons is selected by slicing, without any search. The path traversals of the
+    buses and of the on-demand ride vehicles are sorted by vehicle and time, and looked up by binary search on a key
+    combining the vehicle code and the time.
+
+    The index is built once and inherited by the worker processes of get_legs_output() when they are forked.
+
+    Attributes
+    ----------
+    path_traversals: pandas DataFrame
+        All path traversals: output of the get_path_traversal_output() function
+
+    person_ids: pandas Index
+        IDs of the persons making trips: categories of the `PID` column of the trips dataframe
+
+    vehicle_ids: pandas Index
+        IDs of the vehicles of the path traversals and vehicle entries
+
+    body_vehicles: numpy array
+        Code of the body of each person, -1 if the person never walks
+
+    transit_vehicles: numpy array
+        Whether each vehicle is a bus
+
+    trips, path_traversals_by_person, entries: pandas DataFrame
+        Trips windows, non-bus path traversals (by driver) and PersonEntersVehicle events (by person), sorted by
+        person code
+
+    trips_offsets, path_traversals_offsets, entries_offsets: numpy array
+        Row ranges of each person in the tables above
+
+    time_span: float
+        Upper bound of all the times of the events, used to combine the vehicle codes and the times into search keys
+
+    bus_path_traversals, ride_path_traversals: pandas DataFrame
+        Path traversals of the buses, and non-bus path traversals with passengers, sorted by vehicle and departure time
+
+    bus_departure_keys, bus_arrival_keys, ride_departure_keys: numpy array
+        Search keys of the sorted bus and ride path traversals
+
+    bus_distances: numpy array
+        Cumulated length of the sorted bus path traversals, starting at 0
+    """
+
+    def __init__(self, events_df, trips_df):
+        self.path_traversals = get_path_traversal_output(events_df)
+
+        # get all relevant personEntersVehicle events (those occurring at time ==0 are all ridehail/bus drivers)
+        enter_veh_events = events_df[(events_df['type'] == 'PersonEntersVehicle') & (events_df['time'] > 0)]
+
+        # encode the vehicles of all the events at once
+        vehicle_codes, vehicle_ids = pd.factorize(np.concatenate([id_strings(self.path_traversals['vehicle']).values,
+                                                                  id_strings(enter_veh_events['vehicle']).values]))
+        self.vehicle_ids = pd.Index(vehicle_ids)
+        path_traversals = self.path_traversals.assign(vehicle_code=vehicle_codes[:len(self.path_traversals)])
+        enter_veh_events = enter_veh_events.assign(vehicle_code=vehicle_codes[len(self.path_traversals):])
+
+        self.person_ids = pd.Index(pd.Categorical(trips_df['PID']).categories)
+        self.body_vehicles = self.vehicle_ids.get_indexer('body-' + self.person_ids.astype(str))
+        self.transit_vehicles = np.asarray(self.vehicle_ids.str.startswith('siouxareametro-sd-us:'), dtype=bool)
+
+        # split the bus path traversals from the car & body path traversals
+        is_bus = (path_traversals['mode'] == "bus").values
+        bus_path_traversal_events = path_traversals[is_bus]
+        non_bus_path_traversal_events = path_traversals[~is_bus]
+
+        trips_windows = get_trips_windows(trips_df)
+        self.trips, self.trips_offsets = self._sort_by_person(trips_windows, trips_windows['person_code'].values)
+        self.path_traversals_by_person, self.path_traversals_offsets = self._sort_by_person(
+            non_bus_path_traversal_events,
+            self.person_ids.get_indexer(id_strings(non_bus_path_traversal_events['driver'])))
+        self.entries, self.entries_offsets = self._sort_by_person(
+            enter_veh_events, self.person_ids.get_indexer(id_strings(enter_veh_events['person'])))
+
+        self.time_span = np.nanmax([self.path_traversals['arrivalTime'].max(), enter_veh_events['time'].max(),
+                                    self.trips['trip_end'].max(), 0]) + 1
+
+        self.bus_path_traversals, self.bus_departure_keys = self._sort_by_vehicle(bus_path_traversal_events)
+        # the traversals of a bus do not overlap: sorted by departure time, their arrival times are sorted as well
+        self.bus_arrival_keys = self._vehicle_time_keys(self.bus_path_traversals, 'arrivalTime')
+        self.bus_distances = np.concatenate([[0], np.cumsum(self.bus_path_traversals['length'].values.astype(float))])
+
+        self.ride_path_traversals, self.ride_departure_keys = self._sort_by_vehicle(
+            non_bus_path_traversal_events[non_bus_path_traversal_events['numPassengers'] > 0])
+
+    def _sort_by_person(self, df, person_codes):
+        order = np.argsort(person_codes, kind='stable')
+        order = order[person_codes[order] >= 0]
+        df = df.iloc[order].assign(person_code=person_codes[order].astype(np.int64))
+        offsets = np.searchsorted(df['person_code'].values, np.arange(len(self.person_ids) + 1))
+        return df, offsets
+
+    def _sort_by_vehicle(self, path_traversals_df):
+        path_traversals_df = path_traversals_df.sort_values(['vehicle_code', 'departureTime'], kind='mergesort')
+        return path_traversals_df, self._vehicle_time_keys(path_traversals_df, 'departureTime')
+
+    def _vehicle_time_keys(self, path_traversals_df, time_column):
+        return (path_traversals_df['vehicle_code'].values * self.time_span +
+                path_traversals_df[time_column].values.astype(float))
+
+    def persons_slice(self, first_person, last_person):
+        """ Trips, non-bus path traversals and vehicle entries of a range of persons
+
+        Parameters
+        ----------
+        first_person, last_person: int
+            Codes of the first person of the range and of the person following the range
+
+        Returns
+        -------
+        trips_windows_df, path_traversals_df, entries_df: pandas DataFrame
+        """
+        return (self.trips.iloc[self.trips_offsets[first_person]:self.trips_offsets[last_person]],
+                self.path_traversals_by_person.iloc[self.path_traversals_offsets[first_person]:
+                                                    self.path_traversals_offsets[last_person]],
+                self.entries.iloc[self.entries_offsets[first_person]:self.entries_offsets[last_person]])
+
+
+def match_events_to_trips(events_df, trips_df, time_column, end_column=None):
+    """ Interval join of events onto the trips during which they occur
+
+    Each event is matched to the last trip of the same person starting at or before `time_column`, and is kept only
+    if it is over (at `end_column`) by the end of this trip. Both tables are sorted once and joined with `merge_asof`,
+    instead of scanning all the events for every trip.
+
+    Parameters
+    ----------
+    events_df: pandas DataFrame
+        Events to match, with the `person_code` of the person they relate to
+
+    trips_df: pandas DataFrame
+        Trips windows: output of the get_trips_windows() function, with the `person_code` of the persons
+
+    time_column: str
+        Column of `events_df` with the time at which the event starts
+
+    end_column: str, optional
+        Column of `events_df` with the time at which the event is over. Defaults to `time_column`
+
+    Returns
+    -------
+    matched_events_df: pandas DataFrame
+        Events occurring during a trip, with the `trip_index`, `trip_end` and `trip_mode` of this trip
+    """
+    events_df = events_df.assign(event_start=events_df[time_column].astype(float))
+    events_df = events_df.sort_values('event_start', kind='mergesort')
+    matched_events_df = pd.merge_asof(events_df, trips_df.sort_values('trip_start'),
+                                      left_on='event_start', right_on='trip_start', by='person_code',
+                                      direction='backward')
+    event_end = matched_events_df[end_column or time_column].astype(float)
+    matched_events_df = matched_events_df[matched_events_df['trip_index'].notna() &
+                                          (event_end <= matched_events_df['trip_end'])]
+    return matched_events_df.astype({'trip_index': np.int64})
+
+
+def get_trips_windows(trips_df):
+    """ Time window of each trip, sorted by start time for the interval joins of match_events_to_trips()
+
+    Parameters
+    ----------
+    trips_df: pandas DataFrame
+        Record of each person's trips' attributes, with `Start_time` as a timedelta and `End_time` in seconds
+
+    Returns
+    -------
+    trips_windows_df: pandas DataFrame
+        person_code, trip_index (row position of the trip in `trips_df`), trip_start and trip_end in seconds and
+        trip_mode
+    """
+    trips_windows_df = pd.DataFrame({'person_code': pd.Categorical(trips_df['PID']).codes.astype(np.int64),
+                                     'trip_index': np.arange(len(trips_df), dtype=np.int64),
+                                     'trip_start': trips_df['Start_time'].dt.total_seconds().values,
+                                     'trip_end': trips_df['End_time'].astype(float).values,
+                                     'trip_mode': trips_df['Mode'].values})
+    return trips_windows_df.sort_values('trip_start', kind='mergesort')
+
+
+def path_traversal_legs(path_traversals_df):
+    """ Legs made of a single path traversal of the person (walking or driving a car)
+
+    Parameters
+    ----------
+    path_traversals_df: pandas DataFrame
+        Non-bus path traversals, matched to the trips of their driver
+
+    Returns
+    -------
+    legs_df: pandas DataFrame
+    """
+    departure_time = path_traversals_df['departureTime'].values
+    arrival_time = path_traversals_df['arrivalTime'].values
+    return pd.DataFrame({'trip_index': path_traversals_df['trip_index'].values,
+                         'Mode': path_traversals_df['mode'].astype(object).values,
+                         'Veh': path_traversals_df['vehicle_code'].values,
+                         'Veh_type': path_traversals_df['vehicleType'].astype(object).values,
+                         'Start_time': departure_time,
+                         'End_time': arrival_time,
+                         'Duration_sec': arrival_time.astype(np.int64) - departure_time.astype(np.int64),
+                         'Distance_m': path_traversals_df['length'].values,
+                         'Path': path_traversals_df['links'].values,
+                         'primaryFuel': path_traversals_df['primaryFuel'].values,
+                         'primaryFuelType': path_traversals_df['primaryFuelType'].astype(object).values})
+
+
+def ridehail_legs(entries_df, event_index):
+    """ Legs of the on-demand ride trips
+
+    Parameters
+    ----------
+    entries_df: pandas DataFrame
+        PersonEntersVehicle events, matched to the on-demand ride trips of the person
+
+    event_index: EventIndex
+
+    Returns
+    -------
+    legs_df: pandas DataFrame
+    """
+    # A single vehicle (other than the person's body) must be entered during the trip
+    vehicle_code = entries_df['vehicle_code'].values
+    entries_df = entries_df[vehicle_code != event_index.body_vehicles[entries_df['person_code'].values]]
+    entries_df = entries_df[~entries_df['trip_index'].duplicated(keep=False)]
+
+    # the path traversal of this vehicle departing when the person enters it, with passengers on board
+    entry_time = entries_df['time'].values.astype(float)
+    key = entries_df['vehicle_code'].values * event_index.time_span + np.floor(entry_time)
+    position = np.searchsorted(event_index.ride_departure_keys, key)
+    found = position < len(event_index.ride_departure_keys)
+    found[found] = event_index.ride_departure_keys[position[found]] == key[found]
+    rides_df = event_index.ride_path_traversals.iloc[position[found]]
+    entry_time = entry_time[found]
+
+    return pd.DataFrame({'trip_index': entries_df['trip_index'].values[found],
+                         'Mode': 'OnDemand_ride',
+                         'Veh': rides_df['vehicle_code'].values,
+                         'Veh_type': rides_df['vehicleType'].astype(object).values,
+                         'Start_time': entry_time,
+                         'End_time': rides_df['arrivalTime'].values,
+                         'Duration_sec': rides_df['arrivalTime'].values.astype(np.int64) - entry_time.astype(np.int64),
+                         'Distance_m': rides_df['length'].values,
+                         'Path': rides_df['links'].values,
+                         'primaryFuel': rides_df['primaryFuel'].values,
+                         'primaryFuelType': rides_df['primaryFuelType'].astype(object).values})
+
+
+def bus_legs(bus_entries_df, person_path_traversals_df, event_index):
+    """ Bus legs of the transit trips
+
+    A bus leg starts when the person enters the bus and ends when the next leg of the person (a path traversal
+    arriving after the bus entry) departs, or else at the next bus entry or at the end of the trip. The path
+    traversals of the bus during the leg are found by binary search in the bus path traversals of the `event_index`.
+
+    Parameters
+    ----------
+    bus_entries_df: pandas DataFrame
+        PersonEntersVehicle events into a bus, matched to the transit trips of the person
+
+    person_path_traversals_df: pandas DataFrame
+        Non-bus path traversals, matched to the trips of their driver
+
+    event_index: EventIndex
+
+    Returns
+    -------
+    legs_df: pandas DataFrame
+    """
+    bus_entries_df = bus_entries_df.sort_values(['trip_index', 'event_start'], kind='mergesort')
+    next_entry_time = bus_entries_df.groupby('trip_index')['event_start'].shift(-1)
+    bus_entries_df = bus_entries_df.assign(next_entry_time=next_entry_time.fillna(bus_entries_df['trip_end']))
+
+    # first leg of the person arriving after the bus entry, if it arrives before the next bus entry
+    post_path_traversals_df = pd.DataFrame(
+        {'trip_index': person_path_traversals_df['trip_index'].values,
+         'post_arrival': person_path_traversals_df['arrivalTime'].astype(float).values,
+         'post_departure': person_path_traversals_df['departureTime'].astype(float).values})
+    bus_entries_df = pd.merge_asof(bus_entries_df.sort_values('event_start', kind='mergesort'),
+                                   post_path_traversals_df.sort_values('post_arrival', kind='mergesort'),
+                                   left_on='event_start', right_on='post_arrival', by='trip_index',
+                                   direction='forward', allow_exact_matches=False)
+    entry_time = bus_entries_df['event_start'].values
+    has_post = (bus_entries_df['post_arrival'] <= bus_entries_df['next_entry_time']).values
+    leg_start_time = np.floor(entry_time)
+    leg_end_time = np.where(has_post, np.floor(bus_entries_df['post_departure'].values),
+                            bus_entries_df['next_entry_time'].values)
+
+    # the bus traversals must depart after the bus entry, and arrive by the departure of the next leg, or strictly
+    # before the next bus entry
+    vehicle_key = bus_entries_df['vehicle_code'].values * event_index.time_span
+    first = np.searchsorted(event_index.bus_departure_keys, vehicle_key + leg_start_time, side='left')
+    last = np.where(has_post,
+                    np.searchsorted(event_index.bus_arrival_keys, vehicle_key + leg_end_time, side='right'),
+                    np.searchsorted(event_index.bus_arrival_keys, vehicle_key + leg_end_time, side='left'))
+    found = last > first
+    first, last = first[found], last[found]
+    bus_entries_df = bus_entries_df[found]
+
+    bus_path_traversals_df = event_index.bus_path_traversals
+    links = bus_path_traversals_df['links'].values
+    return pd.DataFrame({'trip_index': bus_entries_df['trip_index'].values,
+                         'Mode': bus_path_traversals_df['mode'].astype(object).values[first],
+                         'Veh': bus_entries_df['vehicle_code'].values,
+                         'Veh_type': bus_path_traversals_df['vehicleType'].astype(object).values[first],
+                         'Start_time': leg_start_time[found].astype(np.int64),
+                         'End_time': leg_end_time[found],
+                         'Duration_sec': (leg_end_time[found] - entry_time[found]).astype(np.int64),
+                         'Distance_m': event_index.bus_distances[last] - event_index.bus_distances[first],
+                         'Path': [str(links[i:j].tolist()) for i, j in zip(first, last)],
+                         'primaryFuel': 0,
+                         'primaryFuelType': 'Diesel'})
+
+
+def get_persons_legs(event_index, first_person, last_person):
+    """ Rebuild the legs of the trips of a range of persons
+
+    Parameters
+    ----------
+    event_index: EventIndex
+
+    first_person, last_person: int
+        Codes of the first person of the range and of the person following the range
+
+    Returns
+    -------
+    legs_df: pandas DataFrame
+        Legs of the trips, with the `trip_index` of their trip and the code of their vehicle, and not numbered yet
+    """
+    trips_windows_df, path_traversals_df, entries_df = event_index.persons_slice(first_person, last_person)
+
+    # match the path traversals driven by each person, and the vehicles they enter, to the trip during which they occur
+    person_path_traversals = match_events_to_trips(path_traversals_df, trips_windows_df, 'departureTime',
+                                                   'arrivalTime')
+    person_entries = match_events_to_trips(entries_df, trips_windows_df, 'time')
+
+    # legs of the OnDemand_ride trips
+    on_demand_ride_legs = ridehail_legs(
+        person_entries[person_entries['trip_mode'].isin(['OnDemand_ride', 'ride_hail'])], event_index)
+
+    # legs of the transit trips: the bus legs, and the walk/car legs to and from the buses
+    transit_entries = person_entries[person_entries['trip_mode'].isin(['drive_transit', 'walk_transit'])]
+    transit_legs = bus_legs(transit_entries[event_index.transit_vehicles[transit_entries['vehicle_code'].values]],
+                            person_path_traversals, event_index)
+
+    # legs of the walk and car trips
+    walk_car_legs = path_traversal_legs(person_path_traversals[person_path_traversals['trip_mode'].isin(
+        ['car', 'walk', 'drive_transit', 'walk_transit'])])
+
+    return pd.concat([on_demand_ride_legs, transit_legs, walk_car_legs], ignore_index=True)
+
+
+# Index of the events being processed by get_legs_output(): set before the worker processes are forked, so that they
+# inherit it instead of receiving a pickled copy with each task
+_EVENT_INDEX = None
+
+
+def _get_persons_legs(persons_range):
+    return get_persons_legs(_EVENT_INDEX, *persons_range)
+
+
+def get_legs_partitions(event_index, max_workers=None, events_per_partition=EVENTS_PER_PARTITION):
+    """ Split the persons into ranges of persons with roughly the same number of events, one for each worker process
+
+    Parameters
+    ----------
+    event_index: EventIndex
+
+    max_workers: int, optional
+        Maximum number of partitions, the number of CPUs by default
+
+    events_per_partition: int
+        Minimum number of events per partition: smaller inputs are not worth the cost of starting the processes
+
+    Returns
+    -------
+    partitions: list of tuples
+        (first_person, last_person) codes of the ranges of persons
+    """
+    events_offsets = event_index.path_traversals_offsets + event_index.entries_offsets
+    n_events = events_offsets[-1]
+    n_partitions = int(max(1, min(max_workers or os.cpu_count() or 1, n_events // events_per_partition)))
+    bounds = np.searchsorted(events_offsets, np.linspace(0, n_events, n_partitions + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], bounds, [len(event_index.person_ids)]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def label_trip_modes(mode_masks):
+    """ Labels the realized mode of trips from the modes of their legs
+
+    Parameters
+    ----------
+    mode_masks: numpy array
+        Bitmask of the modes of the legs of each trip: bit `i` is set if one of the legs uses the mode `LEG_MODES[i]`
+
+    Returns
+    -------
+    : numpy array
+        Realized mode of each trip, None if the modes of the legs do not match any trip mode
+    """
+    walk, car, bus, on_demand_ride = (1 << LEG_MODES.index(mode) for mode in ['walk', 'car', 'bus', 'OnDemand_ride'])
+    has_walk = (mode_masks & walk) > 0
+    has_car = (mode_masks & car) > 0
+    has_bus = (mode_masks & bus) > 0
+    conditions = [has_car & has_bus, has_walk & has_bus, has_walk & has_car, mode_masks == car,
+                  (mode_masks & on_demand_ride) > 0, mode_masks == walk]
+    choices = ['drive_transit', 'walk_transit', 'car', 'car', 'OnDemand_ride', 'walk']
+    return np.select(conditions, choices, default=None)
+
+
+def decode_leg_modes(key, base, leg_modes):
+    """ Modes of the legs of a trip encoded in a key by merge_legs_trips()
+
+    Parameters
+    ----------
+    key: int
+        Codes of the modes plus one, as the digits of the key in base `base`, the first mode of the trip first
+
+    base: int
+
+    leg_modes: list of str
+        Mode of each code
+
+    Returns
+    -------
+    modes: list of str
+    """
+    modes = []
+    while key > 0:
+        key, digit = divmod(int(key), base)
+        modes.insert(0, leg_modes[digit - 1])
+    return modes
 
 
 def merge_legs_trips(legs_df, trips_df):
-    trips_df = trips_df[['PID', 'Trip_ID', 'Origin_Activity_ID', 'Destination_activity_ID', 'Trip_Purpose',
-                         'Mode']]
-    trips_df.columns = ['PID', 'Trip_ID', 'Origin_Activity_ID', 'Destination_activity_ID', 'Trip_Purpose',
-                        'plannedTripMode']
-    legs_grouped = legs_df.groupby("Trip_ID")
-    unique_modes = legs_grouped['Mode'].unique()
-    unique_modes_df = pd.DataFrame(unique_modes)
-    unique_modes_df.columns = ['legModes']
-    merged_trips = trips_df.merge(legs_grouped['Duration_sec', 'Distance_m', 'primaryFuel', 'FuelCost', 'Fare'].sum(),
-                                  on='Trip_ID')
-    merged_trips.set_index('Trip_ID', inplace=True)
-    legs_transit = legs_df.loc[legs_df['Mode'] == 'bus',]
-    legs_transit_grouped = legs_transit.groupby("Trip_ID")
-    count_modes = legs_transit_grouped['Mode'].count()
-    merged_trips.loc[count_modes.loc[count_modes.values > 1].index.values, 'Fare'] = merged_trips.loc[count_modes.loc[
-                                                                                                          count_modes.values > 1].index.values, 'Fare'] / \
-                                                                                     count_modes.loc[
-                                                                                         count_modes.values > 1].values
-    merged_trips = merged_trips.merge(unique_modes_df, on='Trip_ID')
-    legs_grouped_start_min = pd.DataFrame(legs_grouped['Start_time'].min())
-    legs_grouped_end_max = pd.DataFrame(legs_grouped['End_time'].max())
-    merged_trips = merged_trips.merge(legs_grouped_start_min, on='Trip_ID')
-    merged_trips = merged_trips.merge(legs_grouped_end_max, on='Trip_ID')
-    merged_trips['realizedTripMode'] = merged_trips['legModes'].apply(lambda row: label_trip_mode(row))
+    """ Aggregates the legs of each trip and adds their totals to the trips dataframe
+
+    The legs are matched to their trip through its `trip_index` (the position of the trip in `trips_df`) and
+    aggregated in a single pass. The realized mode of each trip is labeled from the bitmask of the modes of its legs,
+    and its `legModes` lists these modes in the order they first appear in the trip.
+
+    Parameters
+    ----------
+    legs_df: pandas DataFrame
+        Records the legs attributes for each person's trip, the legs of each trip in order of start time: output of the
+        extract_legs_dataframes() function
+
+    trips_df: pandas DataFrame
+        Record of each person's trips' attributes: output of the get_trips_output() function
+
+    Returns
+    -------
+    merged_trips: pandas DataFrame
+        Trips having legs, indexed by their `trip_index`, with the totals of their legs
+    """
+    trips_df = trips_df[['PID', 'trip_ordinal', 'Trip_Purpose', 'Mode']].rename(columns={'Mode': 'plannedTripMode'})
+
+    # the modes beyond LEG_MODES get the following codes
+    leg_modes = LEG_MODES + sorted(set(legs_df['Mode'].dropna().unique()) - set(LEG_MODES))
+    mode_codes = pd.Index(leg_modes).get_indexer(legs_df['Mode'])
+    legs_df = legs_df.assign(is_bus=mode_codes == LEG_MODES.index('bus'))
+
+    legs_grouped = legs_df.groupby('trip_index').agg(Duration_sec=('Duration_sec', 'sum'),
+                                                     Distance_m=('Distance_m', 'sum'),
+                                                     primaryFuel=('primaryFuel', 'sum'),
+                                                     FuelCost=('FuelCost', 'sum'),
+                                                     Fare=('Fare', 'sum'),
+                                                     bus_legs=('is_bus', 'sum'),
+                                                     Start_time=('Start_time', 'min'),
+                                                     End_time=('End_time', 'max'))
+
+    # distinct modes of the legs of each trip, in the order they first appear in the trip, encoded as the digits of a
+    # key in base `len(leg_modes) + 1` (0 being no mode) and as a bitmask
+    distinct_modes = pd.DataFrame({'trip_index': legs_df['trip_index'].values, 'code': mode_codes})
+    distinct_modes = distinct_modes[distinct_modes['code'] >= 0].drop_duplicates()
+    distinct_count = distinct_modes.groupby('trip_index')['code'].transform('size').values
+    position = distinct_modes.groupby('trip_index').cumcount().values
+    base = len(leg_modes) + 1
+    distinct_modes = distinct_modes.assign(
+        key=(distinct_modes['code'].values + 1) * base ** (distinct_count - 1 - position),
+        mask=1 << distinct_modes['code'].values)
+    trip_modes = distinct_modes.groupby('trip_index')[['key', 'mask']].sum().reindex(legs_grouped.index, fill_value=0)
+    mode_masks = trip_modes['mask'].values
+
+    # the fare of transit trips with several bus legs is averaged over their bus legs
+    fares = legs_grouped['Fare'].values / np.maximum(legs_grouped['bus_legs'].values, 1)
+
+    # list of the modes of the legs of each trip, written as an array of modes, e.g. "['walk' 'bus']": it is only
+    # formatted once for all the trips with the same modes in the same order
+    unique_keys, key_codes = np.unique(trip_modes['key'].values, return_inverse=True)
+    leg_modes_lists = np.array([str(np.array(decode_leg_modes(key, base, leg_modes), dtype=object))
+                                for key in unique_keys], dtype=object)
+
+    merged_trips = trips_df.iloc[legs_grouped.index.values]
+    merged_trips.index.name = 'trip_index'
+    merged_trips = merged_trips.assign(Duration_sec=legs_grouped['Duration_sec'].values,
+                                       Distance_m=legs_grouped['Distance_m'].values,
+                                       primaryFuel=legs_grouped['primaryFuel'].values,
+                                       FuelCost=legs_grouped['FuelCost'].values,
+                                       Fare=fares,
+                                       legModes=leg_modes_lists[key_codes],
+                                       Start_time=legs_grouped['Start_time'].values,
+                                       End_time=legs_grouped['End_time'].values,
+                                       realizedTripMode=label_trip_modes(mode_masks))
     return merged_trips
 
 
 # ########### 2. PARSING AND PROCESSING THE XML FILES INTO PANDAS DATA FRAMES ###############
 
-def get_person_output_from_households_xml(households_xml, output_folder_path):
-    """
-    - Parses the outputHouseholds file to create the households_dataframe gathering each person's household attributes
+def get_person_output_from_households_xml(households_path):
+    """ Parses the outputHouseholds file to create the households_dataframe gathering each person's household attributes
     (person id, household id, number of vehicles in the household, overall income of the household)
-    - Saves the household dataframe to csv
 
     Parameters
     ----------
-    households_xml: ElementTree object
-        Output of the open_xml() function for the `outputHouseholds.xml` file
-
-    output_folder_path: pathlib.Path object
-        Absolute path of the output folder of the simulation
-        (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
+    households_path: pathlib.Path object
+        Absolute path of the `outputHouseholds.xml` file
 
     Returns
     -------
@@ -484,85 +897,74 @@ def get_person_output_from_households_xml(households_xml, output_folder_path):
         Record of each person's household attributes
         (person id, household id, number of vehicles in the household, overall income of the household)
     """
+    pids, hhd_ids, hhd_num_vehs, hhd_incomes = [], [], [], []
 
-    # get root of the `outputHouseholds.xml` file
-    households_root = households_xml.getroot()
-    hhd_array = []
-
-    for hhd in households_root.getchildren():
+    # the elements of the `outputHouseholds.xml` file are in the MATSim namespace
+    for hhd in iter_elements(households_path, '{*}household'):
         hhd_id = hhd.get('id').strip()
-        hhd_children = hhd.getchildren()
         # check for vehicles; record household attributes
-        if len(hhd_children) == 3:
-            members = hhd_children[0]
-            vehicles = hhd_children[1]
-            income = hhd_children[2]
-            vehs = vehicles.getchildren()
-            hdd_num_veh = len(vehs)
-        else:
-            members = hhd_children[0]
-            vehicles = []
-            income = hhd_children[1]
-            hdd_num_veh = 0
-        hhd_income = income.text.strip()
+        vehicles = hhd.find('{*}vehicles')
+        hdd_num_veh = len(vehicles) if vehicles is not None else 0
+        income = hhd.find('{*}income')
+        hhd_income = income.text.strip() if income is not None else None
         # get list of persons in household and make a record of each person
-        list_members = members.getchildren()
-        for person in list_members:
-            pid = person.attrib['refId'].strip()
-            hhd_array.append([pid, hhd_id, hdd_num_veh, hhd_income])
+        for person in hhd.find('{*}members'):
+            pids.append(person.get('refId').strip())
+            hhd_ids.append(hhd_id)
+            hhd_num_vehs.append(hdd_num_veh)
+            hhd_incomes.append(hhd_income)
 
-    # convert array to dataframe and save
-    households_df = pd.DataFrame(hhd_array,
-                                 columns=['PID', 'Household_ID', 'Household_num_vehicles', 'Household_income [$]'])
-    households_df.to_csv(str(output_folder_path) + "/households_dataframe.csv")
+    households_df = pd.DataFrame({'PID': pids,
+                                  'Household_ID': pd.Categorical(hhd_ids),
+                                  'Household_num_vehicles': np.array(hhd_num_vehs, dtype=np.uint16),
+                                  'Household_income [$]': pd.to_numeric(hhd_incomes).astype(np.float32)})
 
     return households_df
 
 
-def get_person_output_from_output_plans_xml(output_plans_xml):
+def get_person_output_from_output_plans_xml(output_plans_path):
     """ Parses the outputPlans file to create the person_dataframe gathering individual attributes of each person
     (person id, age, sex, home location)
 
     Parameters
     ----------
-    output_plans_xml: ElementTree object
-        Output of the open_xml() function for the `outputPlans.xml` file
+    output_plans_path: pathlib.Path object
+        Absolute path of the `outputPlans.xml` file
 
     Returns
     -------
     person_df: pandas DataFrame
         Record of some of each person's individual attributes (person id, age, sex, home location)
     """
-
-    # get root of the `outputPlans.xml` file
-    output_plans_root = output_plans_xml.getroot()
-    person_array = []
-
-    for person in output_plans_root.findall('./person'):
-        pid = person.get('id')
-        attributes = person.findall('./attributes')[0]
-        age = int(attributes.findall('./attribute[@name="age"]')[0].text)
-        sex = attributes.findall('./attribute[@name="sex"]')[0].text
-        plan = person.findall('./plan')[0]
-        home = plan.findall('./activity')[0]
-        home_x = home.get('x')
-        home_y = home.get('y')
-        person_array.append([pid, age, sex, home_x, home_y])
-    # convert person array to dataframe
-    person_df = pd.DataFrame(person_array, columns=['PID', 'Age', 'Sex', 'Home_X', 'Home_Y'])
+    pids, ages, sexes, homes_x, homes_y = [], [], [], [], []
+
+    for person in iter_elements(output_plans_path, 'person'):
+        pids.append(person.get('id'))
+        attributes = person.find('./attributes')
+        ages.append(attributes.find('./attribute[@name="age"]').text)
+        sexes.append(attributes.find('./attribute[@name="sex"]').text)
+        home = person.find('./plan').find('./activity')
+        homes_x.append(home.get('x'))
+        homes_y.append(home.get('y'))
+
+    person_df = pd.DataFrame({'PID': pids,
+                              'Age': pd.to_numeric(ages).astype(np.uint8),
+                              'Sex': pd.Categorical(sexes),
+                              'Home_X': pd.to_numeric(homes_x),
+                              'Home_Y': pd.to_numeric(homes_y)})
 
     return person_df
 
 
-def get_person_output_from_output_person_attributes_xml(persons_xml):
+def get_person_output_from_output_person_attributes_xml(persons_path):
     """ Parses outputPersonAttributes.xml file to create population_attributes_dataframe gathering individual attributes
     of the population (person id, excluded modes (i.e. transportation modes that the peron is not allowed to use),
     income, rank, value of time).
 
     Parameters
     ----------
-    persons_xml: ElementTree object
-        Output of the open_xml() function for the `outputPersonAttributes.xml` file
+    persons_path: pathlib.Path object
+        Absolute path of the `outputPersonAttributes.xml` file
 
     Returns
     -------
@@ -570,53 +972,47 @@ def get_person_output_from_output_person_attributes_xml(persons_xml):
         Record of some of each person's individual attributes (person id, excluded modes (i.e. transportation modes
         that the peron is not allowed to use), income, rank, value of time)
     """
+    pids = []
+    attributes_values = {name: [] for name in PERSON_ATTRIBUTES}
 
-    # get root of the `outputPersonAttributes.xml` file
-    persons_root = persons_xml.getroot()
-    population_attributes = []
-
-    population = persons_root.getchildren()
-    for person in population:
-        pid = person.get('id')
-        attributes = person.findall("./attribute")
-        population_attributes_dict = {}
-        population_attributes_dict['PID'] = pid
-        for attribute in attributes:
-            population_attributes_dict[attribute.attrib['name']] = attribute.text
-        population_attributes.append(population_attributes_dict)
+    for person in iter_elements(persons_path, 'object'):
+        pids.append(person.get('id'))
+        attributes = {attribute.get('name'): attribute.text for attribute in person}
+        for name, values in attributes_values.items():
+            values.append(attributes.get(name))
 
-    # convert attribute array to dataframe
-    person_df_2 = pd.DataFrame(population_attributes)
+    person_df_2 = pd.DataFrame({'PID': pids,
+                                'excluded-modes': pd.Categorical(attributes_values['excluded-modes']),
+                                'income': pd.to_numeric(attributes_values['income']).astype(np.float32),
+                                'rank': pd.to_numeric(attributes_values['rank'], downcast='integer'),
+                                'valueOfTime': pd.to_numeric(attributes_values['valueOfTime']).astype(np.float32)})
 
     return person_df_2
 
 
-def get_persons_attributes_output(output_plans_xml, persons_xml, households_xml, output_folder_path):
+def get_persons_attributes_output(output_plans_path, persons_path, households_path):
     """Outputs the augmented persons dataframe, including all individual and household attributes for each person
 
     Parameters
     ----------
-    output_plans_xml: ElementTree object
-        Output of the open_xml() function for the `outputPlans.xml` file
-
-    persons_xml: ElementTree object
-        Output of the open_xml() function for the `outputPersonAttributes.xml` file
+    output_plans_path: pathlib.Path object
+        Absolute path of the `outputPlans.xml` file
 
-    households_xml: ElementTree object
-        Output of the open_xml() function for the `outputHouseholds.xml` file
+    persons_path: pathlib.Path object
+        Absolute path of the `outputPersonAttributes.xml` file
 
-    output_folder_path: pathlib.Path object
-        Absolute path of the output folder of the simulation (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
+    households_path: pathlib.Path object
+        Absolute path of the `outputHouseholds.xml` file
 
     Returns
     -------
     persons_attributes_df: pandas DataFrame
-        Record of all individual and household attributes for each person
+        Record of all individual and household attributes for each person, indexed by person ID
     """
-    # get the person attributes dataframes
-    households_df = get_person_output_from_households_xml(households_xml, output_folder_path)
-    person_df = get_person_output_from_output_plans_xml(output_plans_xml)
-    person_df_2 = get_person_output_from_output_person_attributes_xml(persons_xml)
+    # get the person attributes dataframes, streaming one file at a time
+    households_df = get_person_output_from_households_xml(households_path)
+    person_df = get_person_output_from_output_plans_xml(output_plans_path)
+    person_df_2 = get_person_output_from_output_person_attributes_xml(persons_path)
 
     # set the index of all dataframes to PID (person ID)
     person_df.set_index('PID', inplace=True)
@@ -630,127 +1026,118 @@ def get_persons_attributes_output(output_plans_xml, persons_xml, households_xml,
     return persons_attributes_df
 
 
-def get_activities_output(experienced_plans_xml):
-    """ Parses the experiencedPlans.xml file to create the activities_dataframe, gathering each person's activities' attributes
-    (person id, activity id, activity type, activity start time, activity end time)
+def get_trips_output(experienced_plans_xml_path):
+    """ Parses the experiencedPlans.xml file to create the trips dataframe, gathering each person's trips' attributes
+    (person id, trip id, id of the origin activity of the trip, id of the destination activity of the trip, trip purpose,
+    mode used, start time of the trip, duration of the trip, distance of the trip, path of the trip)
 
     Parameters
     ----------
-    experienced_plans_xml: ElementTree object
-        Output of the open_xml() function for the `<num_iterations>.experiencedPlans.xml` file located in
-        the `/ITERS/it.<num_iterations> folder
+    experienced_plans_xml_path: pathlib.Path object or str
+        Absolute path of the `<num_iterations>.experiencedPlans.xml.gz` file located in the `/ITERS/it.<num_iterations>
+        folder
 
     Returns
     -------
-    activities_df: pandas DataFrame
-        Record of each person's activities' attributes
-
-    trip_purposes: list of string
-        purpose of each trip, ege, "Work", "Home".etc...
-
+    trips_df: pandas DataFrame
+        Record of each person's trips' attributes
     """
+    _, trips_df = parse_experienced_plans(experienced_plans_xml_path)
 
-    # get root of experiencedPlans xml file
-    plans_root = experienced_plans_xml.getroot()
-    acts_array = []
-
-    # iterate through persons, recording activities and trips for each person
-    for person in plans_root.findall('./person'):
-        # we use the person ID from the raw output
-        pid = person.get('id')
-        plan = person.getchildren()[0]
-        activities = plan.findall('./activity')
-
-        # initialize activity ID counters (we create activity IDs using these)
-        act_id = 0
-        trip_purposes = []
-
-        # iterate through activities and make record of each activity
-        for activity in activities:
-            act_id += 1
-            # create activity ID
-            activity_id = pid + "_a-" + str(act_id)
-            act_type = activity.get('type')
-            if activity.get('start_time') is None:
-                act_start_time = None
-            else:
-                act_start_time = activity.get('start_time')
-            if activity.get('end_time') is None:
-                act_end_time = None
-            else:
-                act_end_time = activity.get('end_time')
-
-            # record all activity types to determine trip trip_purposes
-            trip_purposes.append([act_type])
-            acts_array.append([pid, activity_id, act_type, act_start_time, act_end_time])
-
-    # convert the activity_array to a dataframe
-    activities_df = pd.DataFrame(acts_array, columns=['PID', 'Activity_ID', 'Activity_Type', 'Start_time', 'End_time'])
-
-    return activities_df, trip_purposes
+    return trips_df
 
 
-def get_trips_output(experienced_plans_xml_path):
-    """ Parses the experiencedPlans.xml file to create the trips dataframe, gathering each person's trips' attributes
-    (person id, trip id, id of the origin activity of the trip, id of the destination activity of the trip, trip purpose,
-    mode used, start time of the trip, duration of the trip, distance of the trip, path of the trip)
+def parse_experienced_plans(experienced_plans_path):
+    """ Parses the experiencedPlans.xml file in a single streaming pass to create both the activities and the trips
+    dataframes. The persons are parsed one at a time with iterparse and cleared once processed, so the memory used
+    does not grow with the size of the file.
 
     Parameters
     ----------
-    experienced_plans_xml_path: str
-        Output of the open_xml() function for the `<num_iterations>.experiencedPlans.xml` file located in
-        the `/ITERS/it.<num_iterations> folder
+    experienced_plans_path: pathlib.Path object or str
+        Absolute path of the `<num_iterations>.experiencedPlans.xml.gz` file located in the `/ITERS/it.<num_iterations>
+        folder
 
     Returns
     -------
+    activities_df: pandas DataFrame
+        Record of each person's activities' attributes (person id, activity ordinal, activity type, activity start
+        time, activity end time)
+
     trips_df: pandas DataFrame
-        Record of each person's trips' attributes
-    """
-    # get root of experiencedPlans xml file
-    experienced_plans_xml = open_xml(experienced_plans_xml_path)
-    plans_root = experienced_plans_xml.getroot()
-    trip_array = []
+        Record of each person's trips' attributes (person id, trip ordinal, trip purpose, mode used, start time of the
+        trip, duration of the trip, distance of the trip, path of the trip). The origin and destination activities of
+        the n-th trip of a person are its n-th and n+1-th activities.
 
-    # Getting the activities dataframe
-    _, trip_purposes = get_activities_output(experienced_plans_xml)
+    The person IDs are categorical: the code of a person is its position in the file. The readable IDs of the
+    activities and trips are composed from the person IDs and the ordinals when the dataframes are exported, see the
+    readable_activities() and readable_trips() functions.
+    """
+    # activities and trips are recorded column by column; each trip keeps the row of its destination activity
+    person_ids = []
+    act_persons, act_ordinals, act_types, act_start_times, act_end_times = array('l'), array('l'), [], [], []
+    trip_persons, trip_ordinals, trip_destinations = array('l'), array('l'), array('l')
+    trip_modes, trip_dep_times, trip_trav_times, trip_distances, trip_paths = [], [], [], [], []
 
-    # iterate through persons, recording activities and trips for each person
-    for person in plans_root.findall('./person'):
+    for person in iter_elements(experienced_plans_path, 'person'):
         # we use the person ID from the raw output
-        pid = person.get('id')
-        plan = person.getchildren()[0]
-        legs = plan.findall('./leg')
+        person_code = len(person_ids)
+        person_ids.append(person.get('id'))
+        plan = person.find('plan')
 
-        # initialize trip ID counters (we create trip IDs using these)
+        # initialize activity and trip ID counters (we create activity and trip IDs using these)
+        act_id = 0
         trip_id = 0
 
-        # iterate through trips (called legs in the `experiencedPlans.xml` file) and make record of each trip
-        for trip in legs:
-            trip_id += 1
-            # create trip ID
-            trip_id_full = pid + "_t-" + str(trip_id)
-            # record activity IDs for origin and destination activities of the trip
-            o_act_id = pid + "_a-" + str(trip_id)
-            d_act_id = pid + "_a-" + str(trip_id + 1)
-
-            # identify the activity type of the trip destination to record as the trip trip_purpose
-            trip_purpose = trip_purposes[trip_id][0]
-
-            mode = trip.get('mode')
-            dep_time = trip.get('dep_time')
-            duration = trip.get('trav_time')
-            route = trip.find('./route')
-            distance = route.get('distance')
-            path = route.text
-            trip_array.append(
-                [pid, trip_id_full, o_act_id, d_act_id, trip_purpose, mode, dep_time, duration, distance, path])
-
-    # convert the trip_array to a dataframe
-    trips_df = pd.DataFrame(trip_array,
-                            columns=['PID', 'Trip_ID', 'Origin_Activity_ID', 'Destination_activity_ID', 'Trip_Purpose',
-                                     'Mode', 'Start_time', 'Duration_sec', 'Distance_m', 'Path_linkIds'])
-
-    return trips_df
+        # activities and trips (called legs in the `experiencedPlans.xml` file) alternate in the plan: the destination
+        # of a trip is the next activity recorded, if the plan does not end with this trip
+        for element in plan:
+            if element.tag == 'activity':
+                act_id += 1
+                act_persons.append(person_code)
+                act_ordinals.append(act_id)
+                act_types.append(element.get('type'))
+                act_start_times.append(element.get('start_time'))
+                act_end_times.append(element.get('end_time'))
+
+            elif element.tag == 'leg':
+                trip_id += 1
+                route = element.find('route')
+                trip_persons.append(person_code)
+                trip_ordinals.append(trip_id)
+                trip_destinations.append(len(act_types))
+                trip_modes.append(element.get('mode'))
+                trip_dep_times.append(element.get('dep_time'))
+                trip_trav_times.append(element.get('trav_time'))
+                trip_distances.append(route.get('distance') if route is not None else None)
+                trip_paths.append(route.text if route is not None else None)
+
+        if trip_id > 0 and trip_destinations[-1] == len(act_types):
+            trip_destinations[-1] = -1
+
+    # convert the arrays to dataframes
+    act_persons, act_ordinals, trip_persons, trip_ordinals, trip_destinations = (
+        np.frombuffer(column, dtype=column.typecode)
+        for column in (act_persons, act_ordinals, trip_persons, trip_ordinals, trip_destinations))
+    person_ids = pd.Index(person_ids)
+    # a trip without destination activity has the index -1, which points at the missing purpose appended last
+    act_types = np.array(act_types + [None], dtype=object)
+    activities_df = pd.DataFrame({'PID': pd.Categorical.from_codes(act_persons, person_ids),
+                                  'activity_ordinal': act_ordinals.astype(np.int32),
+                                  'Activity_Type': act_types[:-1],
+                                  'Start_time': act_start_times,
+                                  'End_time': act_end_times})
+
+    trips_df = pd.DataFrame({'PID': pd.Categorical.from_codes(trip_persons, person_ids),
+                             'trip_ordinal': trip_ordinals.astype(np.int32),
+                             'Trip_Purpose': act_types[trip_destinations],
+                             'Mode': trip_modes,
+                             'Start_time': trip_dep_times,
+                             'Duration_sec': trip_trav_times,
+                             'Distance_m': trip_distances,
+                             'Path_linkIds': trip_paths})
+
+    return activities_df, trips_df
 
 
 # def get_events_output(events):
@@ -816,9 +1203,7 @@ def get_path_traversal_output(events_df):
     """
 
     # Selecting the columns of interest
-    events_df = events_df[['time', 'type', 'person', 'vehicle', 'driver', 'vehicleType', 'length',
-                           'numPassengers', 'departureTime', 'arrivalTime', 'mode', 'links',
-                           'primaryFuelType', 'primaryFuel']]
+    events_df = events_df[LEGS_EVENT_COLUMNS]
 
     # get all path traversal events (all vehicle movements, and all person walk movements)
     path_traversal_events_df = events_df[(events_df['type'] == 'PathTraversal') & (events_df['length'] > 0)]
@@ -828,7 +1213,7 @@ def get_path_traversal_output(events_df):
     return path_traversal_events_df
 
 
-def get_legs_output(events_df, trips_df):
+def get_legs_output(events_df, trips_df, max_workers=None, writer=None):
     """ Parses the outputEvents.xml and trips_df file to create the legs dataframe, gathering each person's trips' legs' attributes
     (PID, Trip_ID, Leg_ID, Mode, Veh, Veh_type, Start_time, End_time,
                                     Duration, Distance, Path, fuel, fuelType)
@@ -841,11 +1226,20 @@ def get_legs_output(events_df, trips_df):
     trips_df: pandas DataFrame
         Record of each person's trips' attributes: output of the get_trips_output() function
 
+    max_workers: int, optional
+        Maximum number of worker processes rebuilding the legs, the number of CPUs by default
+
+    writer: dataframe_cache.BackgroundWriter, optional
+        Writer of the files of the process: its pending writes are completed before the worker processes are forked
+
     Returns
     -------
     legs_df: pandas DataFrame
-        Records the legs attributes for each person's trip
+        Records the legs attributes for each person's trip. The legs are referred to by the `trip_index` of their trip
+        (its row in `trips_df`) and their `leg_ordinal` in the trip; `PID` and `Veh` are categorical
 
+    path_traversals_df: pandas DataFrame
+        All path traversals
     """
 
     # convert trip times to timedelta; calculate end time of trips
@@ -854,138 +1248,216 @@ def get_legs_output(events_df, trips_df):
     trips_df['End_time'] = trips_df['Start_time'].dt.seconds + trips_df['Duration_sec'].dt.seconds + (
             3600 * 24 * trips_df['Start_time'].dt.days)
 
-    path_traversal_events_full = get_path_traversal_output(events_df)
-
-    # get all relevant personEntersVehicle events (those occurring at time ==0 are all ridehail/bus drivers)
-    enter_veh_events = events_df[(events_df['type'] == 'PersonEntersVehicle') & (events_df['time'] > 0)]
+    global _EVENT_INDEX
+    event_index = EventIndex(events_df, trips_df)
+
+    # rebuild the legs of ranges of persons in parallel: forked worker processes inherit the index
+    print("Now processing the legs of the trips")
+    partitions = get_legs_partitions(event_index, max_workers)
+    if len(partitions) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # a process forked while the writer thread holds a lock (e.g. of the allocator or of a file) could deadlock
+        if writer is not None:
+            writer.wait()
+        _EVENT_INDEX = event_index
+        try:
+            with multiprocessing.get_context('fork').Pool(len(partitions)) as pool:
+                legs_parts = pool.map(_get_persons_legs, partitions)
+        finally:
+            _EVENT_INDEX = None
+    else:
+        legs_parts = [get_persons_legs(event_index, *persons_range) for persons_range in partitions]
 
-    # filter for bus path traversals only
-    bus_path_traversal_events = path_traversal_events_full[path_traversal_events_full['mode'] == "bus"]
+    # order the legs of each trip by start time and number them
+    legs_df = pd.concat(legs_parts, ignore_index=True)
+    legs_df = legs_df.sort_values(['trip_index', 'Start_time', 'End_time'], kind='mergesort').reset_index(drop=True)
+    person_ids = pd.Categorical(trips_df['PID'])
+    legs_df.insert(0, 'PID', pd.Categorical.from_codes(person_ids.codes[legs_df['trip_index'].values],
+                                                       person_ids.categories))
+    legs_df.insert(2, 'leg_ordinal', (legs_df.groupby('trip_index').cumcount() + 1).astype(np.int32))
+    legs_df['Veh'] = pd.Categorical.from_codes(legs_df['Veh'].values, event_index.vehicle_ids)
 
-    # filter for car & body path traversals only
-    non_bus_path_traversal_events = path_traversal_events_full[path_traversal_events_full['mode'] != "bus"]
+    return legs_df, event_index.path_traversals
 
-    # get all PersonCost events (record the expenditures of persons during a trip)
-    # person_costs = events_df.loc[events_df['type']=='PersonCost',]
 
-    # get all ReserveRideHail events
-    # reserve_ridehail_events = events_df[(events_df['type'] == 'ReserveRideHail') & (events_df['time'] > 0)]
+# ############ 3. GENERATE THE CSV FILES ###########
 
-    legs_array = []
+def readable_activities(activities_df):
+    """ Activities dataframe with the readable activity IDs "<person id>_a-<activity ordinal>", as exported
 
-    # record all legs corresponding to OnDemand_ride trips
-    on_demand_ride_trips_df = trips_df.loc[((trips_df['Mode'] == 'OnDemand_ride') | (trips_df['Mode'] == 'ride_hail')),]
-    print("Now processing on-demand ride trips")
-    on_demand_ride_trips_dask_df = dd.from_pandas(on_demand_ride_trips_df, 32)
-    on_demand_ride_legs_array = on_demand_ride_trips_dask_df.map_partitions(
-        lambda df: df.apply((lambda row: parse_ridehail_trips(row, non_bus_path_traversal_events, enter_veh_events)),
-                            axis=1)).compute(scheduler='processes')
-    for bit in on_demand_ride_legs_array.tolist():
-        legs_array.extend(tid for tid in bit)
+    Parameters
+    ----------
+    activities_df: pandas DataFrame
+        Output of the parse_experienced_plans() function
 
-    # record all legs corresponding to transit trips
-    transit_trips_df = trips_df[(trips_df['Mode'] == 'drive_transit') | (trips_df['Mode'] == 'walk_transit')]
-    print("Now processing transit trips")
-    transit_trips_dask_df = dd.from_pandas(transit_trips_df, 32)
-    transit_legs_array = transit_trips_dask_df.map_partitions(
-        lambda df: df.apply((lambda row: parse_transit_trips(row, non_bus_path_traversal_events, bus_path_traversal_events, enter_veh_events)),
-                            axis=1)).compute(scheduler='processes')
-    for bit in transit_legs_array.tolist():
-        legs_array.extend(tid for tid in bit)
+    Returns
+    -------
+    : pandas DataFrame
+    """
+    ordinals = activities_df['activity_ordinal'].values
+    activities_df = activities_df.drop(columns='activity_ordinal')
+    activities_df.insert(1, 'Activity_ID', compose_ids(activities_df['PID'], "_a-", ordinals))
+    return activities_df
 
-    # record all legs corresponding to walk and car trips
-    walk_car_trips_df = trips_df.loc[(trips_df['Mode'] == 'car') | (trips_df['Mode'] == 'walk'),]
-    print("Now processing walk->car trips")
-    walk_car_trips_dask_df = dd.from_pandas(walk_car_trips_df, 32)
-    walk_car_legs_array = walk_car_trips_dask_df.map_partitions(lambda df: df.apply((lambda row: parse_walk_car_trips(row, non_bus_path_traversal_events, enter_veh_events)), axis=1)).compute(scheduler='processes')
-    for bit in walk_car_legs_array.tolist():
-        legs_array.extend(tid for tid in bit)
 
-    # convert the leg array to a dataframe
-    legs_df = pd.DataFrame(legs_array,
-                           columns=['PID', 'Trip_ID', 'Leg_ID', 'Mode', 'Veh', 'Veh_type', 'Start_time', 'End_time',
-                                    'Duration_sec', 'Distance_m', 'Path', 'primaryFuel', 'primaryFuelType'])
+def readable_legs(legs_df, trips_df):
+    """ Legs dataframe with the readable trip and leg IDs, "<person id>_t-<trip ordinal>" and
+    "<trip id>_l-<leg ordinal>", as exported
 
-    return legs_df, path_traversal_events_full
+    Parameters
+    ----------
+    legs_df: pandas DataFrame
+        Output of the get_legs_output() function
 
+    trips_df: pandas DataFrame
+        Trips the legs belong to, with their `trip_index`: trips of the outputs of parse_iteration_outputs()
 
-# ############ 3. GENERATE THE CSV FILES ###########
+    Returns
+    -------
+    : pandas DataFrame
+    """
+    trip_positions = pd.Index(trips_df['trip_index']).get_indexer(legs_df['trip_index'])
+    trip_ids = compose_ids(legs_df['PID'], "_t-", trips_df['trip_ordinal'].values[trip_positions])
+    leg_ids = compose_ids(trip_ids, "_l-", legs_df['leg_ordinal'].values)
+    legs_df = legs_df.drop(columns=['trip_index', 'leg_ordinal'])
+    legs_df.insert(1, 'Trip_ID', trip_ids)
+    legs_df.insert(2, 'Leg_ID', leg_ids)
+    return legs_df
 
 
-def extract_person_dataframes(output_plans_path, persons_path, households_path, output_folder_path):
-    """ Create a csv file from the processed person dataframe
+def readable_trips(trips_df):
+    """ Trips dataframe with the readable trip IDs "<person id>_t-<trip ordinal>" and the readable IDs of their origin
+    and destination activities, as exported
 
     Parameters
     ----------
-    output_plans_path: pathlib.Path object
-        Absolute path of the the `outputPlans.xml` file
+    trips_df: pandas DataFrame
+        Trips of the outputs of parse_iteration_outputs(), with their `trip_index`
 
-    persons_path: pathlib.Path object
-        Absolute path of the the `outputPersonAttributes.xml` file
+    Returns
+    -------
+    : pandas DataFrame
+    """
+    ordinals = trips_df['trip_ordinal'].values
+    trips_df = trips_df.drop(columns=['trip_index', 'trip_ordinal'])
+    trips_df.insert(0, 'Trip_ID', compose_ids(trips_df['PID'], "_t-", ordinals))
+    trips_df.insert(2, 'Origin_Activity_ID', compose_ids(trips_df['PID'], "_a-", ordinals))
+    trips_df.insert(3, 'Destination_activity_ID', compose_ids(trips_df['PID'], "_a-", ordinals + 1))
+    return trips_df
 
-    households_path: pathlib.Path object
-        Absolute path of the the `outputHouseholds.xml` file
 
-    output_folder_path: pathlib.Path object
-        Absolute path of the output folder of the simulation (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
+def plain_columns(frame):
+    """ Convert the categorical columns of a dataframe to columns of their values, as if read back from a csv file,
+    except the ROUTE_COLUMNS
+
+    Parameters
+    ----------
+    frame: pandas DataFrame
 
     Returns
     -------
-    persons_attributes_df: pandas DataFrame
-        Record of all individual and household attributes for each person
+    : pandas DataFrame
+    """
+    categorical = [name for name, dtype in frame.dtypes.items()
+                   if isinstance(dtype, pd.CategoricalDtype) and name not in ROUTE_COLUMNS]
+    return frame.astype({name: object for name in categorical}) if categorical else frame
+
+
+def readable_frame(frames, name):
+    """ Dataframe of the outputs of the parsing laid out as in its csv file: with the readable IDs of the activities,
+    trips and legs, and without categorical columns
+
+    Parameters
+    ----------
+    frames: dictionary
+        {name: pandas DataFrame} outputs of output_parse(), including the trips to export the legs
+
+    name: str
+        Name of the dataframe, among the keys of OUTPUT_CSV_FILES
 
+    Returns
+    -------
+    : pandas DataFrame
     """
+    frame = frames[name]
+    if name == "activities":
+        frame = readable_activities(frame)
+    elif name == "legs":
+        frame = readable_legs(frame, frames["trips"])
+    elif name == "trips":
+        frame = readable_trips(frame)
+    return plain_columns(frame)
 
-    # opens the xml files
-    output_plans_xml = open_xml(output_plans_path)
-    persons_xml = open_xml(persons_path)
-    households_xml = open_xml(households_path)
 
-    persons_attributes_df = get_persons_attributes_output(output_plans_xml, persons_xml, households_xml,
-                                                          output_folder_path)
-    persons_attributes_df.to_csv(str(output_folder_path) + "/persons_dataframe.csv")
-    print("person_dataframe.csv generated")
+def write_csv_file(frame, path, index):
+    """ Write a dataframe to a csv file, through a temporary file so that an interrupted write leaves no partial file
 
-    return persons_attributes_df
+    Parameters
+    ----------
+    frame: pandas DataFrame
+
+    path: pathlib.Path object
+        Absolute path of the csv file
+
+    index: bool
+        Whether the index of the dataframe is written
+    """
+    tmp_path = path.with_suffix(".tmp")
+    frame.to_csv(str(tmp_path), index=index)
+    os.replace(str(tmp_path), str(path))
+    print("{} generated".format(path.name))
 
 
-def extract_activities_dataframes(experienced_plans_path, output_folder):
-    """ Create a csv file from the processed activities dataframe
+def export_csv_file(frames, name, path):
+    """ Export a dataframe of the outputs of the parsing to its csv file, laid out by readable_frame()
 
     Parameters
     ----------
-    experienced_plans_path: pathlib.Path object
+    frames: dictionary
+        {name: pandas DataFrame} outputs of output_parse()
 
-    output_folder_path: pathlib.Path object
-        Absolute path of the output folder of the simulation
-        (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
+    name: str
+        Name of the dataframe, among the keys of OUTPUT_CSV_FILES
 
-    Returns
-    -------
-    activities_df
+    path: pathlib.Path object
+        Absolute path of the csv file
     """
+    write_csv_file(readable_frame(frames, name), path, name in CSV_ROW_NUMBERS)
 
-    # opens the experiencedPlans and passes the xml file to get_activity_trip_output
-    # returns the actitivities_dataframe and trips_dataframe
 
-    experienced_plans_xml = open_xml(experienced_plans_path)
-    activities_df, _ = get_activities_output(experienced_plans_xml)
+def export_csv_files(frames, output_folder_path, writer=None):
+    """ Export the dataframes created by output_parse() to csv files in the output folder of the simulation
 
-    # convert dataframes into csv files
-    activities_df.to_csv(str(output_folder) + "/activities_dataframe.csv")
-    print("activities_dataframe.csv generated")
+    Parameters
+    ----------
+    frames: dictionary
+        {name: pandas DataFrame}, the names being the keys of OUTPUT_CSV_FILES. The legs are exported with the trips
 
-    return activities_df
+    output_folder_path: pathlib.Path object
+        Absolute path of the output folder of the simulation
+        (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
 
+    writer: dataframe_cache.BackgroundWriter, optional
+        Writer of the files: the readable IDs are composed and the files written on its background thread. Otherwise,
+        they are written at once
+    """
+    # the columns added to the dataframes afterwards are not exported
+    frames = {name: frame.copy(deep=False) for name, frame in frames.items()}
+    for name in frames:
+        path = Path(output_folder_path) / OUTPUT_CSV_FILES[name]
+        if writer is None:
+            export_csv_file(frames, name, path)
+        else:
+            writer.submit(export_csv_file, frames, name, path)
 
-def extract_legs_dataframes(events_path, trips_df, person_df, bus_fares_df, trip_to_route, fuel_costs,
-                            output_folder_path):
-    """ Create a csv file from the processes legs dataframe
+
+def extract_legs_dataframes(events_path, trips_df, person_df, bus_fares_df, trip_to_route, fuel_costs, max_workers=None,
+                            writer=None):
+    """ Create the legs and path traversals dataframes from the events file
 
     Parameters
     ----------
     events_path: pathlib.Path object
-        Absolute path of the `ITERS/<num_iterations>.events.csv.gz` file
+        Absolute path of the `ITERS/<num_iterations>.events.xml.gz` (or `.events.csv.gz`) file
 
     trips_df: pandas DataFrame
         Record of each person's trips' attributes: output of the  get_trips_output() function
@@ -1004,58 +1476,151 @@ def extract_legs_dataframes(events_path, trips_df, person_df, bus_fares_df, trip
         fuel type / fuel price correspondence extracted from the `beamFuelTypes.csv` file in the
         `/reference-data/sioux_faux/config/<SAMPLE_SIZE>` folder of the Starter Kit
 
-    output_folder_path: pathlib.Path object
-        Absolute path of the output folder of the simulation
-        (format of the output folder name: `<scenario_name>-<sample_size>__<date and time>`)
+    max_workers, writer:
+        See get_legs_output()
 
     Returns
     -------
     legs_df: pandas DataFrame
         Records the legs attributes for each person's trips
+
+    path_traversal_df: pandas DataFrame
+        All path traversals, with their fuel costs
+
+    The bus legs and path traversals have their GTFS trip and route in the categorical `gtfs_trip_id` and `route_id`
+    columns
     """
-    # opens the outputevents and passes the xml file to get_legs_output
     # augments the legs dataframe with estimates of the fuelcosts and fares for each leg
 
-    # extract a dataframe from the `outputEvents.xml` file
-    # all_events_df = extract_dataframe(str(events_path))
-    suffixes = Path(events_path).suffixes
-    if suffixes[1] == ".xml":
-        all_events_df = extract_dataframe(str(events_path))
-    else:
-        all_events_df = pd.read_csv(events_path)
+    # extract a dataframe of the path traversal and vehicle entry events from the `outputEvents.xml` file
+    all_events_df = load_events(events_path, LEGS_EVENT_TYPES, LEGS_EVENT_COLUMNS)
 
-    legs_df, path_traversal_df = get_legs_output(all_events_df, trips_df)
+    legs_df, path_traversal_df = get_legs_output(all_events_df, trips_df, max_workers, writer)
+    del all_events_df
 
-    path_traversal_df_new = calc_fuel_costs(path_traversal_df, fuel_costs)
-    path_traversal_df_new.to_csv(str(output_folder_path) + '/path_traversals_dataframe.csv')
-    print("path_traversals_dataframe.csv generated")
-    legs_df_new = calc_fuel_costs(legs_df, fuel_costs)
+    path_traversal_df = calc_fuel_costs(path_traversal_df, fuel_costs)
+    legs_df = calc_fuel_costs(legs_df, fuel_costs)
+    # the routes of the buses are mapped once, for the fares and the plots
+    path_traversal_df = add_route_columns(path_traversal_df, 'vehicle', 'mode', trip_to_route)
+    legs_df = add_route_columns(legs_df, 'Veh', 'Mode', trip_to_route)
     ride_hail_fares = {'base': 0.0, 'distance': 1.0, 'duration': 0.5}
+    legs_df = calc_fares(legs_df, ride_hail_fares, bus_fares_df, person_df)
 
-    legs_df_new_new = calc_fares(legs_df_new, ride_hail_fares, bus_fares_df, person_df, trip_to_route)
+    return legs_df, path_traversal_df
 
-    legs_df_new_new.to_csv(str(output_folder_path) + '/legs_dataframe.csv')
-    print("legs_dataframe.csv generated")
 
-    return legs_df_new_new
+def parse_iteration_outputs(events_path, experienced_plans_path, persons_attributes_df, bus_fares_data_df, route_ids,
+                            trip_to_route, fuel_costs, incentive_data, max_age, max_income, csv_folder_path=None,
+                            writer=None, legs_workers=None):
+    """ Parse the outputs of an iteration of a simulation into the activities, legs, path traversals and trips
+    dataframes, given the attributes of the persons, which are the same for all the iterations
 
+    Parameters
+    ----------
+    events_path, experienced_plans_path: pathlib.Path object
+        Absolute paths of the `ITERS/it.<num_iterations>/<num_iterations>.events.xml.gz` (or `.events.csv.gz`) and
+        `ITERS/it.<num_iterations>/<num_iterations>.experiencedPlans.xml.gz` files
 
-def output_parse(events_path, output_plans_path, persons_path, households_path, experienced_plans_path,
-                 bus_fares_data_df, route_ids, trip_to_route, fuel_costs, output_folder_path, incentive_data, max_age,
-                 max_income):
-    persons_attributes_df = extract_person_dataframes(output_plans_path, persons_path, households_path,
-                                                      output_folder_path)
+    persons_attributes_df: pandas DataFrame
+        Attributes of the persons, indexed by person ID: output of the get_persons_attributes_output() function
+
+    bus_fares_data_df, route_ids, trip_to_route, fuel_costs, incentive_data, max_age, max_income:
+        See output_parse()
+
+    csv_folder_path: pathlib.Path object, optional
+        Folder the dataframes are exported to as csv files, if any
 
-    activities_df = extract_activities_dataframes(experienced_plans_path, output_folder_path)
+    writer: dataframe_cache.BackgroundWriter, optional
+        Writer of the csv files
 
-    trips_df = get_trips_output(str(experienced_plans_path))
+    legs_workers: int, optional
+        Maximum number of worker processes rebuilding the legs, see get_legs_output()
+
+    Returns
+    -------
+    frames: dictionary
+        {name: pandas DataFrame} for "activities", "legs", "path_traversals" and "trips". The activities, legs and
+        trips are referred to by their person and ordinals (`activity_ordinal`, `trip_ordinal` and `leg_ordinal`) and
+        the legs to their trip by its `trip_index`; the IDs of the persons and vehicles are categorical
+    """
+    activities_df, trips_df = parse_experienced_plans(experienced_plans_path)
+
+    # the legs are rebuilt by forked worker processes before any file of the iteration is written in the background
     bus_fares_df = parse_bus_fare_input(bus_fares_data_df, route_ids, max_age)
-    incentive_df = parse_incentive_input(incentive_data, max_age, max_income)
-    legs_df = extract_legs_dataframes(events_path, trips_df, persons_attributes_df, bus_fares_df, trip_to_route,
-                                      fuel_costs, output_folder_path)
-    legs_df = pd.read_csv(str(output_folder_path) + '/legs_dataframe.csv')
+    incentive_table = parse_incentive_input(incentive_data, max_age, max_income)
+    legs_df, path_traversal_df = extract_legs_dataframes(events_path, trips_df, persons_attributes_df, bus_fares_df,
+                                                         trip_to_route, fuel_costs, legs_workers, writer)
+
     final_trips_df = merge_legs_trips(legs_df, trips_df)
-    final_trips_df_new = calc_incentives(final_trips_df, incentive_df, persons_attributes_df)
+    final_trips_df = calc_incentives(final_trips_df, incentive_table, persons_attributes_df)
+    frames = {"activities": activities_df,
+              "path_traversals": path_traversal_df,
+              "legs": legs_df,
+              "trips": final_trips_df.reset_index()}
+    if csv_folder_path is not None:
+        export_csv_files(frames, csv_folder_path, writer)
+
+    return frames
+
+
+def output_parse(events_path, output_plans_path, persons_path, households_path, experienced_plans_path,
+                 bus_fares_data_df, route_ids, trip_to_route, fuel_costs, output_folder_path, incentive_data, max_age,
+                 max_income, export_csv=True, writer=None, legs_workers=None):
+    """ Parse the outputs of a simulation into the persons, activities, legs, path traversals and trips dataframes
+
+    The dataframes are passed from one stage to the next in memory, with integer codes and ordinals rather than readable
+    IDs. Exporting them to csv files is an optional final step: the readable IDs are only composed in the files, which
+    are written on the background thread of the `writer` if any.
+
+    Parameters
+    ----------
+    events_path, output_plans_path, persons_path, households_path, experienced_plans_path: pathlib.Path object
+        Absolute paths of the `ITERS/<num_iterations>.events.xml.gz` (or `.events.csv.gz`), `outputPlans.xml`,
+        `outputPersonAttributes.xml`, `outputHouseholds.xml` and `ITERS/<num_iterations>.experiencedPlans.xml.gz` files
+
+    bus_fares_data_df: pandas DataFrame
+        Bus fares extracted from the "submission-inputs/MassTransitFares.csv"
+
+    route_ids: list of strings
+        All routes ids where buses operate (from `routes.txt` file in the GTFS data)
 
-    final_trips_df_new.to_csv(str(output_folder_path) + '/trips_dataframe.csv')
-    print("trips_dataframe.csv generated")
+    trip_to_route: dictionary
+        route_id / trip_id correspondence
+
+    fuel_costs: dictionary
+        fuel type / fuel price correspondence
+
+    output_folder_path: pathlib.Path object
+        Absolute path of the output folder of the simulation
+
+    incentive_data: pandas DataFrame
+        Incentives extracted from the "submission-inputs/ModeIncentives.csv"
+
+    max_age, max_income: int
+        maximum age and income
+
+    export_csv: bool
+        Whether the dataframes are exported to csv files in `output_folder_path`, see OUTPUT_CSV_FILES
+
+    writer: dataframe_cache.BackgroundWriter, optional
+        Writer of the csv files
+
+    legs_workers: int, optional
+        Maximum number of worker processes rebuilding the legs, see get_legs_output()
+
+    Returns
+    -------
+    frames: dictionary
+        {name: pandas DataFrame} for the names of OUTPUT_CSV_FILES, see parse_iteration_outputs(). The persons keep
+        their categorical attributes
+    """
+    csv_folder_path = output_folder_path if export_csv else None
+    persons_attributes_df = get_persons_attributes_output(output_plans_path, persons_path, households_path)
+    frames = {"persons": persons_attributes_df.reset_index()}
+    if export_csv:
+        export_csv_files(frames, output_folder_path, writer)
+
+    frames.update(parse_iteration_outputs(events_path, experienced_plans_path, persons_attributes_df,
+                                          bus_fares_data_df, route_ids, trip_to_route, fuel_costs, incentive_data,
+                                          max_age, max_income, csv_folder_path, writer, legs_workers))
+    return frames
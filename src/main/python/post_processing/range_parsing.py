@@ -0,0 +1,85 @@
+"""Parsing of the ranges used in the submission inputs, e.g. the "age" and "income" columns of `MassTransitFares.csv`
+and `ModeIncentives.csv`: "[a:b]", "(a:b)", "[a:b)" or "(a:b]", where brackets are inclusive and parentheses
+exclusive bounds.
+"""
+import numpy as np
+import pandas as pd
+
+RANGE_PATTERN = r'^\s*([\[(])\s*(-?\d+)\s*:\s*(-?\d+)\s*([\])])\s*$'
+
+
+def parse_ranges(ranges):
+    """ Parse a column of range strings in a single vectorized pass
+
+    Parameters
+    ----------
+    ranges: pandas Series
+        Range strings, e.g. "(10:30]"
+
+    Returns
+    -------
+    bounds: pandas DataFrame
+        Indexed like `ranges`, with the columns:
+        - "lower" and "upper": bounds as written in the range, e.g. 10 and 30
+        - "min" and "max": smallest and largest integers of the range, e.g. 11 and 30
+    """
+    parts = ranges.astype(str).str.extract(RANGE_PATTERN)
+    invalid = parts.isnull().any(axis=1)
+    if invalid.any():
+        raise ValueError("Invalid ranges: {}".format(ranges[invalid].tolist()))
+
+    lower = parts[1].astype(np.int64)
+    upper = parts[2].astype(np.int64)
+    return pd.DataFrame({'lower': lower,
+                         'upper': upper,
+                         'min': lower + (parts[0] == '(').astype(np.int64),
+                         'max': upper - (parts[3] == ')').astype(np.int64)},
+                        index=ranges.index)
+
+
+def range_intervals(bounds):
+    """ Lookup structure of parsed ranges
+
+    Parameters
+    ----------
+    bounds: pandas DataFrame
+        Output of the parse_ranges() function
+
+    Returns
+    -------
+    : pandas IntervalIndex
+        Closed intervals between the smallest and the largest integers of each range
+    """
+    return pd.IntervalIndex.from_arrays(bounds['min'], bounds['max'], closed='both')
+
+
+def add_range_columns(df, name_column):
+    """ Parse the ranges of the `name_column` column of an input dataframe, adding the columns:
+    - "min_<name_column>" and "max_<name_column>": bounds as written in the ranges. Ex: [0:120] --> 0, 120
+    - "<name_column>_interval": closed intervals of the integers in the ranges
+
+    The ranges are only parsed if these columns are missing or incomplete, so that an input dataframe can be parsed
+    once and then shared by the post-processing pipeline and the plots.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        ModeIncentives.csv or MassTransitFares.csv input file
+
+    name_column: str
+        Column containing the range values to parse
+
+    Returns
+    -------
+    df: pandas DataFrame
+        Input dataframe, with the new columns
+    """
+    columns = ["min_{0}".format(name_column), "max_{0}".format(name_column), "{0}_interval".format(name_column)]
+    if all(column in df.columns for column in columns) and not df[columns].isnull().any().any():
+        return df
+
+    bounds = parse_ranges(df[name_column])
+    df[columns[0]] = bounds['lower'].values
+    df[columns[1]] = bounds['upper'].values
+    df[columns[2]] = range_intervals(bounds).values
+    return df
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""Report of a run: every figure of the visualization module, rendered without a display and written to a folder with
+an HTML index.
+
+The figures are drawn in parallel by forked worker processes, each figure in its own process, so that the figures do
+not share the state of pyplot. The key of a figure hashes its inputs (dataframes, files and parameters), the source of
+its plot function and the modules drawing the plots: a figure whose key has not changed since the last report is not
+drawn again.
+
+Like the visualization module, this module is imported from the post_processing package, e.g.
+`python -m post_processing.report <output folder> <iteration>` with the post_processing folder on the path.
+"""
+import argparse
+import hashlib
+import html
+import inspect
+import json
+import multiprocessing
+import os
+import traceback
+from collections import namedtuple
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from . import metrics, trip_cube
+from . import visualization as viz
+from .dataframe_cache import file_signature, write_json
+from .fixed_data_visualization import ITERS, ReferenceData, ResultFiles, max_age, max_fare, max_incentive, max_income
+
+REPORT_MANIFEST = "report.json"
+REPORT_INDEX = "index.html"
+FORMATS = ("png", "svg")
+
+# name: file name of the figure
+# function: plot function of the visualization module
+# arguments: function of (run, BAU run, name of the run) returning the arguments of the plot function
+# bau: whether the figure compares the run to the BAU run
+# options: function of the run returning keyword arguments derived from the arguments (not part of the key)
+Figure = namedtuple("Figure", ["name", "function", "arguments", "bau", "options"])
+Figure.__new__.__defaults__ = (False, None)
+
+
+def iteration_file(results, name):
+    """ Path of an output file of the iteration of a run, e.g. `averageTravelTimes.csv` """
+    return results.path_output_folder / ITERS / "it.{0}".format(results.number_iterations) / "{0}.{1}".format(
+        results.number_iterations, name)
+
+
+def cube_option(results):
+    return {"cube": results.trip_cube}
+
+
+FIGURES = [
+    # Inputs
+    Figure("incentives_inputs", viz.plot_incentives_inputs,
+           lambda r, b, name: (r.incentives_data, max_incentive, max_age, max_income, name)),
+    Figure("vehicle_fleet_mix_inputs", viz.plot_vehicle_fleet_mix_inputs,
+           lambda r, b, name: (r.fleet_mix_data, r.reference_data.route_ids, r.reference_data.buses_list,
+                               r.reference_data.agency_ids, name)),
+    Figure("mass_transit_fares_inputs", viz.plot_mass_transit_fares_inputs,
+           lambda r, b, name: (r.bus_fares_data, b.bus_fares_data, max_fare, r.reference_data.route_ids, name),
+           bau=True),
+    Figure("bus_frequency", viz.plot_bus_frequency,
+           lambda r, b, name: (r.bus_frequency_data, r.reference_data.route_ids, name)),
+    # Mode choice
+    Figure("overall_mode_choice", viz.plot_overall_mode_choice, lambda r, b, name: (r.mode_choice_data, name)),
+    Figure("mode_choice_by_hour", viz.plot_mode_choice_by_hour,
+           lambda r, b, name: (iteration_file(r, "modeChoice.csv"), name)),
+    Figure("mode_choice_by_income_group", viz.plot_mode_choice_by_income_group,
+           lambda r, b, name: (r.person_df, r.trips_df, name), options=cube_option),
+    Figure("mode_choice_per_income_group", viz.plot_mode_choice_per_income_group,
+           lambda r, b, name: (r.person_df, r.trips_df, name), options=cube_option),
+    Figure("mode_choice_by_age_group", viz.plot_mode_choice_by_age_group,
+           lambda r, b, name: (r.person_df, r.trips_df, name), options=cube_option),
+    Figure("mode_choice_by_trip_distance", viz.plot_mode_choice_by_trip_distance,
+           lambda r, b, name: (r.trips_df, name), options=cube_option),
+    Figure("mode_choice_by_trip_distance_stacked", viz.plot_mode_choice_by_trip_distance_stacked,
+           lambda r, b, name: (r.trips_df, name), options=cube_option),
+    Figure("num_trips_by_trip_distance", viz.plot_num_trips_by_trip_distance,
+           lambda r, b, name: (r.trips_df, name), options=cube_option),
+    Figure("average_speed_by_tod_per_mode", viz.plot_average_speed_by_tod_per_mode,
+           lambda r, b, name: (r.trips_df, name), options=cube_option),
+    Figure("num_trips_by_tod_per_mode", viz.plot_num_trips_by_tod_per_mode,
+           lambda r, b, name: (r.trips_df, name), options=cube_option),
+    # Costs and incentives
+    Figure("average_travel_expenditure_per_trip_per_mode_over_day",
+           viz.plot_average_travel_expenditure_per_trip_per_mode_over_day, lambda r, b, name: (r.trips_df, name)),
+    Figure("incentives_distributed_by_mode", viz.plot_incentives_distributed_by_mode,
+           lambda r, b, name: (r.trips_df, name)),
+    Figure("cost_benefits", viz.plot_cost_benefits,
+           lambda r, b, name: (r.paths_traversals_df, r.legs_df, r.reference_data.operational_costs,
+                               r.reference_data.trip_to_route, name)),
+    # Transit
+    Figure("average_bus_crowding_by_bus_route_by_period_of_day",
+           viz.plot_average_bus_crowding_by_bus_route_by_period_of_day,
+           lambda r, b, name: (r.paths_traversals_df, r.reference_data.trip_to_route,
+                               r.reference_data.seating_capacities, r.reference_data.transit_scale_factor, name)),
+    Figure("bus_vmt_by_ridership_number_by_hour_of_the_day", viz.plot_bus_vmt_by_ridership_number_by_hour_of_the_day,
+           lambda r, b, name: (r.paths_traversals_df, name)),
+    Figure("bus_vmt_by_ridership_state_by_hour_of_the_day", viz.plot_bus_vmt_by_ridership_state_by_hour_of_the_day,
+           lambda r, b, name: (r.paths_traversals_df, r.reference_data.transit_scale_factor,
+                               r.reference_data.seating_capacities, r.reference_data.capacity,
+                               r.reference_data.buses_list, name)),
+    # Travel times
+    Figure("travel_time_by_mode", viz.plot_travel_time_by_mode,
+           lambda r, b, name: (iteration_file(r, "averageTravelTimes.csv"), name)),
+    Figure("travel_time_over_the_day", viz.plot_travel_time_over_the_day,
+           lambda r, b, name: (iteration_file(r, "averageTravelTimes.csv"), name)),
+    Figure("parallel_travel_time_bau_submission", viz.plot_parallel_travel_time_bau_submission,
+           lambda r, b, name: (iteration_file(b, "averageTravelTimes.csv"), iteration_file(r, "averageTravelTimes.csv")),
+           bau=True),
+    # VMT and emissions
+    Figure("vmt_per_mode", viz.plot_vmt_per_mode, lambda r, b, name: (r.paths_traversals_df, r.legs_df, name)),
+    Figure("vmt_on_demand", viz.plot_vmt_on_demand, lambda r, b, name: (r.paths_traversals_df, name)),
+    Figure("parallel_vmt_bau_submission", viz.plot_parallel_vmt_bau_submission,
+           lambda r, b, name: (b.paths_traversals_df, r.paths_traversals_df, b.legs_df, r.legs_df), bau=True),
+    Figure("daily_emissions_per_mode", viz.plot_daily_emissions_per_mode,
+           lambda r, b, name: (b.paths_traversals_df, r.paths_traversals_df, b.legs_df, r.legs_df), bau=True),
+    # Scores
+    Figure("weighted_scores", viz.plot_weighted_scores, lambda r, b, name: (r.scores_data, name)),
+]
+FIGURES_BY_NAME = {figure.name: figure for figure in FIGURES}
+# Modules of the plot functions and of their helpers: the figures are drawn again when they change
+PLOT_MODULES = (viz, trip_cube, metrics)
+
+# Inputs of the report, inherited by the worker processes when they are forked
+_REPORT = None
+
+
+def hash_input(value, hashes):
+    """ Hash of an input of a figure
+
+    Parameters
+    ----------
+    value: object
+        DataFrame, Series, file path, collection or parameter
+
+    hashes: dictionary
+        Hashes of the dataframes and files already hashed, by id or path: the figures share most of their inputs
+
+    Returns
+    -------
+    : str
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        if id(value) not in hashes:
+            frame = value.to_frame() if isinstance(value, pd.Series) else value
+            sha1 = hashlib.sha1(repr((list(frame.columns), list(map(str, frame.dtypes)))).encode())
+            try:
+                sha1.update(pd.util.hash_pandas_object(value).values.tobytes())
+            except TypeError:
+                # unhashable values, e.g. lists
+                sha1.update(value.to_csv().encode())
+            hashes[id(value)] = sha1.hexdigest()
+        return hashes[id(value)]
+    if isinstance(value, Path):
+        if str(value) not in hashes:
+            hashes[str(value)] = file_signature(value)["sha1"] if value.exists() else "missing"
+        return hashes[str(value)]
+    if isinstance(value, dict):
+        return repr(sorted((repr(k), hash_input(v, hashes)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return repr([hash_input(v, hashes) for v in value])
+    return repr(value)
+
+
+def figure_key(figure, arguments, hashes):
+    """ Key of a figure: hash of its arguments, of the source of its plot function and of the source files of the
+    modules drawing the plots, whose helpers the plot functions call """
+    source_files = [Path(inspect.getsourcefile(module))
+                    for module in PLOT_MODULES + (inspect.getmodule(figure.function),)]
+    sha1 = hashlib.sha1(inspect.getsource(figure.function).encode())
+    sha1.update(hash_input(source_files, hashes).encode())
+    sha1.update(hash_input(arguments, hashes).encode())
+    return sha1.hexdigest()
+
+
+def render_figure(name):
+    """ Draw a figure and save it in all the formats of the report
+
+    The plot functions may draw several figures: the figures after the first one are saved as `<name>_<number>`.
+
+    Parameters
+    ----------
+    name: str
+        Name of the figure, in FIGURES
+
+    Returns
+    -------
+    entry: dictionary
+        Entry of the figure in the manifest: status, files written and error if it could not be drawn
+    """
+    results, bau, name_run, report_folder, formats = _REPORT
+    figure = FIGURES_BY_NAME[name]
+    plt.close('all')
+    try:
+        options = figure.options(results) if figure.options is not None else {}
+        figure.function(*figure.arguments(results, bau, name_run), **options)
+        files = []
+        for number, figure_number in enumerate(plt.get_fignums(), start=1):
+            stem = name if number == 1 else "{0}_{1}".format(name, number)
+            for file_format in formats:
+                plt.figure(figure_number).savefig(str(report_folder / "{0}.{1}".format(stem, file_format)),
+                                                  format=file_format)
+                files.append("{0}.{1}".format(stem, file_format))
+        return {"status": "rendered", "files": files}
+    except Exception:
+        return {"status": "failed", "error": traceback.format_exc()}
+    finally:
+        plt.close('all')
+
+
+def write_index(report_folder, manifest, name_run):
+    """ Write the HTML page showing all the figures of the report """
+    sections = []
+    for figure in FIGURES:
+        entry = manifest.get(figure.name)
+        if entry is None:
+            continue
+        title = "<h2>{0}</h2>".format(html.escape(figure.name.replace("_", " ")))
+        if entry["status"] == "rendered":
+            images = [f for f in entry["files"] if f.endswith(".png")] or entry["files"]
+            links = " ".join('<a href="{0}">{1}</a>'.format(html.escape(f), html.escape(Path(f).suffix[1:]))
+                             for f in entry["files"])
+            body = "\n".join('<img src="{0}" alt="{1}">'.format(html.escape(f), html.escape(figure.name))
+                             for f in images) + "\n<p>{0}</p>".format(links)
+        else:
+            body = "<pre>{0}</pre>".format(html.escape(entry.get("error", entry["status"])))
+        sections.append('<section id="{0}">\n{1}\n{2}\n</section>'.format(figure.name, title, body))
+    with open(str(report_folder / REPORT_INDEX), 'w') as f:
+        f.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{0}</title>\n"
+                "<style>img {{max-width: 100%;}} section {{margin-bottom: 3em;}}</style>\n</head>\n<body>\n"
+                "<h1>{0}</h1>\n{1}\n</body>\n</html>\n".format(html.escape(name_run), "\n".join(sections)))
+
+
+def render_report(results, report_folder, bau=None, name_run="Submission", formats=FORMATS, max_workers=None):
+    """ Render all the figures of a run into a folder, with an HTML index
+
+    Parameters
+    ----------
+    results: ResultFiles
+        Run to report on
+
+    report_folder: pathlib.Path object
+        Folder of the figures, created if needed
+
+    bau: ResultFiles, optional
+        BAU run, for the figures comparing the run to the BAU. These figures are left out without it
+
+    name_run: str
+        Name of the run , e.g. "BAU", "Run 1", "Submission"...
+
+    formats: tuple of str
+        Formats of the figure files
+
+    max_workers: int, optional
+        Number of figures drawn simultaneously, the number of CPUs by default
+
+    Returns
+    -------
+    manifest: dictionary
+        {figure name: {"key", "status", "files", "error"}}, also written to `report.json` in the report folder
+    """
+    global _REPORT
+    report_folder = Path(report_folder)
+    report_folder.mkdir(parents=True, exist_ok=True)
+    manifest_path = report_folder / REPORT_MANIFEST
+    try:
+        with open(str(manifest_path)) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    manifest = {}
+    to_render = []
+    hashes = {}
+    for figure in FIGURES:
+        if figure.bau and bau is None:
+            continue
+        arguments = figure.arguments(results, bau, name_run)
+        missing = [str(value) for value in arguments if isinstance(value, Path) and not value.exists()]
+        if missing:
+            manifest[figure.name] = {"status": "missing inputs", "error": "Missing inputs: " + ", ".join(missing)}
+            continue
+        key = "{0}-{1}".format(figure_key(figure, arguments, hashes), "-".join(formats))
+        entry = previous.get(figure.name)
+        if entry is not None and entry.get("key") == key and entry.get("status") == "rendered" and \
+                all((report_folder / f).exists() for f in entry["files"]):
+            manifest[figure.name] = entry
+        else:
+            manifest[figure.name] = {"key": key}
+            to_render.append(figure.name)
+    print("Rendering {0} figures, {1} unchanged".format(
+        len(to_render), sum(entry.get("status") == "rendered" for entry in manifest.values())))
+
+    # the derived inputs are built before forking, to be shared by the workers
+    if any(FIGURES_BY_NAME[name].options is not None for name in to_render):
+        results.trip_cube
+    _REPORT = (results, bau, name_run, report_folder, formats)
+    try:
+        max_workers = min(max_workers or os.cpu_count() or 1, len(to_render))
+        if max_workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # a process forked while a writer thread holds a lock (e.g. of the allocator or of a file) could deadlock
+            for run_results in (results, bau):
+                if run_results is not None:
+                    run_results.writer.wait()
+            # one process per figure: the plot functions share the global state of pyplot, and some modify their
+            # input dataframes
+            with multiprocessing.get_context('fork').Pool(max_workers, maxtasksperchild=1) as pool:
+                entries = pool.map(render_figure, to_render, chunksize=1)
+        else:
+            entries = [render_figure(name) for name in to_render]
+    finally:
+        _REPORT = None
+
+    for name, entry in zip(to_render, entries):
+        manifest[name].update(entry)
+        if entry["status"] == "failed":
+            print("Failed to render {0}:\n{1}".format(name, entry["error"]))
+    write_json(manifest_path, manifest)
+    write_index(report_folder, manifest, name_run)
+    return manifest
+
+
+def run(args):
+    reference_data = ReferenceData(args.sample_size)
+    results = ResultFiles(Path(args.output_dir), args.iter_number, reference_data)
+    bau = None
+    if args.bau:
+        bau = ResultFiles(Path(reference_data.path_output_folder_bau), args.bau_iter_number, reference_data)
+    report_folder = Path(args.report_dir) if args.report_dir else Path(args.output_dir) / "report"
+    render_report(results, report_folder, bau=bau, name_run=args.name_run, formats=tuple(args.formats),
+                  max_workers=args.max_workers)
+    results.writer.close()
+    if bau is not None:
+        bau.writer.close()
+    print("Report written to {0}".format(report_folder / REPORT_INDEX))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render all the figures of a BISTRO run into an HTML report.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("output_dir", type=str, help="Path to output directory.")
+    parser.add_argument("iter_number", type=int, help="Iteration used to parse data.")
+    parser.add_argument("--sample_size", type=str, default="15k", help="Sample size.")
+    parser.add_argument("--name_run", type=str, default="Submission", help="Name of the run in the figures.")
+    parser.add_argument("--bau", action="store_true", help="Compare the run to the BAU run of the sample size.")
+    parser.add_argument("--bau_iter_number", type=int, default=101, help="Iteration of the BAU run.")
+    parser.add_argument("--report_dir", type=str, help="Folder of the report, `report` in the output directory by "
+                                                       "default.")
+    parser.add_argument("--formats", type=str, nargs="+", default=list(FORMATS), help="Formats of the figures.")
+    parser.add_argument("--max_workers", type=int, help="Number of figures drawn simultaneously.")
+    args = parser.parse_args()
+
+    run(args)
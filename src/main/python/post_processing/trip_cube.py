@@ -0,0 +1,118 @@
+"""Trip cube: number of trips, and sums of their distances, durations, costs and speeds, for each combination of
+realized mode, income group, age group, distance group and hour of departure.
+
+The cube is built once per run. The mode choice plots of the visualization module are slices of it, instead of
+joining the persons with the trips and grouping the trips again for each plot.
+"""
+import numpy as np
+import pandas as pd
+
+INCOME_BINS = [0, 10000, 25000, 50000, 75000, 100000, float('inf')]
+AGE_BINS = [0, 18, 30, 40, 50, 60, float('inf')]
+DISTANCE_BINS = [0, 1000, 2500, 5000, 7500, 10000, 60000]
+DISTANCE_MILES_BINS = [0, .5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 5, 7.5, 10, 40]
+TIME_INTERVAL_BINS = [6, 8, 10, 12, 14, 16, 18, 20, 22, 24, 26]
+METERS_TO_MILES = 0.000621371
+METERS_PER_SEC_TO_MILES_PER_HOUR = 2.23694
+
+# Dimensions of the cube: binned dimensions are categorical, with the same intervals as the former plots
+CUBE_DIMENSIONS = ["realizedTripMode", "income_group", "age_group", "distance_group", "distance_group_miles", "hour"]
+# Sums of the trip columns kept in the cube, when they exist
+CUBE_SUMS = {"Distance_m": "distance_m", "Duration_sec": "duration_sec", "FuelCost": "fuel_cost", "Fare": "fare",
+             "Incentive": "incentive"}
+
+
+def build_trip_cube(trips_df, person_df=None):
+    """ Aggregate the trips over their realized mode, the income and age groups of the persons, their distance groups
+    and their hour of departure
+
+    Parameters
+    ----------
+    trips_df: pandas DataFrame
+        Trips of a run, with the `PID`, `realizedTripMode`, `Distance_m`, `Duration_sec` and `Start_time` columns
+
+    person_df: pandas DataFrame, optional
+        Persons of the run, with the `PID`, `Age` and `income` columns. Without it, the income and age groups are
+        missing
+
+    Returns
+    -------
+    cube: pandas DataFrame
+        One row per combination of the CUBE_DIMENSIONS with trips, a missing value standing for trips out of the
+        bins. The measures are the number of `trips`, the sums of the CUBE_SUMS columns, and the number of trips with
+        a positive duration (`moving_trips`) and the sum of their speeds in miles/hour (`speed_sum`)
+    """
+    if person_df is not None:
+        persons = person_df.drop_duplicates('PID').set_index('PID')
+        income = persons['income'].reindex(trips_df['PID'].values).values
+        age = persons['Age'].reindex(trips_df['PID'].values).values
+    else:
+        income = age = np.full(len(trips_df), np.nan)
+
+    distance = trips_df['Distance_m'].values
+    duration = trips_df['Duration_sec'].values
+    modes = pd.Series(trips_df['realizedTripMode'].values).astype(object)
+    mode_codes, mode_ids = pd.factorize(modes, sort=True)
+    dimensions = {
+        "realizedTripMode": mode_codes,
+        "income_group": pd.cut(income, INCOME_BINS, right=False),
+        "age_group": pd.cut(age, AGE_BINS, right=False),
+        "distance_group": pd.cut(distance, DISTANCE_BINS, right=False),
+        "distance_group_miles": pd.cut(distance * METERS_TO_MILES, DISTANCE_MILES_BINS, right=False),
+    }
+    codes = pd.DataFrame({name: dimension if name == "realizedTripMode" else dimension.codes
+                          for name, dimension in dimensions.items()})
+    # trips without a start time are kept with the hour -1
+    codes["hour"] = np.nan_to_num(np.floor(trips_df['Start_time'].values.astype(float) / 3600), nan=-1).astype(int)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = METERS_PER_SEC_TO_MILES_PER_HOUR * distance / duration
+    moving = (duration > 0) & ~np.isnan(speeds)
+    measures = pd.DataFrame({"trips": np.ones(len(trips_df), dtype=np.int64)})
+    for column, name in CUBE_SUMS.items():
+        if column in trips_df.columns:
+            measures[name] = trips_df[column].values
+    measures["moving_trips"] = moving.astype(np.int64)
+    measures["speed_sum"] = np.where(moving, speeds, 0)
+
+    # the cells are grouped by integer codes: missing values are codes -1, and kept
+    cube = pd.concat([codes, measures], axis=1).groupby(CUBE_DIMENSIONS, sort=True).sum().reset_index()
+    cube["realizedTripMode"] = pd.Series(mode_ids.values.astype(object)).reindex(cube["realizedTripMode"].values).values
+    for name in CUBE_DIMENSIONS[1:-1]:
+        cube[name] = pd.Categorical.from_codes(cube[name].values, dimensions[name].categories)
+    cube["hour"] = cube["hour"].where(cube["hour"] >= 0)
+    return cube
+
+
+def slice_trip_cube(cube, dimensions, measures, rows=None):
+    """ Sums of measures of the cube over some of its dimensions
+
+    Like a groupby of the trips: the combinations without trips of the observed modes and of all the bins are kept
+    with zero sums, and the trips out of the bins are left out.
+
+    Parameters
+    ----------
+    cube: pandas DataFrame
+        Output of build_trip_cube()
+
+    dimensions: list of str
+        Dimensions of the cube kept, or columns added to the cube (e.g. other bins of its dimensions)
+
+    measures: list of str
+
+    rows: boolean array, optional
+        Cells of the cube aggregated, all of them by default
+
+    Returns
+    -------
+    : pandas DataFrame
+        One row per combination of the dimensions, one column per dimension and per measure
+    """
+    if rows is not None:
+        cube = cube[rows]
+    return cube.groupby(dimensions, observed=False)[measures].sum().reset_index()
+
+
+def add_time_intervals(cube):
+    """ Cube with the `time_interval` column: two-hour intervals of the hours of departure, from 6am to 2am """
+    return cube.assign(time_interval=pd.cut(cube['hour'], TIME_INTERVAL_BINS, right=False))
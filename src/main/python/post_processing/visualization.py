@@ -22,6 +22,9 @@ from collections import defaultdict
 
 # Defining matplolib parameters
 from .fixed_data_visualization import ReferenceData
+from . import metrics
+from .range_parsing import add_range_columns
+from .trip_cube import add_time_intervals, build_trip_cube, slice_trip_cube
 
 plt.rcParams["axes.titlesize"] = 15
 plt.rcParams["axes.titleweight"] = "bold"
@@ -101,10 +104,7 @@ def splitting_min_max(df, name_column):
         df["min_{0}".format(name_column)] = [0]
         df["max_{0}".format(name_column)] = [0]
     else:
-        min_max = df[name_column].str.replace("[", "").str.replace("]", "").str.replace("(", "").str.replace(")", "") \
-            .str.split(":", expand=True)
-        df["min_{0}".format(name_column)] = min_max.iloc[:, 0].astype(int)
-        df["max_{0}".format(name_column)] = min_max.iloc[:, 1].astype(int)
+        add_range_columns(df, name_column)
 
     return df
 
@@ -612,7 +612,7 @@ def plot_mode_choice_by_hour(mode_choice_by_hour_data_path, name_run):
     plt.title("Output - Mode choice over the agent's day \n (goes past midnight) - {}".format(name_run))
 
 
-def plot_mode_choice_by_income_group(person_df, trips_df, name_run):
+def plot_mode_choice_by_income_group(person_df, trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice By Income Group output
 
     Parameters
@@ -626,22 +626,21 @@ def plot_mode_choice_by_income_group(person_df, trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
-    person_df = person_df[['PID', 'Age', 'income']]
-    mode_df = trips_df[['PID', 'realizedTripMode']]
-    people_age_income_mode = person_df.merge(mode_df, on=['PID'])
-    people_age_income_mode['income_group'] = pd.cut(people_age_income_mode.income,
-                                                    [0, 10000, 25000, 50000, 75000, 100000, float('inf')],
-                                                    right=False)
-    people_income_mode_grouped = people_age_income_mode.groupby(by=['realizedTripMode', 'income_group']).agg(
-        'count').reset_index()
+    if cube is None:
+        cube = build_trip_cube(trips_df, person_df)
+    people_income_mode_grouped = slice_trip_cube(cube, ['realizedTripMode', 'income_group'], ['trips'],
+                                                 rows=cube['income_group'].notna())
 
     # rename df column to num_people due to grouping
     people_income_mode_grouped = people_income_mode_grouped.rename(
-        index=str, columns={'PID': 'num_people'})
+        index=str, columns={'trips': 'num_people'})
 
     # plot
     fig, ax = plt.subplots(figsize=(8, 6))
@@ -650,7 +649,8 @@ def plot_mode_choice_by_income_group(person_df, trips_df, name_run):
     ax.set_title("Output - Mode choice by income group - {}".format(name_run))
     return ax
 
-def plot_mode_choice_per_income_group(person_df, trips_df, name_run):
+
+def plot_mode_choice_per_income_group(person_df, trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice percentages per Income Group output
 
     Parameters
@@ -664,29 +664,24 @@ def plot_mode_choice_per_income_group(person_df, trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
-    person_df = person_df[['PID', 'Age', 'income']]
-    mode_df = trips_df[['PID', 'realizedTripMode']]
-    people_age_income_mode = person_df.merge(mode_df, on=['PID'])
-    people_age_income_mode['income_group'] = pd.cut(people_age_income_mode.income,
-                                                    [0, 10000, 25000, 50000, 75000, 100000, float('inf')],
-                                                    right=False)
-    people_income_mode_grouped = people_age_income_mode.groupby(by=['realizedTripMode', 'income_group']).agg('count').reset_index()
+    if cube is None:
+        cube = build_trip_cube(trips_df, person_df)
+    people_income_mode_grouped = slice_trip_cube(cube, ['realizedTripMode', 'income_group'], ['trips'],
+                                                 rows=cube['income_group'].notna())
 
     # rename df column to num_people due to grouping
     people_income_mode_grouped = people_income_mode_grouped.rename(
-        index=str, columns={'PID': 'num_people'})
-    
-    mode_df_dub_grouped = people_income_mode_grouped.groupby(by='income_group').agg('sum')
-    mode_df_dub_grouped = mode_df_dub_grouped.rename(index=str, columns={'Age': 'total_trips_by_income'})
-    
-    people_income_mode_grouped['total_trips_by_income'] = np.zeros(people_income_mode_grouped.shape[0])
-    for d in people_income_mode_grouped['income_group'].unique():
-        people_income_mode_grouped.loc[people_income_mode_grouped['income_group']==d,'total_trips_by_income'] = mode_df_dub_grouped.loc[str(d),'total_trips_by_income']
-    
+        index=str, columns={'trips': 'num_people'})
+
+    people_income_mode_grouped['total_trips_by_income'] = people_income_mode_grouped.groupby(
+        'income_group')['num_people'].transform('sum')
     people_income_mode_grouped['percent_trips_by_income']=  people_income_mode_grouped['num_people']/people_income_mode_grouped['total_trips_by_income']
     
     # plot
@@ -697,7 +692,7 @@ def plot_mode_choice_per_income_group(person_df, trips_df, name_run):
     return ax
 
 
-def plot_mode_choice_by_age_group(person_df, trips_df, name_run):
+def plot_mode_choice_by_age_group(person_df, trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice By Age Group output
 
     Parameters
@@ -711,24 +706,22 @@ def plot_mode_choice_by_age_group(person_df, trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
-    person_df = person_df[['PID', 'Age', 'income']]
-    mode_df = trips_df[['PID', 'realizedTripMode']]
-    people_age_mode = person_df.merge(mode_df, on=['PID'])
-
-    people_age_mode['age_group'] = pd.cut(people_age_mode.Age,
-                                          [0, 18, 30, 40, 50, 60, float('inf')],
-                                          right=False)
+    if cube is None:
+        cube = build_trip_cube(trips_df, person_df)
 
     # group the data and reset index to keep as consistent dataframe
-    people_age_mode_grouped = people_age_mode.groupby(
-        by=['realizedTripMode', 'age_group']).agg('count').reset_index()
+    people_age_mode_grouped = slice_trip_cube(cube, ['realizedTripMode', 'age_group'], ['trips'],
+                                              rows=cube['age_group'].notna())
 
     # rename df column to num_people due to grouping
-    people_age_mode_grouped = people_age_mode_grouped.rename(index=str, columns={'PID': 'num_people'})
+    people_age_mode_grouped = people_age_mode_grouped.rename(index=str, columns={'trips': 'num_people'})
     fig, ax = plt.subplots(figsize=(9, 6))
     sns.barplot(data=people_age_mode_grouped, x="realizedTripMode", y="num_people", hue="age_group")
     ax.legend(title="Age group", bbox_to_anchor=(1.0, 1.01))
@@ -736,7 +729,8 @@ def plot_mode_choice_by_age_group(person_df, trips_df, name_run):
 
     return ax
 
-def plot_mode_choice_by_trip_distance(trips_df, name_run):
+
+def plot_mode_choice_by_trip_distance(trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice By Trip Distance output
 
     Parameters
@@ -747,32 +741,24 @@ def plot_mode_choice_by_trip_distance(trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
 
-    mode_df = trips_df[['Trip_ID', 'Distance_m', 'realizedTripMode']]
-    mode_df['distance_group'] = pd.cut(mode_df.Distance_m,
-                                       [0, 1000, 2500, 5000, 7500, 10000, 60000],
-                                       right=False)
-
-    mode_df_grouped = mode_df.groupby(by=['realizedTripMode', 'distance_group']).agg('count').reset_index()
+    if cube is None:
+        cube = build_trip_cube(trips_df)
+    mode_df_grouped = slice_trip_cube(cube, ['realizedTripMode', 'distance_group'], ['trips'])
 
     # rename df column to num_people due to grouping
-    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'Trip_ID': 'num_trips'})
-
-    mode_df_dub_grouped = mode_df_grouped.groupby(by='distance_group').agg('sum')
-    mode_df_dub_grouped = mode_df_dub_grouped.rename(index=str, columns={'Distance_m': 'total_trips_by_dist'})
+    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'trips': 'num_trips'})
 
-    mode_df_grouped['total_trips_by_dist'] = np.zeros(mode_df_grouped.shape[0])
-    for d in mode_df_grouped['distance_group'].unique():
-        mode_df_grouped.loc[mode_df_grouped['distance_group'] == d, 'total_trips_by_dist'] = mode_df_dub_grouped.loc[
-            str(d), 'total_trips_by_dist']
+    mode_df_grouped['total_trips_by_dist'] = mode_df_grouped.groupby('distance_group')['num_trips'].transform('sum')
     mode_df_grouped['% Total Trips by Trip Distance'] = mode_df_grouped['num_trips'] / mode_df_grouped[
         'total_trips_by_dist']
-    trip_distance_labels = {x[0]: str(x[0]) + ', n = ' + str(int(x[1][1])) for x in mode_df_dub_grouped.iterrows()}
-    mode_df_grouped['trip_labels'] = [trip_distance_labels[str(y[1][1])] for y in mode_df_grouped.iterrows()]
     mode_df_grouped = mode_df_grouped.rename(index=str, columns={'distance_group': 'Trip Distance (meters)'})
     # plot
     fig, ax = plt.subplots(figsize=(8, 6))
@@ -783,7 +769,7 @@ def plot_mode_choice_by_trip_distance(trips_df, name_run):
     return ax
 
 
-def plot_mode_choice_by_trip_distance_stacked(trips_df, name_run):
+def plot_mode_choice_by_trip_distance_stacked(trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice By Trip Distance output
 
     Parameters
@@ -794,19 +780,21 @@ def plot_mode_choice_by_trip_distance_stacked(trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
 
-    mode_df = trips_df[['Trip_ID', 'Distance_m', 'realizedTripMode']]
-    mode_df.loc[:,'Distance_miles'] = mode_df.loc[:,'Distance_m'] * 0.000621371
-    mode_df.loc[:,'Trip Distance (miles)'] = pd.cut(mode_df.Distance_miles,[0, .5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 5, 7.5, 10, 40],right=False)
-
-    mode_df_grouped = mode_df.groupby(by=['realizedTripMode', 'Trip Distance (miles)']).agg('count').reset_index()
+    if cube is None:
+        cube = build_trip_cube(trips_df)
+    mode_df_grouped = slice_trip_cube(cube, ['realizedTripMode', 'distance_group_miles'], ['trips'])
 
     # rename df column to num_people due to grouping
-    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'Trip_ID': 'num_trips'})
+    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'trips': 'num_trips',
+                                                                 'distance_group_miles': 'Trip Distance (miles)'})
 
     for_plot = mode_df_grouped[['realizedTripMode', 'Trip Distance (miles)', 'num_trips']]
     for_plot = for_plot.rename(columns={'realizedTripMode': 'Trip Mode'})
@@ -818,7 +806,7 @@ def plot_mode_choice_by_trip_distance_stacked(trips_df, name_run):
     plt.ylabel('Number of Trips')
 
 
-def plot_num_trips_by_trip_distance(trips_df, name_run):
+def plot_num_trips_by_trip_distance(trips_df, name_run, cube=None):
     """Plotting the Overall Mode choice By Trip Distance output
 
     Parameters
@@ -829,28 +817,22 @@ def plot_num_trips_by_trip_distance(trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
 
-    mode_df = trips_df[['Trip_ID', 'Distance_m', 'realizedTripMode']]
-    mode_df['distance_group'] = pd.cut(mode_df.Distance_m,
-                                       [0, 1000, 2500, 5000, 7500, 10000, 60000],
-                                       right=False)
-
-    mode_df_grouped = mode_df.groupby(by=['realizedTripMode', 'distance_group']).agg('count').reset_index()
+    if cube is None:
+        cube = build_trip_cube(trips_df)
+    mode_df_grouped = slice_trip_cube(cube, ['realizedTripMode', 'distance_group'], ['trips'])
 
     # rename df column to num_people due to grouping
-    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'Trip_ID': 'num_trips'})
+    mode_df_grouped = mode_df_grouped.rename(index=str, columns={'trips': 'num_trips'})
 
-    mode_df_dub_grouped = mode_df_grouped.groupby(by='distance_group').agg('sum')
-    mode_df_dub_grouped = mode_df_dub_grouped.rename(index=str, columns={'Distance_m': 'total_trips_by_dist'})
-
-    mode_df_grouped['total_trips_by_dist'] = np.zeros(mode_df_grouped.shape[0])
-    for d in mode_df_grouped['distance_group'].unique():
-        mode_df_grouped.loc[mode_df_grouped['distance_group'] == d, 'total_trips_by_dist'] = mode_df_dub_grouped.loc[
-            str(d), 'total_trips_by_dist']
+    mode_df_grouped['total_trips_by_dist'] = mode_df_grouped.groupby('distance_group')['num_trips'].transform('sum')
 
     mode_df_grouped = mode_df_grouped.rename(index=str, columns={"distance_group": "Trip Distance (meters)",
                                                                  "total_trips_by_dist": "Number of Trips"})
@@ -863,7 +845,7 @@ def plot_num_trips_by_trip_distance(trips_df, name_run):
     return ax
 
 
-def plot_average_speed_by_tod_per_mode(trips_df, name_run):
+def plot_average_speed_by_tod_per_mode(trips_df, name_run, cube=None):
     """Plotting the average speed by time of day per trip mode output
 
     Parameters
@@ -874,30 +856,32 @@ def plot_average_speed_by_tod_per_mode(trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
-    trips_df['average speed (meters/sec)'] = trips_df['Distance_m'] / trips_df['Duration_sec']
-    trips_df['Average Speed (miles/hour)'] = 2.23694 * trips_df['average speed (meters/sec)']
-    trips_df['Start_time_hour'] = trips_df['Start_time'] / 3600
-    # trips_df['Start time (hour)'] =round(trips_df['Start_time_hour'],0)
-    trips_new = trips_df.loc[trips_df['Duration_sec'] > 0,]
-    trips_new.loc[:,'time_interval'] = pd.cut(trips_new['Start_time_hour'],
-                                        [6, 8, 10, 12, 14, 16, 18, 20, 22, 24, 26],
-                                        right=False)
-    trips_new = trips_new.rename(index=str, columns={"time_interval": "Start time interval (hour)"})
+    if cube is None:
+        cube = build_trip_cube(trips_df)
+    # average speed of the trips with a positive duration
+    trips_grouped = slice_trip_cube(add_time_intervals(cube), ["realizedTripMode", "time_interval"],
+                                    ["moving_trips", "speed_sum"], rows=cube['moving_trips'] > 0)
+    trips_grouped['Average Speed (miles/hour)'] = trips_grouped['speed_sum'] / trips_grouped['moving_trips']
+    trips_grouped = trips_grouped.rename(index=str, columns={"time_interval": "Start time interval (hour)"})
 
     # plot
     fig, ax = plt.subplots(figsize=(12, 6))
     # sns.lineplot(data=trips_grouped_tod, x="Start time (hour)", y="average speed (miles/hour)", hue="realizedTripMode", ax=ax)
-    sns.barplot(data=trips_new, x="Start time interval (hour)", y="Average Speed (miles/hour)", hue="realizedTripMode",
+    sns.barplot(data=trips_grouped, x="Start time interval (hour)", y="Average Speed (miles/hour)", hue="realizedTripMode",
                 ax=ax)
     ax.legend(title="Trip Mode", bbox_to_anchor=(1.0, 1.01))
     ax.set_title("Average Travel Speed by Time of Day per Mode - {}".format(name_run))
     return ax
 
-def plot_num_trips_by_tod_per_mode(trips_df, name_run):
+
+def plot_num_trips_by_tod_per_mode(trips_df, name_run, cube=None):
     """Plotting the number of trips by binned time of day per trip mode output
 
     Parameters
@@ -908,21 +892,20 @@ def plot_num_trips_by_tod_per_mode(trips_df, name_run):
     name_run: str
         Name of the run , e.g. "BAU", "Run 1", "Submission"...
 
+    cube: pandas DataFrame, optional
+        Trip cube of the run (output of build_trip_cube()), built from the dataframes if not provided
+
     Returns
     -------
     ax: matplotlib axes object
     """
-    trips_df['average speed (meters/sec)'] = trips_df['Distance_m'] / trips_df['Duration_sec']
-    trips_df['Average Speed (miles/hour)'] = 2.23694 * trips_df['average speed (meters/sec)']
-    trips_df['Start_time_hour'] = trips_df['Start_time'] / 3600
-    # trips_df['Start time (hour)'] =round(trips_df['Start_time_hour'],0)
-    trips_new = trips_df.loc[trips_df['Duration_sec'] > 0,]
-    trips_new['time_interval'] = pd.cut(trips_new['Start_time_hour'],
-                                        [6, 8, 10, 12, 14, 16, 18, 20, 22, 24, 26],
-                                        right=False)
-    trips_new = trips_new.rename(index=str, columns={"time_interval": "Start time interval (hour)"})
-    trips_grouped = trips_new.groupby(by=["realizedTripMode", "Start time interval (hour)"]).agg('count').reset_index()
-    trips_grouped = trips_grouped.rename(index=str, columns={"Trip_ID": "Number of Trips"})
+    if cube is None:
+        cube = build_trip_cube(trips_df)
+    # trips with a positive duration
+    trips_grouped = slice_trip_cube(add_time_intervals(cube), ["realizedTripMode", "time_interval"],
+                                    ["moving_trips"], rows=cube['moving_trips'] > 0)
+    trips_grouped = trips_grouped.rename(index=str, columns={"time_interval": "Start time interval (hour)",
+                                                             "moving_trips": "Number of Trips"})
     # plot
     fig, ax = plt.subplots(figsize=(12, 6))
     # sns.lineplot(data=trips_grouped_tod, x="Start time (hour)", y="average speed (miles/hour)", hue="realizedTripMode", ax=ax)
@@ -931,6 +914,7 @@ def plot_num_trips_by_tod_per_mode(trips_df, name_run):
     ax.set_title("Number of Trips by Time of Day per Mode - {}".format(name_run))
     return ax
 
+
 def plot_average_travel_expenditure_per_trip_per_mode_over_day(trips_df, name_run):
     """Plot the Average Travel Expenditure Per Trip and By MOde Over THe Day output
 
@@ -967,7 +951,8 @@ def plot_average_travel_expenditure_per_trip_per_mode_over_day(trips_df, name_ru
         + this_trips_df.loc[this_trips_df['realizedTripMode'] == 'drive_transit',:].FuelCost.values
 
 
-    this_trips_df.loc[this_trips_df['trip_cost']<0,:] = 0
+    # the trips with a negative cost are left out
+    this_trips_df = this_trips_df[~(this_trips_df['trip_cost'] < 0)]
     #trips_df.loc[:, "trip_cost"] = trips_df.FuelCost.values + trips_df.Fare.values
     this_trips_df.loc[:, "hour_of_day"] = np.floor(this_trips_df.Start_time/3600)
     grouped_data = this_trips_df.groupby(by=["realizedTripMode", "hour_of_day"]).agg("mean")["trip_cost"].reset_index()
@@ -1048,9 +1033,9 @@ def plot_average_bus_crowding_by_bus_route_by_period_of_day(path_df, trip_to_rou
         """
     bus_slice_df = path_df.loc[path_df["mode"] == "bus"][["vehicle", "numPassengers", "departureTime",
                                                           "arrivalTime", "vehicleType"]]
-    bus_slice_df.loc[:, "route_id"] = bus_slice_df.vehicle.apply(lambda x: trip_to_route[x.split(":")[1].split('-')[0]])
+    bus_slice_df.loc[:, "route_id"] = metrics.get_bus_routes(path_df.loc[bus_slice_df.index], "vehicle", trip_to_route)
     bus_slice_df.loc[:, "serviceTime"] = (bus_slice_df.arrivalTime - bus_slice_df.departureTime) / 3600
-    bus_slice_df.loc[:, "seatingCapacity"] = bus_slice_df.vehicleType.apply(
+    bus_slice_df.loc[:, "seatingCapacity"] = bus_slice_df.vehicleType.astype(object).apply(
         lambda x: transit_scale_factor * seating_capacities[x])
     bus_slice_df.loc[:, "passengerOverflow"] = bus_slice_df.numPassengers > bus_slice_df.seatingCapacity
     # AM peak = 7am-10am, PM Peak = 5pm-8pm, Early Morning, Midday, Late Evening = in between
@@ -1246,20 +1231,7 @@ def plot_cost_benefits(traversal_path_df, legs_df, operational_costs, trip_to_ro
     -------
     ax: matplotlib axes object
         """
-    bus_slice_df = traversal_path_df.loc[traversal_path_df["mode"] == "bus"][["vehicle", "numPassengers", "departureTime",
-                                                          "arrivalTime", "FuelCost", "vehicleType"]]
-    bus_slice_df.loc[:, "route_id"] = bus_slice_df.vehicle.apply(lambda x: trip_to_route[x.split(":")[-1].split('-')[0]])
-    bus_slice_df.loc[:, "operational_costs_per_bus"] = bus_slice_df.vehicleType.apply(
-        lambda x: operational_costs[x])
-    bus_slice_df.loc[:, "serviceTime"] = (bus_slice_df.arrivalTime - bus_slice_df.departureTime) / 3600
-    bus_slice_df.loc[:, "OperationalCosts"] = bus_slice_df.operational_costs_per_bus * bus_slice_df.serviceTime
-
-    bus_fare_df = legs_df.loc[legs_df["Mode"] == "bus"][["Veh", "Fare"]]
-    bus_fare_df.loc[:, "route_id"] = bus_fare_df.Veh.apply(
-        lambda x: trip_to_route[x.split(":")[-1].split('-')[0].split('-')[0]])
-    merged_df = pd.merge(bus_slice_df, bus_fare_df, on=["route_id"])
-
-    grouped_data = merged_df.groupby(by="route_id").agg("sum")[["OperationalCosts", "FuelCost", "Fare"]]
+    grouped_data = metrics.get_route_costs_and_benefits(traversal_path_df, legs_df, operational_costs, trip_to_route)
 
     fig, ax = plt.subplots(figsize=(8, 6))
     grouped_data.plot.bar(stacked=True, ax=ax)
@@ -1378,15 +1350,8 @@ def plot_vmt_per_mode(paths_traversals_df, legs_df, name_run):
     ax: matplotlib axes object
     """
 
-    # gathering the data
-    vmt_walk = round(
-        paths_traversals_df[paths_traversals_df["mode"] == "walk"]["length"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt_bus = round(
-        paths_traversals_df[paths_traversals_df["mode"] == "bus"]["length"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt_on_demand = round(
-        legs_df[legs_df["Mode"] == "OnDemand_ride"]["Distance_m"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt_car = round(legs_df[legs_df["Mode"] == "car"]["Distance_m"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt = pd.DataFrame({"bus": [vmt_bus], "car": [vmt_car], "on_demand_ride": [vmt_on_demand], "walk":[vmt_walk]})
+    # gathering the data: the on-demand rides are counted from the legs, without the trips to pick up the passengers
+    vmt = metrics.get_vmt_dataframe(paths_traversals_df, legs_df, on_demand_from_legs=True)
 
     # plotting
     fig, ax = plt.subplots()
@@ -1469,9 +1434,9 @@ def process_bus_vmt_by_ridership_state_data(paths_traversals_df, transit_scale_f
         ["numPassengers", "length", "departureTime", "arrivalTime", "vehicleType"]]
 
     # Calculate the capacity of each bus
-    vmt_bus_ridership.loc[:, "seatingCapacity"] = vmt_bus_ridership["vehicleType"].apply(
+    vmt_bus_ridership.loc[:, "seatingCapacity"] = vmt_bus_ridership["vehicleType"].astype(object).apply(
         lambda x: transit_scale_factor * seating_capacities[x])
-    vmt_bus_ridership.loc[:, "capacity"] = vmt_bus_ridership["vehicleType"].apply(
+    vmt_bus_ridership.loc[:, "capacity"] = vmt_bus_ridership["vehicleType"].astype(object).apply(
         lambda x: transit_scale_factor * capacity[x])
 
     # Split the travels by crowding state
@@ -1543,16 +1508,7 @@ def plot_bus_vmt_by_ridership_state_by_hour_of_the_day(paths_traversals_df, tran
 
 
 def get_vmt_dataframe(paths_traversals_df, legs_df):
-    vmt_walk = round(
-        paths_traversals_df[paths_traversals_df["mode"] == "walk"]["length"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt_bus = round(
-        paths_traversals_df[paths_traversals_df["mode"] == "bus"]["length"].apply(lambda x: x * 0.000621371).sum(), 0)
-
-    vmt_on_demand = round(
-        paths_traversals_df[paths_traversals_df["vehicle"].str.contains("rideHailVehicle")]["length"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt_car = round(legs_df[legs_df["Mode"] == "car"]["Distance_m"].apply(lambda x: x * 0.000621371).sum(), 0)
-    vmt = pd.DataFrame({"bus": [vmt_bus], "car": [vmt_car], "on_demand_ride": [vmt_on_demand], "walk" : [vmt_walk]})
-    return vmt
+    return metrics.get_vmt_dataframe(paths_traversals_df, legs_df)
 
 
 def plot_parallel_vmt_bau_submission(paths_traversals_df_bau, paths_traversals_df, legs_df_bau, legs_df):
@@ -1654,31 +1610,14 @@ def plot_vmt_on_demand(paths_traversals_df, name_run):
     return ax
 
 
-def get_emissions_dataframe(paths_traversals_df, legs_df):
-    vmt = paths_traversals_df.loc[:, ["vehicle", "mode", "length", "departureTime"]]
-
-    # emissions for each mode
-    emissions_walk = round(
-        vmt[vmt["mode"] == "walk"]["length"].apply(lambda x: x * 0.000621371 * 0).sum(), 0)
-    emissions_bus = round(
-        vmt[vmt["mode"] == "bus"]["length"].apply(lambda x: x * 0.000621371 * 0.259366648).sum(), 0)
-
-    emissions_on_demand = round(
-        vmt[vmt["vehicle"].str.contains("rideHailVehicle")]["length"].apply(
-            lambda x: x * 0.000621371 * 0.001716086).sum(), 0)
-
-    # Dealing with cars
-    emissions_car = round(
-        legs_df[legs_df["Mode"] == "car"]["Distance_m"].apply(lambda x: x * 0.000621371 * 0.001716086).sum(), 0)
-
-    emissions = pd.DataFrame({"bus": [emissions_bus], "car": [emissions_car], "on_demand_ride": [emissions_on_demand],
-                              "walk": [emissions_walk]})
-    return emissions
+def get_emissions_dataframe(paths_traversals_df, legs_df, emission_factors=metrics.EMISSION_FACTORS):
+    return metrics.get_emissions_dataframe(paths_traversals_df, legs_df, emission_factors)
 
 
-def plot_daily_emissions_per_mode(paths_traversals_df_bau, paths_traversals_df, legs_df_bau, legs_df):
-    emissions_bau = get_emissions_dataframe(paths_traversals_df_bau, legs_df_bau)
-    emissions_submission = get_emissions_dataframe(paths_traversals_df, legs_df)
+def plot_daily_emissions_per_mode(paths_traversals_df_bau, paths_traversals_df, legs_df_bau, legs_df,
+                                  emission_factors=metrics.EMISSION_FACTORS):
+    emissions_bau = get_emissions_dataframe(paths_traversals_df_bau, legs_df_bau, emission_factors)
+    emissions_submission = get_emissions_dataframe(paths_traversals_df, legs_df, emission_factors)
 
     emissions_both = pd.concat([emissions_bau, emissions_submission])
     emissions_both.loc[:, "Scenario"] = ["bau", "your submission"]
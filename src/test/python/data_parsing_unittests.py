@@ -0,0 +1,63 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+import data_parsing
+
+EVENTS_XML = """<?xml version="1.0" encoding="utf-8"?>
+<events version="1.0">
+    <event time="21600.0" type="PersonEntersVehicle" person="1" vehicle="1"/>
+    <event time="21700.0" type="PathTraversal" driver="1" vehicle="1" vehicleType="Car" length="1520.5" numPassengers="0" links="10,11,12" mode="car"/>
+    <event time="21800.0" type="PersonEntersVehicle" person="2" vehicle="2"/>
+    <event time="21900.0" type="PathTraversal" driver="2" vehicle="2" vehicleType="Car" length="830.0" numPassengers="1" links="7" mode="car"/>
+</events>
+"""
+
+EVENTS_CSV = """time,type,person,driver,vehicle,vehicleType,length,numPassengers,links,mode
+21600.0,PersonEntersVehicle,1,,1,,,,,
+21700.0,PathTraversal,,1,1,Car,1520.5,0,"10,11,12",car
+21800.0,PersonEntersVehicle,2,,2,,,,,
+21900.0,PathTraversal,,2,2,Car,830.0,1,7,car
+"""
+
+
+class LoadEventsTest(unittest.TestCase):
+    """Types of the columns of the events loaded from the events files, when all the identifiers are numbers.
+
+    """
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.folder))
+        (self.folder / "0.events.xml").write_text(EVENTS_XML)
+        (self.folder / "0.events.csv").write_text(EVENTS_CSV)
+
+    def check_events(self, events_df):
+        self.assertEqual(events_df["person"].tolist()[::2], ["1", "2"])
+        self.assertEqual(events_df["driver"].tolist()[1::2], ["1", "2"])
+        self.assertEqual(events_df["vehicle"].tolist(), ["1", "1", "2", "2"])
+        self.assertEqual(events_df["links"].tolist()[1::2], ["10,11,12", "7"])
+        # the measurements are still numbers
+        np.testing.assert_array_equal(events_df["length"].values[1::2], [1520.5, 830.])
+        np.testing.assert_array_equal(events_df["numPassengers"].values[1::2], [0, 1])
+
+    def test_numeric_ids_of_the_xml_events(self):
+        self.check_events(data_parsing.load_events(self.folder / "0.events.xml"))
+
+    def test_numeric_ids_of_the_csv_events(self):
+        self.check_events(data_parsing.load_events(self.folder / "0.events.csv"))
+
+    def test_numeric_ids_of_the_chunks(self):
+        # each chunk has a single event: the identifiers are strings in all of them
+        events_df = data_parsing.load_events(self.folder / "0.events.xml", ["PathTraversal"], ["driver", "links"],
+                                             chunk_size=1)
+        self.assertEqual(events_df["driver"].tolist(), ["1", "2"])
+        self.assertEqual(events_df["links"].tolist(), ["10,11,12", "7"])
+
+
+if __name__ == '__main__':
+    unittest.main()
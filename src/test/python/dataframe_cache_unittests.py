@@ -0,0 +1,92 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+from dataframe_cache import DataFrameCache, extract_archive
+
+
+class DataFrameCacheTest(unittest.TestCase):
+    """Validity and invalidation of the cache of the parsed DataFrames.
+
+    """
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.source = self.folder / "0.events.csv.gz"
+        self.source.write_bytes(b"events")
+        self.frames = {"legs": pd.DataFrame({
+            "PID": pd.Categorical.from_codes([0, 1, 0], ["p-0", "p-1"]),
+            "route_id": pd.Categorical.from_codes([0, -1, 1], [1340, 1341]),
+            "Distance_m": [10., 20., 30.]})}
+
+    def tearDown(self):
+        shutil.rmtree(str(self.folder))
+
+    def cache(self, sources=None, version=1):
+        return DataFrameCache(self.folder / "cache", sources if sources is not None else [self.source], version)
+
+    def test_frames_are_loaded_with_their_dtypes(self):
+        self.cache().save(self.frames)
+        pd.testing.assert_frame_equal(self.cache().load("legs"), self.frames["legs"])
+
+    def test_valid_until_a_source_changes(self):
+        self.assertFalse(self.cache().is_valid(["legs"]))
+        self.cache().save(self.frames)
+        self.assertTrue(self.cache().is_valid(["legs"]))
+        self.assertFalse(self.cache().is_valid(["legs", "trips"]))
+
+        self.source.write_bytes(b"events of another simulation")
+        self.assertFalse(self.cache().is_valid(["legs"]))
+
+    def test_touched_source_is_still_valid(self):
+        self.cache().save(self.frames)
+        stat = os.stat(str(self.source))
+        os.utime(str(self.source), (stat.st_atime, stat.st_mtime + 10))
+        self.assertTrue(self.cache().is_valid(["legs"]))
+
+    def test_other_sources_or_version_are_invalid(self):
+        self.cache().save(self.frames)
+        other_source = self.folder / "ModeIncentives.csv"
+        other_source.write_bytes(b"incentives")
+        self.assertFalse(self.cache(sources=[self.source, other_source]).is_valid(["legs"]))
+        self.assertFalse(self.cache(version=2).is_valid(["legs"]))
+
+    def test_source_changed_while_parsing_is_not_recorded(self):
+        cache = self.cache()
+        signatures = cache.source_signatures()
+        self.source.write_bytes(b"events written during the parsing")
+        cache.save(self.frames, signatures)
+        self.assertFalse(self.cache().is_valid(["legs"]))
+
+
+class ExtractArchiveTest(unittest.TestCase):
+    """Archives are extracted once, into folders named after their content.
+
+    """
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        (self.folder / "warm-start").mkdir()
+        (self.folder / "warm-start" / "outputPlans.xml").write_text("plans")
+        self.archive = Path(shutil.make_archive(str(self.folder / "warm-start"), "zip", str(self.folder),
+                                                "warm-start"))
+
+    def tearDown(self):
+        shutil.rmtree(str(self.folder))
+
+    def test_archive_is_extracted_once(self):
+        extraction_folder = self.folder / "archives"
+        folder = extract_archive(self.archive, extraction_folder)
+        self.assertEqual((folder / "warm-start" / "outputPlans.xml").read_text(), "plans")
+
+        (folder / "warm-start" / "outputPlans.xml").write_text("already extracted")
+        self.assertEqual(extract_archive(self.archive, extraction_folder), folder)
+        self.assertEqual((folder / "warm-start" / "outputPlans.xml").read_text(), "already extracted")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+import plans_parser
+
+ROUTE_IDS = [1340, 1341]
+TRIP_TO_ROUTE = {"t_1": 1340, "t_2": 1341}
+
+
+def build_fares():
+    """Fares of the `MassTransitFares.csv` file: a fare for all the routes, overridden on one route for the children
+    and the seniors.
+
+    """
+    return pd.DataFrame({"agencyId": "217",
+                         "routeId": [np.nan, 1341., 1341.],
+                         "age": ["[0:120]", "[0:10)", "(64:120]"],
+                         "amount": [1.5, 0.5, 0.75]})
+
+
+def build_bus_legs(pids, vehicles):
+    legs_df = pd.DataFrame({"PID": pd.Categorical(pids), "Mode": "bus", "Veh": vehicles})
+    return plans_parser.add_route_columns(legs_df, "Veh", "Mode", TRIP_TO_ROUTE)
+
+
+class BusFareInputTest(unittest.TestCase):
+    """Table of the fares by age and route parsed from the `MassTransitFares.csv` file.
+
+    """
+    def test_fares_by_age_and_route(self):
+        bus_fare_dict = plans_parser.parse_bus_fare_input(build_fares(), ROUTE_IDS, 120)
+        self.assertEqual(bus_fare_dict.shape, (121, 2))
+        self.assertEqual(bus_fare_dict.columns.tolist(), ROUTE_IDS)
+        self.assertTrue((bus_fare_dict[1340] == 1.5).all())
+        self.assertEqual(bus_fare_dict.loc[[0, 9, 10, 64, 65, 120], 1341].tolist(), [0.5, 0.5, 1.5, 1.5, 0.75, 0.75])
+
+    def test_route_missing_from_the_gtfs(self):
+        fares = build_fares()
+        fares.loc[len(fares)] = ["217", 1399., "[0:120]", 2.]
+        with self.assertRaisesRegex(KeyError, "No route \\[1399\\] in the GTFS data"):
+            plans_parser.parse_bus_fare_input(fares, ROUTE_IDS, 120)
+
+
+class TransitFaresTest(unittest.TestCase):
+    """Fares of the bus legs, looked up at the age of the passengers and the route of the buses.
+
+    """
+    def setUp(self):
+        self.bus_fare_dict = plans_parser.parse_bus_fare_input(build_fares(), ROUTE_IDS, 120)
+        self.person_df = pd.DataFrame({"Age": [5, 30, 70]}, index=["1", "2", "3"])
+
+    def test_fares_of_the_bus_legs(self):
+        legs_df = build_bus_legs(["1", "1", "2", "3"], ["sd:t_1-0", "sd:t_2-0", "sd:t_2-1", "sd:t_2-0"])
+        fares = plans_parser.calc_transit_fares(legs_df, self.bus_fare_dict, self.person_df)
+        np.testing.assert_array_equal(fares, [1.5, 0.5, 1.5, 0.75])
+
+    def test_fares_of_the_legs(self):
+        legs_df = pd.DataFrame({"PID": pd.Categorical(["1", "2", "3"]),
+                                "Mode": ["bus", "walk", "OnDemand_ride"],
+                                "Veh": ["sd:t_2-0", "body-2", "rideHailVehicle-1"],
+                                "Duration_sec": ["00:10:00", "00:05:00", "00:20:00"],
+                                "Distance_m": [5000., 400., 1000. / 0.621371]})
+        legs_df = plans_parser.add_route_columns(legs_df, "Veh", "Mode", TRIP_TO_ROUTE)
+        ride_hail_fares = {"base": 2., "duration": 0.5, "distance": 1.}
+        legs_df = plans_parser.calc_fares(legs_df, ride_hail_fares, self.bus_fare_dict, self.person_df)
+        np.testing.assert_allclose(legs_df["Fare"].values, [0.5, 0., 2. + 20 * 0.5 + 1.])
+
+    def test_unknown_age(self):
+        legs_df = build_bus_legs(["1", "4"], ["sd:t_1-0", "sd:t_1-0"])
+        with self.assertRaisesRegex(KeyError, "age of the persons \\['4'\\]"):
+            plans_parser.calc_transit_fares(legs_df, self.bus_fare_dict, self.person_df)
+
+        self.person_df.loc["4", "Age"] = 121
+        with self.assertRaisesRegex(KeyError, "age of the persons \\['4'\\]"):
+            plans_parser.calc_transit_fares(legs_df, self.bus_fare_dict, self.person_df)
+
+    def test_unknown_route(self):
+        legs_df = build_bus_legs(["1"], ["sd:t_3-0"])
+        with self.assertRaisesRegex(KeyError, "No route for the GTFS trips \\['t_3'\\]"):
+            plans_parser.calc_transit_fares(legs_df, self.bus_fare_dict, self.person_df)
+
+    def test_route_without_fares(self):
+        legs_df = build_bus_legs(["1"], ["sd:t_1-0"])
+        with self.assertRaisesRegex(KeyError, "No fares for the routes \\[1340\\]"):
+            plans_parser.calc_transit_fares(legs_df, self.bus_fare_dict[[1341]], self.person_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
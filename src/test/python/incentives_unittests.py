@@ -0,0 +1,85 @@
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+import plans_parser
+
+MAX_AGE = 120
+MAX_INCOME = 150000
+
+
+def build_incentives():
+    """Incentives of the `ModeIncentives.csv` file: the second walk-transit row overrides part of the first one.
+
+    """
+    return pd.DataFrame({"mode": ["walk_transit", "walk_transit", "OnDemand_ride", "car"],
+                         "age": ["[0:120]", "(64:120]", "[18:30)", "[0:120]"],
+                         "income": ["[0:150000]", "[0:20000)", "(50000:150000]", "[0:150000]"],
+                         "amount": [1., 3., 2.5, 10.]})
+
+
+class IncentiveInputTest(unittest.TestCase):
+    """Table of the incentives by mode, age and income bin parsed from the `ModeIncentives.csv` file.
+
+    """
+    def test_income_bins(self):
+        incentive_table = plans_parser.parse_incentive_input(build_incentives(), MAX_AGE, MAX_INCOME)
+        self.assertEqual(incentive_table.modes, plans_parser.INCENTIVE_ELIGIBLE_MODES)
+        np.testing.assert_array_equal(incentive_table.income_edges, [0, 20000, 50001, 150001])
+        self.assertEqual(incentive_table.amounts.shape, (3, MAX_AGE + 1, 3))
+
+    def test_incentives_by_age_and_income(self):
+        incentive_table = plans_parser.parse_incentive_input(build_incentives(), MAX_AGE, MAX_INCOME)
+        walk_transit = incentive_table.amounts[plans_parser.INCENTIVE_ELIGIBLE_MODES.index("walk_transit")]
+        np.testing.assert_array_equal(walk_transit[[0, 64, 65, 120]], [[1., 1., 1.], [1., 1., 1.],
+                                                                       [3., 1., 1.], [3., 1., 1.]])
+        on_demand = incentive_table.amounts[plans_parser.INCENTIVE_ELIGIBLE_MODES.index("OnDemand_ride")]
+        np.testing.assert_array_equal(on_demand[[17, 18, 29, 30]], [[0., 0., 0.], [0., 0., 2.5],
+                                                                    [0., 0., 2.5], [0., 0., 0.]])
+        self.assertFalse(incentive_table.amounts[plans_parser.INCENTIVE_ELIGIBLE_MODES.index("drive_transit")].any())
+
+
+class IncentivesTest(unittest.TestCase):
+    """Incentives of the trips, looked up at the mode of the trips and the age and income of the persons.
+
+    """
+    def setUp(self):
+        self.incentive_table = plans_parser.parse_incentive_input(build_incentives(), MAX_AGE, MAX_INCOME)
+        self.person_df = pd.DataFrame({"Age": [70, 25, 40], "income": [19999.5, 50001., 150000.]},
+                                      index=["1", "2", "3"])
+
+    def test_incentives_of_the_trips(self):
+        trips_df = pd.DataFrame({"PID": pd.Categorical(["1", "1", "2", "2", "3", "3"]),
+                                 "realizedTripMode": ["walk_transit", "car", "OnDemand_ride", "walk_transit",
+                                                      "OnDemand_ride", "drive_transit"]})
+        trips_df = plans_parser.calc_incentives(trips_df, self.incentive_table, self.person_df)
+        self.assertEqual(trips_df["Incentive"].tolist(), [3., 0., 2.5, 1., 0., 0.])
+
+    def test_unknown_age(self):
+        trips_df = pd.DataFrame({"PID": pd.Categorical(["1", "4"]), "realizedTripMode": "walk_transit"})
+        with self.assertRaisesRegex(KeyError, "age and income of the persons \\['4'\\]"):
+            plans_parser.calc_incentives(trips_df, self.incentive_table, self.person_df)
+
+        self.person_df.loc["4"] = [MAX_AGE + 1, 10000.]
+        with self.assertRaisesRegex(KeyError, "age and income of the persons \\['4'\\]"):
+            plans_parser.calc_incentives(trips_df, self.incentive_table, self.person_df)
+
+    def test_unknown_income(self):
+        self.person_df.loc["4"] = [30, MAX_INCOME + 1.]
+        self.person_df.loc["5"] = [30, np.nan]
+        trips_df = pd.DataFrame({"PID": pd.Categorical(["1", "4", "5"]), "realizedTripMode": "OnDemand_ride"})
+        with self.assertRaisesRegex(KeyError, "age and income of the persons \\['4', '5'\\]"):
+            plans_parser.calc_incentives(trips_df, self.incentive_table, self.person_df)
+
+    def test_ineligible_trips_are_not_looked_up(self):
+        trips_df = pd.DataFrame({"PID": pd.Categorical(["4"]), "realizedTripMode": "car"})
+        trips_df = plans_parser.calc_incentives(trips_df, self.incentive_table, self.person_df)
+        self.assertEqual(trips_df["Incentive"].tolist(), [0.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+import plans_parser
+from data_parsing import load_events
+
+BUS = "siouxareametro-sd-us:t_1-0"
+
+
+def path_traversal(vehicle, driver, mode, departure, arrival, length, links, vehicle_type="BODY-TYPE-DEFAULT",
+                   passengers=0, fuel_type="food", fuel=0.):
+    return dict(time=arrival, type="PathTraversal", person=None, vehicle=vehicle, driver=driver,
+                vehicleType=vehicle_type, length=length, numPassengers=passengers, departureTime=departure,
+                arrivalTime=arrival, mode=mode, links=links, primaryFuelType=fuel_type, primaryFuel=fuel)
+
+
+def vehicle_entry(time, person, vehicle):
+    return dict(time=time, type="PersonEntersVehicle", person=person, vehicle=vehicle)
+
+
+def build_events_and_trips():
+    """Events of a walk trip, a car trip, a walk-transit trip and an on-demand ride, and the trips of the
+    `experiencedPlans.xml` file, as parsed.
+
+    """
+    events_df = pd.DataFrame([
+        path_traversal("body-1", "1", "walk", 28800, 29100, 300., "1,2"),
+        # after the end of the walk trip: not a leg
+        path_traversal("body-1", "1", "walk", 50000, 50300, 300., "1,2"),
+        path_traversal("car-2", "2", "car", 32400, 33000, 5000., "3,4", "Car", fuel_type="gasoline", fuel=100.),
+        vehicle_entry(36000, "3", "body-3"),
+        path_traversal("body-3", "3", "walk", 36000, 36300, 400., 5),
+        vehicle_entry(36400, "3", BUS),
+        # only the traversals of the bus between the entry of the person and the departure of their next leg count
+        path_traversal(BUS, "TransitDriverAgent-1", "bus", 36000, 36400, 999., 9, "BUS-DEFAULT", 0, "diesel", 5.),
+        path_traversal(BUS, "TransitDriverAgent-1", "bus", 36400, 36800, 1000., 10, "BUS-DEFAULT", 1, "diesel", 5.),
+        path_traversal(BUS, "TransitDriverAgent-1", "bus", 36800, 37200, 1500., 11, "BUS-DEFAULT", 1, "diesel", 5.),
+        path_traversal(BUS, "TransitDriverAgent-1", "bus", 37200, 37600, 700., 12, "BUS-DEFAULT", 0, "diesel", 5.),
+        path_traversal("body-3", "3", "walk", 37200, 37500, 200., 6),
+        # the ride-hail vehicle picks the person up, then drives them with a passenger on board
+        path_traversal("rideHailVehicle-1", "rideHailAgent-1", "car", 39000, 39700, 900., 19, "Car", 0, "gasoline",
+                       10.),
+        vehicle_entry(39700, "4", "rideHailVehicle-1"),
+        path_traversal("rideHailVehicle-1", "rideHailAgent-1", "car", 39700, 40300, 4000., "20,21", "Car", 1,
+                       "gasoline", 50.),
+    ], columns=plans_parser.LEGS_EVENT_COLUMNS)
+
+    trips_df = pd.DataFrame({"PID": pd.Categorical(["1", "2", "3", "4"]),
+                             "trip_ordinal": np.ones(4, dtype=np.int32),
+                             "Trip_Purpose": "Work",
+                             "Mode": ["walk", "car", "walk_transit", "OnDemand_ride"],
+                             "Start_time": ["08:00:00", "09:00:00", "10:00:00", "11:00:00"],
+                             "Duration_sec": ["00:10:00", "00:15:00", "01:00:00", "00:20:00"],
+                             "Distance_m": None,
+                             "Path_linkIds": None})
+    return events_df, trips_df
+
+
+def write_events(events_df, path):
+    """Write the events to an `events.xml` file, as BEAM does: the missing attributes are left out.
+
+    """
+    with open(str(path), "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<events version="1.0">\n')
+        for event in events_df.to_dict("records"):
+            attributes = " ".join('{}="{}"'.format(name, value) for name, value in event.items()
+                                  if not pd.isnull(value))
+            f.write("    <event {}/>\n".format(attributes))
+        f.write("</events>\n")
+
+
+class LegsTest(unittest.TestCase):
+    """Legs rebuilt by get_legs_output() from the events, compared to the legs expected from the hand-built events.
+
+    """
+    def test_legs_of_each_trip_mode(self):
+        events_df, trips_df = build_events_and_trips()
+        legs_df, path_traversals_df = plans_parser.get_legs_output(events_df, trips_df)
+
+        expected_legs_df = pd.DataFrame({
+            "PID": ["1", "2", "3", "3", "3", "4"],
+            "trip_index": [0, 1, 2, 2, 2, 3],
+            "leg_ordinal": [1, 1, 1, 2, 3, 1],
+            "Mode": ["walk", "car", "walk", "bus", "walk", "OnDemand_ride"],
+            "Veh": ["body-1", "car-2", "body-3", BUS, "body-3", "rideHailVehicle-1"],
+            "Start_time": [28800., 32400., 36000., 36400., 37200., 39700.],
+            "End_time": [29100., 33000., 36300., 37200., 37500., 40300.],
+            "Duration_sec": [300, 600, 300, 800, 300, 600],
+            "Distance_m": [300., 5000., 400., 2500., 200., 4000.],
+            "Path": ["1,2", "3,4", 5, "[10, 11]", 6, "20,21"],
+            "primaryFuel": [0., 100., 0., 0., 0., 50.],
+            "primaryFuelType": ["food", "gasoline", "food", "Diesel", "food", "gasoline"]})
+        legs_df = legs_df[expected_legs_df.columns].astype({"PID": object, "Veh": object, "leg_ordinal": np.int64})
+        pd.testing.assert_frame_equal(legs_df, expected_legs_df)
+
+        # all the path traversals with a length are kept
+        self.assertEqual(len(path_traversals_df), len(events_df[events_df["type"] == "PathTraversal"]))
+
+    def test_events_outside_the_trips_are_not_legs(self):
+        events_df, trips_df = build_events_and_trips()
+        trips_df = trips_df[trips_df["PID"] == "1"].reset_index(drop=True)
+        legs_df, _ = plans_parser.get_legs_output(events_df, trips_df)
+        self.assertEqual(legs_df["Start_time"].tolist(), [28800.])
+
+    def test_partitions_are_capped_by_the_workers(self):
+        event_index = SimpleNamespace(path_traversals_offsets=np.array([0, 600000, 1200000, 1800000]),
+                                      entries_offsets=np.zeros(4, dtype=np.int64), person_ids=["1", "2", "3"])
+        self.assertEqual(plans_parser.get_legs_partitions(event_index, max_workers=4), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(plans_parser.get_legs_partitions(event_index, max_workers=2), [(0, 2), (2, 3)])
+        self.assertEqual(plans_parser.get_legs_partitions(event_index, max_workers=1), [(0, 3)])
+
+
+class ParsedEventsLegsTest(unittest.TestCase):
+    """Legs rebuilt from the events parsed from an events file by load_events(), rather than built by hand.
+
+    """
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.folder))
+
+    def load_events(self, events_df):
+        write_events(events_df, self.folder / "0.events.xml")
+        return load_events(self.folder / "0.events.xml", plans_parser.LEGS_EVENT_TYPES,
+                           plans_parser.LEGS_EVENT_COLUMNS)
+
+    def test_legs_of_the_parsed_events(self):
+        events_df, trips_df = build_events_and_trips()
+        legs_df, _ = plans_parser.get_legs_output(self.load_events(events_df), trips_df)
+        expected_legs_df, _ = plans_parser.get_legs_output(events_df, trips_df)
+
+        # the links of the events are strings
+        self.assertEqual(legs_df["Path"].tolist(), ["1,2", "3,4", "5", "['10', '11']", "6", "20,21"])
+        columns = expected_legs_df.columns.drop("Path")
+        pd.testing.assert_frame_equal(legs_df[columns], expected_legs_df[columns], check_dtype=False)
+
+    def test_numeric_ids(self):
+        # walk and car trips only: all the drivers are persons with a numeric ID
+        events_df, trips_df = build_events_and_trips()
+        events_df = events_df[events_df["driver"].isin(["1", "2"])].replace({"vehicle": {"car-2": "2"}})
+        trips_df = trips_df[trips_df["PID"].isin(["1", "2"])].reset_index(drop=True)
+
+        legs_df, _ = plans_parser.get_legs_output(self.load_events(events_df), trips_df)
+        self.assertEqual(legs_df["Veh"].astype(str).tolist(), ["body-1", "2"])
+        self.assertEqual(legs_df["PID"].astype(str).tolist(), ["1", "2"])
+
+        # the drivers and the vehicles parsed as numbers by another reader are still the persons of the trips
+        legs_df, _ = plans_parser.get_legs_output(events_df.replace({"vehicle": {"2": 2}})
+                                                  .astype({"driver": float}), trips_df)
+        self.assertEqual(legs_df["Veh"].astype(str).tolist(), ["body-1", "2"])
+        self.assertEqual(legs_df["PID"].astype(str).tolist(), ["1", "2"])
+
+
+class MergeLegsTripsTest(unittest.TestCase):
+    """Totals of the legs added to their trips, and modes of the legs in the order they first appear in each trip.
+
+    """
+    def test_modes_of_the_legs(self):
+        trips_df = pd.DataFrame({"PID": pd.Categorical(["1", "1", "2", "3"]),
+                                 "trip_ordinal": [1, 2, 1, 1],
+                                 "Trip_Purpose": "Work",
+                                 "Mode": ["walk_transit", "walk_transit", "car", "OnDemand_ride"]})
+        legs_df = pd.DataFrame({"trip_index": [0, 0, 0, 1, 1, 1, 3, 3],
+                                "Mode": ["bus", "walk", "bus", "walk", "bus", "walk", "walk", "OnDemand_ride"],
+                                "Duration_sec": [600, 60, 300, 120, 600, 120, 60, 600],
+                                "Distance_m": [1000., 50., 500., 100., 1000., 100., 50., 4000.],
+                                "primaryFuel": 0.,
+                                "FuelCost": 0.,
+                                "Fare": [1.5, 0., 1.5, 0., 1.5, 0., 0., 7.],
+                                "Start_time": [0., 600., 660., 0., 120., 720., 0., 60.],
+                                "End_time": [600., 660., 960., 120., 720., 840., 60., 660.]})
+        merged_trips = plans_parser.merge_legs_trips(legs_df, trips_df)
+
+        self.assertEqual(merged_trips.index.tolist(), [0, 1, 3])
+        self.assertEqual(merged_trips["legModes"].tolist(), ["['bus' 'walk']", "['walk' 'bus']",
+                                                             "['walk' 'OnDemand_ride']"])
+        self.assertEqual(merged_trips["realizedTripMode"].tolist(), ["walk_transit", "walk_transit", "OnDemand_ride"])
+        self.assertEqual(merged_trips["Fare"].tolist(), [1.5, 1.5, 7.])
+        self.assertEqual(merged_trips["Duration_sec"].tolist(), [960, 840, 660])
+        self.assertEqual(merged_trips["End_time"].tolist(), [960., 840., 660.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import sys
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+from range_parsing import add_range_columns, parse_ranges
+
+
+class ParseRangesTest(unittest.TestCase):
+    """Bounds of the ranges of the submission inputs, with inclusive brackets and exclusive parentheses.
+
+    """
+    def test_bracket_types(self):
+        bounds = parse_ranges(pd.Series(["[0:120]", "(10:30]", "[10:30)", "(10:30)"], index=[3, 5, 7, 9]))
+        expected_bounds = pd.DataFrame({"lower": [0, 10, 10, 10],
+                                        "upper": [120, 30, 30, 30],
+                                        "min": [0, 11, 10, 11],
+                                        "max": [120, 30, 29, 29]}, index=[3, 5, 7, 9])
+        pd.testing.assert_frame_equal(bounds, expected_bounds)
+
+    def test_negative_bounds_and_whitespace(self):
+        bounds = parse_ranges(pd.Series([" ( -1 : 5 ] ", "[-10:-2)"]))
+        self.assertEqual(bounds["min"].tolist(), [0, -10])
+        self.assertEqual(bounds["max"].tolist(), [5, -3])
+
+    def test_invalid_ranges(self):
+        for invalid in ["0:120", "[0-120]", "[a:b]", "[0:120", "{0:120}", None]:
+            with self.assertRaisesRegex(ValueError, "Invalid ranges"):
+                parse_ranges(pd.Series(["[0:120]", invalid]))
+
+
+class AddRangeColumnsTest(unittest.TestCase):
+    """Range columns added to the input dataframes, once.
+
+    """
+    def test_range_columns(self):
+        df = add_range_columns(pd.DataFrame({"age": ["[0:120]", "(64:120]"]}), "age")
+        self.assertEqual(df["min_age"].tolist(), [0, 64])
+        self.assertEqual(df["max_age"].tolist(), [120, 120])
+        self.assertEqual(df["age_interval"].tolist(), [pd.Interval(0, 120, closed="both"),
+                                                       pd.Interval(65, 120, closed="both")])
+
+    def test_ranges_are_parsed_once(self):
+        df = add_range_columns(pd.DataFrame({"age": ["[0:120]", "(64:120]"]}), "age")
+        # already parsed: the columns are kept as they are
+        df.loc[0, "age"] = "invalid"
+        self.assertIs(add_range_columns(df, "age"), df)
+        self.assertEqual(df["min_age"].tolist(), [0, 64])
+
+        # incomplete columns, e.g. after rows were appended: parsed again
+        df.loc[0, "age"] = "[18:30)"
+        df.loc[2] = ["[0:5]", None, None, None]
+        add_range_columns(df, "age")
+        self.assertEqual(df["min_age"].tolist(), [18, 64, 0])
+        self.assertEqual(df["max_age"].tolist(), [30, 120, 5])
+        self.assertEqual(df["age_interval"].tolist()[0], pd.Interval(18, 29, closed="both"))
+
+
+if __name__ == '__main__':
+    unittest.main()
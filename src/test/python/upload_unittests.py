@@ -0,0 +1,70 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "main" / "python" / "post_processing"))
+try:
+    import boto3
+    import moto
+    import beam_events_processing
+except ImportError:
+    boto3 = None
+
+BUCKET = "bistro-test-output"
+
+
+@unittest.skipUnless(boto3 is not None, "boto3 and moto are required to test the uploads")
+class UploadResultsTest(unittest.TestCase):
+    """Uploads of the dataframe files to a mocked s3 bucket.
+
+    """
+    def setUp(self):
+        for name in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"]:
+            os.environ[name] = "testing"
+        mock = moto.mock_aws() if hasattr(moto, "mock_aws") else moto.mock_s3()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3_client = boto3.client("s3", region_name="us-east-1")
+        self.s3_client.create_bucket(Bucket=BUCKET)
+
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.folder))
+        (self.folder / "trips_dataframe.csv").write_text("Trip_ID,PID\n1_t-1,1\n")
+        (self.folder / "modeChoice.csv").write_text("not uploaded")
+        # leftover of an interrupted export
+        (self.folder / "legs_dataframe.tmp").write_text("not uploaded")
+
+    def upload(self, compress=False):
+        return beam_events_processing.upload_results(self.folder, "run/output/", BUCKET, self.s3_client,
+                                                     compress=compress)
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(self.upload(), ["trips_dataframe.csv"])
+        self.assertEqual(self.upload(), [])
+
+        (self.folder / "trips_dataframe.csv").write_text("Trip_ID,PID\n2_t-1,2\n")
+        self.assertEqual(self.upload(), ["trips_dataframe.csv"])
+        body = self.s3_client.get_object(Bucket=BUCKET, Key="run/output/trips_dataframe.csv")["Body"].read()
+        self.assertEqual(body, b"Trip_ID,PID\n2_t-1,2\n")
+
+    def test_multipart_files_are_skipped(self):
+        # larger than a part: the ETag of the object is the checksum of the checksums of its parts
+        with open(str(self.folder / "legs_dataframe.csv"), "wb") as f:
+            f.write(os.urandom(beam_events_processing.MULTIPART_CHUNK_SIZE + 1024))
+        self.assertEqual(self.upload(), ["legs_dataframe.csv", "trips_dataframe.csv"])
+        self.assertEqual(self.upload(), [])
+
+    def test_compressed_files(self):
+        self.assertEqual(self.upload(compress=True), ["trips_dataframe.csv"])
+        body = self.s3_client.get_object(Bucket=BUCKET, Key="run/output/trips_dataframe.csv.gz")["Body"].read()
+        self.assertEqual(gzip.decompress(body), b"Trip_ID,PID\n1_t-1,1\n")
+        # the archives of the same file are identical
+        self.assertEqual(self.upload(compress=True), [])
+
+
+if __name__ == '__main__':
+    unittest.main()